@@ -5,6 +5,8 @@ import sys
 
 import dotenv
 from agents.pre_processing_agent import PreProcessingAgent
+from core.embeddings import EMBEDDERS
+from core.embeddings import get_embedder
 from core.retreival import PuzzleRetreival
 from loguru import logger
 from models.gemini_model import GeminiLanguageModel
@@ -62,11 +64,21 @@ def _parse_args() -> argparse.Namespace:
         type=str,
         help='Database connection string (psycopg2 format)',
     )
+    parser.add_argument(
+        '--embedder',
+        type=str,
+        default='openai',
+        choices=EMBEDDERS,
+        help='The embedder for the puzzles (hashing is local/offline)',
+    )
     dotenv.load_dotenv()
     return parser.parse_args()
 
 
-def _setup_retrieval_system(db_connection: str) -> PuzzleRetreival:
+def _setup_retrieval_system(
+    db_connection: str,
+    embedder_name: str,
+) -> PuzzleRetreival:
     model = GeminiLanguageModel(
         api_key=os.getenv('GEMINI_API_KEY'),
         model_name='gemini-2.0-flash',
@@ -77,8 +89,8 @@ def _setup_retrieval_system(db_connection: str) -> PuzzleRetreival:
     )
     return PuzzleRetreival(
         connection_string=db_connection,
-        openai_key=os.getenv('OPENAI_API_KEY'),
         pre_processing_agent=agent,
+        embedder=get_embedder(embedder_name, os.getenv('OPENAI_API_KEY')),
     )
 
 
@@ -108,8 +120,15 @@ def _process_puzzle(
 
 def _main() -> int:
     args = _parse_args()
-    retrieval = _setup_retrieval_system(args.db)
+    retrieval = _setup_retrieval_system(args.db, args.embedder)
     retrieval.init_db()
+    # Puzzles added before the embeddings were stored per field
+    backfilled = retrieval.backfill_field_embeddings()
+    if backfilled:
+        tqdm.write(f'Added field embeddings for {backfilled} puzzles')
+    backfilled = retrieval.backfill_tags()
+    if backfilled:
+        tqdm.write(f'Added tags for {backfilled} puzzles')
 
     puzzle_paths = get_puzzle_paths(args.puzzle_dir)
     for puzzle_path in tqdm(puzzle_paths):
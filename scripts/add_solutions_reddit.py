@@ -15,6 +15,8 @@ PROJECT_ROOT = os.path.join(
 )
 sys.path.append(PROJECT_ROOT)
 
+from core.embeddings import EMBEDDERS  # NOQA
+from core.embeddings import get_embedder  # NOQA
 from core.retreival import PuzzleRetreival  # NOQA
 from core.retreival import SolutionData  # NOQA
 
@@ -49,6 +51,13 @@ def _main() -> int:
         type=str,
         help='Only add solutions with the given langauge to the database.',
     )
+    parser.add_argument(
+        '--embedder',
+        type=str,
+        default='openai',
+        choices=EMBEDDERS,
+        help='The embedder the database was created with.',
+    )
     args = parser.parse_args()
 
     loguru.logger.remove()
@@ -58,10 +67,17 @@ def _main() -> int:
 
     retreival = PuzzleRetreival(
         connection_string=args.db,
-        openai_key=os.getenv('OPENAI_API_KEY'),
+        embedder=get_embedder(args.embedder, os.getenv('OPENAI_API_KEY')),
     )
 
     retreival.init_db()
+    # Solutions added before the code was hashed
+    updated, removed = retreival.backfill_solution_hashes()
+    if updated or removed:
+        print(
+            f'Hashed {updated} existing solutions, '
+            f'removed {removed} duplicates',
+        )
 
     with open(args.json_file, 'r') as f:
         solutions = json.load(f)
@@ -85,6 +101,7 @@ def _main() -> int:
             source='reddit',
             puzzle_day=solution['puzzle_day'],
             puzzle_year=solution['puzzle_year'],
+            language=solution.get('language'),
         )
 
         ret = retreival.add_solution(sol_data)
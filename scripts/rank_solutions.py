@@ -0,0 +1,149 @@
+import argparse
+import os
+import sys
+
+import dotenv
+import loguru
+from tqdm import tqdm
+
+
+PROJECT_ROOT = os.path.join(
+    os.path.dirname(
+        os.path.abspath(__file__),
+    ), '../src/',
+)
+sys.path.append(PROJECT_ROOT)
+
+from agents.retreival_agent import DEFAULT_SOLUTION_TOKEN_BUDGET  # NOQA
+from agents.retreival_agent import RetrievalAgent  # NOQA
+from core.embeddings import EMBEDDERS  # NOQA
+from core.embeddings import get_embedder  # NOQA
+from main import get_model  # NOQA
+from prompts.prompts import PROMPTS  # NOQA
+
+
+def _parse_args() -> argparse.Namespace:
+
+    parser = argparse.ArgumentParser(
+        description=(
+            'Rank the stored solutions of each puzzle once and store the '
+            'top solution and plan, so the retrieval agent does not have to '
+            'rank them on every run.'
+        ),
+    )
+    parser.add_argument(
+        'db',
+        type=str,
+        help='Database connection string (psycopg2 format)',
+    )
+    parser.add_argument(
+        '--version',
+        type=str,
+        default=None,
+        help=(
+            'The version tag of the ranking (default: the model and the hash '
+            'of the ranking prompt, so it changes with them)'
+        ),
+    )
+    parser.add_argument(
+        '--model',
+        type=str,
+        default='gemini-2.0-flash',
+        help='The model that ranks the solutions',
+    )
+    parser.add_argument(
+        '--limit',
+        type=int,
+        default=3,
+        help='The number of solutions of each puzzle to rank',
+    )
+    parser.add_argument(
+        '--token-budget',
+        type=int,
+        default=DEFAULT_SOLUTION_TOKEN_BUDGET,
+        help=(
+            'The maximum number of tokens of the solutions of a puzzle to '
+            'rank (as in the retrieval agent)'
+        ),
+    )
+    parser.add_argument(
+        '--embedder',
+        type=str,
+        default='openai',
+        choices=EMBEDDERS,
+        help='The embedder the database was created with.',
+    )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Re-rank puzzles that already have a ranking of the version',
+    )
+    parser.add_argument(
+        '-l', '--log-level',
+        type=str,
+        default='WARNING',
+        help='Log level (DEBUG, INFO, WARNING, ERROR, CRITICAL)',
+    )
+
+    return parser.parse_args()
+
+
+def _main() -> int:
+
+    args = _parse_args()
+
+    loguru.logger.remove()
+    loguru.logger.add(sys.stderr, level=args.log_level)
+
+    dotenv.load_dotenv()
+
+    if args.version is None:
+        prompt_hash = PROMPTS['retreival_rank_solutions'].hash
+        args.version = f'{args.model}-{prompt_hash[:12]}'
+
+    agent = RetrievalAgent(
+        'retreival',
+        model=get_model(args.model),
+        connection_string=args.db,
+        embedder=get_embedder(args.embedder, os.getenv('OPENAI_API_KEY')),
+        solution_token_budget=args.token_budget,
+    )
+    retreival = agent.puzzle_retreival
+
+    puzzles = retreival.get_puzzles(
+        unranked_version=None if args.force else args.version,
+    )
+
+    print(f'Ranking solutions of {len(puzzles)} puzzles')
+
+    ranked = 0
+    for puzzle in tqdm(puzzles):
+        assert puzzle.id is not None
+        # The same solutions as the agent would rank
+        solutions = retreival.get_solutions(
+            puzzle.year,
+            puzzle.day,
+            limit=args.limit,
+            token_budget=agent.solution_token_budget,
+        )
+        if not solutions:
+            tqdm.write(f'No solutions for puzzle {puzzle.year}-{puzzle.day}')
+            continue
+
+        ranked_solution = agent.rank_solutions(puzzle, solutions)
+        if ranked_solution is None:
+            tqdm.write(f'Could not rank puzzle {puzzle.year}-{puzzle.day}')
+            continue
+
+        retreival.add_solution_ranking(
+            puzzle.id, args.version, ranked_solution,
+        )
+        ranked += 1
+
+    print(f'Ranked {ranked} puzzles (version {args.version})')
+
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(_main())
@@ -5,7 +5,11 @@ from typing import Any
 from core.state import MainState
 from loguru import logger
 from models.base_model import BaseLanguageModel
+from prompts.prompts import PROMPT_PARTS
 from prompts.prompts import PROMPTS
+from utils.prompt_packer import DEFAULT_TOKEN_BUDGET
+from utils.prompt_packer import pack_input
+from utils.util_types import PromptParts
 
 
 class BaseAgent(ABC):
@@ -30,19 +34,67 @@ class BaseAgent(ABC):
         self.settings = settings
 
     def _get_prompt(self, prompt_name: str, **kwargs) -> str:
+        """
+        Get the full prompt.
 
-        try:
-            raw_prompt = PROMPTS.get(prompt_name, None)
-            if raw_prompt is None:
-                self.logger.warning(f'Could not find prompt {prompt_name=}')
-                return ''
-            formatted_prompt = raw_prompt.format(**kwargs)
+        Raises:
+            KeyError: If the prompt does not exist or a placeholder of the
+                prompt has no value (instead of sending an empty prompt).
+        """
+
+        return PROMPTS[prompt_name].render(**kwargs)
+
+    def _get_prompt_parts(self, prompt_name: str, **kwargs) -> PromptParts:
+        """
+        Get the prompt split into the static system prompt and the formatted
+        user prompt, so that the static part can be cached by the provider.
+
+        Args:
+            prompt_name (str): The name of the prompt.
+            **kwargs: The values for the placeholders of the prompt (the
+                values are inserted as is, braces in them are kept).
+
+        Returns:
+            PromptParts: The system and user prompt.
+
+        Raises:
+            KeyError: If the prompt does not exist or a placeholder of the
+                prompt has no value (instead of sending an empty prompt).
+        """
 
-        except KeyError as e:
-            self.logger.error(f'Missing key in prompt: {e}')
-            formatted_prompt = ''
+        static, dynamic = PROMPT_PARTS[prompt_name]
+        return PromptParts(static or None, dynamic.render(**kwargs))
 
-        return formatted_prompt
+    def _pack_input(self, inp: dict[str, Any]) -> str:
+        """
+        Create the compact json input for a prompt, with the example
+        solutions truncated/dropped to fit the token budget of the agent
+        (setting `prompt_token_budget`).
+
+        Args:
+            inp (dict[str, Any]): The prompt input.
+
+        Returns:
+            str: The json input.
+        """
+
+        packed = pack_input(
+            inp,
+            token_budget=self.settings.get(
+                'prompt_token_budget', DEFAULT_TOKEN_BUDGET,
+            ),
+        )
+        log = (
+            self.logger.info if packed.truncated or packed.dropped
+            else self.logger.debug
+        )
+        log(
+            f'Packed prompt input: {packed.tokens} tokens, '
+            f'{packed.examples} examples ({packed.truncated} truncated, '
+            f'{packed.dropped} dropped)',
+        )
+
+        return packed.json_input
 
     def _invalid_response_retry(self, state: MainState) -> MainState:
         """
@@ -67,7 +119,14 @@ class BaseAgent(ABC):
             f'Retrying {self.invalid_response_retries}/{self.max_invalid_response_retries} for {self.name}',  # noqa: E501
         )
         # Retry the agent
-        return self.process(state)
+        is_first_retry = self.invalid_response_retries == 1
+        try:
+            return self.process(state)
+        finally:
+            # Reset the counter once all retries of this call are done,
+            # so that the next call of the agent starts fresh
+            if is_first_retry:
+                self.invalid_response_retries = 0
 
     @abstractmethod
     def process(self, state: MainState) -> MainState:
@@ -1,9 +1,9 @@
 import copy
-import json
 
 from agents.base_agent import BaseAgent
 from core.state import MainState
-from utils.utils import extract_json_from_markdown
+from models.errors import ModelError
+from prompts.schemas import SCHEMAS
 
 
 class CodingAgent(BaseAgent):
@@ -13,6 +13,16 @@ class CodingAgent(BaseAgent):
         # Copy the state (passed by reference)
         state = copy.deepcopy(state)
 
+        # The code for the plan was already written while planning
+        if state.selected_plan is not None:
+            candidate = state.candidate_code.pop(
+                state.selected_plan.plan, None,
+            )
+            if candidate is not None:
+                self.logger.info('Coding Agent: Using the code of the plan')
+                state.generated_code = candidate
+                return state
+
         # Create the prompt
         inp = {
             'problem_statement': state.problem_statement,
@@ -39,44 +49,34 @@ class CodingAgent(BaseAgent):
         else:
             inp['plan'] = state.selected_plan.plan
 
-        json_input = json.dumps(inp, indent=2)
+        json_input = self._pack_input(inp)
         self.logger.debug(f'Coding Agent: {json_input}')
-        prompt = self._get_prompt('coding', json_input=json_input)
+        prompt = self._get_prompt_parts('coding', json_input=json_input)
 
         # Prompt the model
-        resp = self.model.prompt(prompt)
-
-        if not resp:
-            self.logger.warning(
-                'Coding Agent: Got no response from the model.',
+        try:
+            obj = self.model.prompt_json(
+                prompt.user,
+                SCHEMAS['coding'],
+                name='coding',
+                system=prompt.system,
+                timeout=state.remaining_time(),
             )
-            return self._invalid_response_retry(state)
+        except ModelError as e:
+            # Transient errors are already retried by the model
+            self.logger.error(f'Coding Agent: Model request failed: {e}')
+            return state
 
-        # Try to extract the json from the response
-        json_resp = extract_json_from_markdown(resp)
-        if not json_resp:
-            self.logger.debug(f'Got {json_resp=} for {resp=}')
+        if not isinstance(obj, dict):
             self.logger.warning(
-                f'Coding Agent: Could not extract json from response {resp=}',
+                f'Coding Agent: Could not get json from response {obj=}',
             )
-            state = self._invalid_response_retry(state)
-
-        try:
-            if len(json_resp) < 1:
-                self.logger.warning(
-                    f'Coding Agent: No json found in response {json_resp=}',
-                )
-                return self._invalid_response_retry(state)
-
-            obj = json.loads(json_resp[0])
-            # NOTE: Is this the correct way to indicate no code is found?
-            state.generated_code = obj.get('code')
-            if state.generated_code is None:
-                self.logger.warning('No code was found in resp json')
-                return self._invalid_response_retry(state)
+            return self._invalid_response_retry(state)
 
-        except json.JSONDecodeError as e:
-            self.logger.warning(f'Could not decode JSON, {e=}')
-            state = self._invalid_response_retry(state)
+        # NOTE: Is this the correct way to indicate no code is found?
+        state.generated_code = obj.get('code')
+        if state.generated_code is None:
+            self.logger.warning('No code was found in resp json')
+            return self._invalid_response_retry(state)
 
         return state
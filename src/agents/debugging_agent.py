@@ -9,6 +9,7 @@ from typing import NamedTuple
 from agents.base_agent import BaseAgent
 from core.state import MainState
 from models.base_model import BaseLanguageModel
+from models.errors import ModelError
 from utils.util_types import TestCase
 from utils.utils import extract_json_from_markdown
 
@@ -170,8 +171,21 @@ class DebuggingAgent(BaseAgent):
         json_inp = json.dumps(inp)
 
         # Prompt the model
-        prompt = self._get_prompt('debug_error', json_input=json_inp)
-        resp = self.model.prompt(prompt)
+        prompt = self._get_prompt_parts('debug_error', json_input=json_inp)
+        try:
+            resp = self.model.prompt_until_block(
+                prompt.user,
+                'json',
+                system=prompt.system,
+                timeout=state.remaining_time(),
+            )
+        except ModelError as e:
+            self.logger.error(f'Debug Agent: Model request failed: {e}')
+            return AnalysisResult(
+                decision=DebugDecision.NO_FIX,
+                suggestions=None,
+                fixed_code=None,
+            )
         if not resp:
             self.logger.warning('Debug Agent: Got not reponse from the model')
 
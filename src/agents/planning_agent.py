@@ -1,16 +1,23 @@
 import copy
-import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
 
 from agents.base_agent import BaseAgent
 from core.state import MainState
+from models.errors import ModelError
+from prompts.schemas import SCHEMAS
+from utils.util_types import PromptParts
 from utils.util_types import SolutionPlan
-from utils.utils import extract_json_from_markdown
 from utils.utils import extract_markdown_from_response
 
 
 class PlanningAgent(BaseAgent):
 
-    def _get_confidence_score(self, plan: str) -> float:
+    def build_confidence_prompt(self, plan: str) -> PromptParts:
+        """
+        Create the prompt to get the confidence score of a plan (the inputs
+        are set by `prepare`).
+        """
 
         # Copy the information for the prompt
         assert self.prompts_input, (
@@ -25,70 +32,95 @@ class PlanningAgent(BaseAgent):
         prompt_inp['plan'] = plan
 
         # Create the json string
-        json_inp = json.dumps(prompt_inp, indent=2)
+        json_inp = self._pack_input(prompt_inp)
 
         # Create the prompt to get the confidence for the plan
-        prompt = self._get_prompt('planning_confidence', json_input=json_inp)
-        self.logger.debug(f'Confidence prompt: {prompt}')
+        return self._get_prompt_parts(
+            'planning_confidence',
+            json_input=json_inp,
+        )
 
-        # Prompt the model and handle the response
-        ret = self.model.prompt(prompt)
-        if not ret:
-            self.logger.warning('No return from model')
-            if self.invalid_response_retries < self.max_invalid_response_retries:  # noqa: E501
-                self.logger.warning(
-                    'Retrying confidence score extraction',
-                )
-                return self._get_confidence_score(plan)
-            return 0.0
+    def parse_confidence(self, confidence_score: Any) -> float:
+        """
+        Get the confidence score from the response to the prompt of
+        `build_confidence_prompt` (0 if the response is invalid).
+        """
 
-        self.logger.debug(f'Confidence return: {ret}')
-        json_resp = extract_json_from_markdown(ret)
-        if not len(json_resp) > 0:
+        self.logger.debug(f'Confidence return: {confidence_score}')
+        if not isinstance(confidence_score, dict):
+            # The json is already repaired where possible, so another
+            # request is unlikely to be worth it
             self.logger.warning('Did not receive json back from model')
-            if self.invalid_response_retries < self.max_invalid_response_retries:  # noqa: E501
-                self.logger.warning(
-                    'Retrying confidence score extraction',
-                )
-                return self._get_confidence_score(plan)
             return 0.0
 
         try:
-            confidence_score = json.loads(json_resp[0])
-        except json.JSONDecodeError as e:
-            self.logger.warning(f'Could not decode json, {e}')
-            if self.invalid_response_retries < self.max_invalid_response_retries:  # noqa: E501
-                self.logger.warning(
-                    'Retrying confidence score extraction',
-                )
-                return self._get_confidence_score(plan)
+            return float(confidence_score.get('confidence', 0.0))
+        except (TypeError, ValueError):
+            self.logger.warning(
+                f'Invalid confidence score: {confidence_score}',
+            )
+            return 0.0
+
+    def _get_confidence_score(self, plan: str, state: MainState) -> float:
+
+        prompt = self.build_confidence_prompt(plan)
+        self.logger.debug(f'Confidence prompt: {prompt}')
+
+        # Prompt the model and handle the response
+        try:
+            confidence_score = self.model.prompt_json(
+                prompt.user,
+                SCHEMAS['planning_confidence'],
+                name='planning_confidence',
+                system=prompt.system,
+                timeout=state.remaining_time(),
+            )
+        except ModelError as e:
+            self.logger.error(f'Confidence request failed: {e}')
             return 0.0
 
-        return float(confidence_score.get('confidence', 0.0))
+        return self.parse_confidence(confidence_score)
 
     def _generate_solution_plan(
         self,
-        prompt: str,
+        prompt: PromptParts,
+        state: MainState,
+        score: bool = True,
+        retries: int = 0,
     ) -> SolutionPlan:
         """
         Generates the solution plan with the given prompt
-        and gets the confidence score.
+        and gets the confidence score (0 if `score` is False).
+
+        The retries (of empty responses) are counted per plan, so plans can
+        be generated concurrently.
         """
 
         self.logger.debug(f'Planning Agent prompt: {prompt}')
 
-        ret = self.model.prompt(prompt)
+        try:
+            ret = self.model.prompt_until_block(
+                prompt.user,
+                'markdown',
+                system=prompt.system,
+                timeout=state.remaining_time(),
+            )
+        except ModelError as e:
+            self.logger.error(f'Planning request failed: {e}')
+            return SolutionPlan('', 0)
         self.logger.debug(f'Model response: {ret}')
 
         # Check if the response is empty
         if not ret:
             self.logger.warning('Planning agent response is empty')
 
-            if self.invalid_response_retries < self.max_invalid_response_retries:  # noqa: E501
+            if retries < self.max_invalid_response_retries:
                 self.logger.warning(
                     'Retrying planning agent response',
                 )
-                return self._generate_solution_plan(prompt)
+                return self._generate_solution_plan(
+                    prompt, state, score, retries + 1,
+                )
 
             # If the response is empty, return an empty plan
             return SolutionPlan('', 0)
@@ -103,14 +135,98 @@ class PlanningAgent(BaseAgent):
             # markdown plan
             generated_plan = [ret]
 
-        conf_score = self._get_confidence_score(generated_plan[0])
+        if not score:
+            return SolutionPlan(generated_plan[0], 0.0)
+
+        conf_score = self._get_confidence_score(generated_plan[0], state)
 
         return SolutionPlan(generated_plan[0], conf_score)
 
-    def process(self, state: MainState) -> MainState:
+    def _plan_and_code(
+        self,
+        prompt: PromptParts,
+        state: MainState,
+        scoring: ThreadPoolExecutor,
+    ) -> tuple[SolutionPlan, str | None]:
+        """
+        Generate a plan and write the code for it right away, the confidence
+        score is requested at the same time as the code.
+        """
 
-        # Deepcopy is needed because the state is passed by reference
-        state = copy.deepcopy(state)
+        plan = self._generate_solution_plan(prompt, state, score=False)
+        if not plan.plan:
+            return plan, None
+
+        confidence = scoring.submit(
+            self._get_confidence_score, plan.plan, state,
+        )
+
+        # A copy per plan, so that the plans do not share the retry counter of
+        # the coding agent
+        coding_agent = copy.copy(self.settings['coding_agent'])
+        coding_state = copy.copy(state)
+        coding_state.selected_plan = plan
+        code = coding_agent.process(coding_state).generated_code
+
+        return SolutionPlan(plan.plan, confidence.result()), code
+
+    def _process_pipelined(
+        self,
+        prompt: PromptParts,
+        state: MainState,
+        n_plans: int,
+    ) -> MainState:
+        """
+        Generate the plans concurrently and code every plan as soon as it is
+        generated (setting `coding_agent`). The confidence scores only decide
+        the order in which the candidates are debugged: the selected plan is
+        the candidate with code and the highest confidence, the other plans
+        follow in that order (see `DebuggingAgent._cycle_plans`).
+        """
+
+        self.logger.info(f'Generating and coding {n_plans} plans')
+        with (
+            ThreadPoolExecutor(
+                max_workers=n_plans, thread_name_prefix='plan',
+            ) as planning,
+            ThreadPoolExecutor(
+                max_workers=n_plans, thread_name_prefix='confidence',
+            ) as scoring,
+        ):
+            futures = [
+                planning.submit(self._plan_and_code, prompt, state, scoring)
+                for _ in range(n_plans)
+            ]
+            candidates = [future.result() for future in futures]
+
+        candidates.sort(
+            key=lambda candidate: (
+                candidate[1] is not None, candidate[0].confidence,
+            ),
+            reverse=True,
+        )
+        plans = [plan for plan, _ in candidates]
+        self.logger.info(
+            f'Coded {sum(code is not None for _, code in candidates)}/'
+            f'{n_plans} plans',
+        )
+
+        state.selected_plan = plans[0] if plans else None
+        # The selected plan is not cycled to again
+        state.generated_plans = plans[1:]
+        state.candidate_code = {
+            plan.plan: code for plan, code in candidates if code is not None
+        }
+
+        return state
+
+    def prepare(self, state: MainState) -> PromptParts:
+        """
+        Set the inputs of the prompts for the puzzle of the state.
+
+        Returns:
+            PromptParts: The prompt to generate a plan.
+        """
 
         # Create the input for the prompts
         example_solutions_inp = [
@@ -132,31 +248,73 @@ class PlanningAgent(BaseAgent):
 
         # Save to state for better acess
         self.prompts_input = inp
-        json_input = json.dumps(inp, indent=2)
+        json_input = self._pack_input(inp)
 
         self.logger.trace(f'Planning Agent: {json_input=}')
 
-        step_by_step_prompt = self._get_prompt(
+        return self._get_prompt_parts(
             'planning_step_by_step',
             json_input=json_input,
         )
 
-        plans: list[SolutionPlan] = []
-        highest_plan = None
-        highest_score = 0
+    def generate_plans(self, state: MainState) -> list[SolutionPlan]:
+        """
+        Generate the plans for the puzzle of the state, without their
+        confidence scores (see `build_confidence_prompt` and
+        `apply_confidences`).
+        """
 
+        prompt = self.prepare(state)
         n_plans = self.settings.get('n_plans', 3)
-        self.logger.info(f'Generating {n_plans} plans')
+        self.logger.info(f'Generating {n_plans} unscored plans')
 
-        for i in range(n_plans):
-            self.logger.info(f'Creating plan {i+1}/{n_plans}')
-            plan = self._generate_solution_plan(step_by_step_prompt)
+        return [
+            self._generate_solution_plan(prompt, state, score=False)
+            for _ in range(n_plans)
+        ]
+
+    def apply_confidences(
+        self,
+        state: MainState,
+        plans: list[SolutionPlan],
+    ) -> MainState:
+        """
+        Set the plans (with their confidence scores) on the state and select
+        the plan with the highest confidence.
+        """
+
+        highest_plan = None
+        highest_score = 0.0
+        for plan in plans:
             if plan.confidence >= highest_score:
                 highest_score = plan.confidence
                 highest_plan = plan
-            plans.append(plan)
 
         state.selected_plan = highest_plan
         state.generated_plans = plans
 
         return state
+
+    def process(self, state: MainState) -> MainState:
+
+        # Deepcopy is needed because the state is passed by reference
+        state = copy.deepcopy(state)
+
+        step_by_step_prompt = self.prepare(state)
+
+        n_plans = self.settings.get('n_plans', 3)
+        if self.settings.get('coding_agent') is not None and n_plans > 0:
+            return self._process_pipelined(
+                step_by_step_prompt, state, n_plans,
+            )
+
+        self.logger.info(f'Generating {n_plans} plans')
+
+        plans: list[SolutionPlan] = []
+        for i in range(n_plans):
+            self.logger.info(f'Creating plan {i+1}/{n_plans}')
+            plans.append(
+                self._generate_solution_plan(step_by_step_prompt, state),
+            )
+
+        return self.apply_confidences(state, plans)
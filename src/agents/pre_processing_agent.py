@@ -1,79 +1,99 @@
 import copy
-import json
+from typing import Any
 
 from agents.base_agent import BaseAgent
 from core.state import MainState
+from models.errors import ModelError
+from prompts.schemas import SCHEMAS
+from utils.util_types import PromptParts
 from utils.util_types import TestCase
-from utils.utils import extract_json_from_markdown
 
 
 class PreProcessingAgent(BaseAgent):
 
-    def process(self, state: MainState) -> MainState:
+    def build_prompt(self, state: MainState) -> PromptParts:
+        """
+        Create the prompt for the puzzle of the state.
+        """
 
-        # Deepcopy is needed because the state is passed by reference
-        state = copy.deepcopy(state)
-
-        prompt = self._get_prompt(
+        return self._get_prompt_parts(
             'pre_processing',
             puzzle=state.puzzle.description,
         )
 
-        self.logger.debug(f'Preprocessing agent prompt: {prompt}')
-        ret = self.model.prompt(prompt)
-        self.logger.debug(f'Model response: {ret}')
+    def process(self, state: MainState) -> MainState:
 
-        # Check if the response is empty
-        if not ret:
-            self.logger.warning('Preprocessing agent response is empty')
-            return self._invalid_response_retry(state)
+        # Deepcopy is needed because the state is passed by reference
+        state = copy.deepcopy(state)
 
-        # Get the json from the markdown response
-        extracted_json = extract_json_from_markdown(ret)
-        self.logger.trace(f'Extracted {extracted_json} from response')
+        prompt = self.build_prompt(state)
 
-        # Parse the response
+        self.logger.debug(f'Preprocessing agent prompt: {prompt}')
         try:
-            response: dict = json.loads(extracted_json[0])
-
-            # Update all required fields on the state
-            required_fields = (
-                'problem_statement', 'input_format',
-                'output_format', 'constraints', 'keywords',
-                'underlying_concepts',
+            response = self.model.prompt_json(
+                prompt.user,
+                SCHEMAS['pre_processing'],
+                name='pre_processing',
+                system=prompt.system,
+                timeout=state.remaining_time(),
             )
+        except ModelError as e:
+            # Transient errors are already retried by the model
+            self.logger.error(f'Preprocessing agent request failed: {e}')
+            return state
+        self.logger.debug(f'Model response: {response}')
 
-            for required_field in required_fields:
-                value = response.get(required_field, None)
-                if value is not None:
-                    setattr(state, required_field, value)
-                else:
-                    self.logger.warning(
-                        f'Missing required_field: `{required_field}`',
-                    )
-
-            test_cases: list[dict[str, str]] | None = response.get(
-                'test_cases', None,
-            )
+        # Check if the response is empty
+        if not isinstance(response, dict):
+            self.logger.warning('Preprocessing agent response has no json')
+            return self._invalid_response_retry(state)
 
-            if test_cases is not None:
-                for test_case in test_cases:
-                    if isinstance(test_case, dict):
-                        inp = test_case.get('input')
-                        out = test_case.get('output')
-                        if inp is not None and out is not None:
-                            state.test_cases.append(TestCase(inp, out))
-                        else:
-                            self.logger.warning(
-                                'Missing input/output for test case: '
-                                f' {test_case}',
-                            )
+        return self.apply_response(state, response)
+
+    def apply_response(
+        self,
+        state: MainState,
+        response: dict[str, Any],
+    ) -> MainState:
+        """
+        Set the fields of the (json) response to the prompt of
+        `build_prompt` on the state.
+        """
+
+        # Update all required fields on the state
+        required_fields = (
+            'problem_statement', 'input_format',
+            'output_format', 'constraints', 'keywords',
+            'underlying_concepts',
+        )
+
+        for required_field in required_fields:
+            value = response.get(required_field, None)
+            if value is not None:
+                setattr(state, required_field, value)
             else:
-                state.test_cases = []
-                self.logger.warning('Missing field `test_cases`')
+                self.logger.warning(
+                    f'Missing required_field: `{required_field}`',
+                )
+
+        test_cases: list[dict[str, str]] | None = response.get(
+            'test_cases', None,
+        )
 
-        except json.JSONDecodeError as e:
-            self.logger.error(f'Error parsing JSON: {e}')
-            state = self._invalid_response_retry(state)
+        if test_cases is not None:
+            for test_case in test_cases:
+                if isinstance(test_case, dict):
+                    inp = test_case.get('input')
+                    out = test_case.get('output')
+                    if inp is not None and out is not None:
+                        state.test_cases.append(TestCase(inp, out))
+                    else:
+                        self.logger.warning(
+                            'Missing input/output for test case: '
+                            f' {test_case}',
+                        )
+        else:
+            state.test_cases = []
+            self.logger.warning('Missing field `test_cases`')
 
         return state
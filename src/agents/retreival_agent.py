@@ -1,12 +1,34 @@
 import json
 from copy import deepcopy
+from typing import Any
+from typing import NamedTuple
 
 from agents.base_agent import BaseAgent
+from core.embeddings import BaseEmbedder
+from core.retreival import PuzzleData
 from core.retreival import PuzzleRetreival
+from core.retreival import RankedSolution
+from core.retreival import SolutionData
+from core.retreival_cache import RetreivalCache
 from core.state import MainState
 from models.base_model import BaseLanguageModel
+from models.errors import ModelError
+from prompts.schemas import SCHEMAS
+from utils.util_types import PromptParts
 from utils.util_types import Puzzle
-from utils.utils import extract_json_from_markdown
+
+DEFAULT_SOLUTION_TOKEN_BUDGET = 6000
+
+
+class RankingCandidate(NamedTuple):
+    """
+    A similar puzzle with its precomputed ranking, or the solutions that
+    still have to be ranked (see `RetrievalAgent.collect_candidates`).
+    """
+
+    puzzle: PuzzleData
+    solutions: list[SolutionData]
+    ranked: RankedSolution | None
 
 
 class RetrievalAgent(BaseAgent):
@@ -15,7 +37,10 @@ class RetrievalAgent(BaseAgent):
             self,
             agent_name: str,
             model: BaseLanguageModel,
-            **settings: str | None | dict[str, float],
+            **settings: (
+                str | int | float | None | dict[str, float] | BaseEmbedder
+                | bool | RetreivalCache
+            ),
     ):
 
         super().__init__(agent_name, model, **settings)
@@ -24,10 +49,25 @@ class RetrievalAgent(BaseAgent):
         # default to 3
         self.retreival_limit = self.settings.get('limit', 3)
         self.retries = 0
+        # Maximum number of tokens of the solutions of a puzzle that are
+        # sent to the model for ranking
+        self.solution_token_budget = self.settings.get(
+            'solution_token_budget', DEFAULT_SOLUTION_TOKEN_BUDGET,
+        )
+        # Use the precomputed solution rankings of this version (if set)
+        self.ranking_version = self.settings.get('ranking_version', None)
+        # Skip the similar puzzles with a lower similarity, or a similarity
+        # more than the gap below the most similar puzzle (no gating if None)
+        self.min_similarity = self.settings.get('min_similarity', None)
+        self.max_similarity_gap = self.settings.get(
+            'max_similarity_gap', None,
+        )
 
         # Check that required settings are given
         con_string = self.settings.get('connection_string', None)
         openai_key = self.settings.get('openai_key', None)
+        # The embedder for the puzzles, defaults to the OpenAI embeddings
+        embedder = self.settings.get('embedder', None)
 
         if con_string is None:
             self.logger.error(
@@ -35,25 +75,216 @@ class RetrievalAgent(BaseAgent):
             )
             raise ValueError('Expected connection_string argument')
 
-        if openai_key is None:
+        if openai_key is None and embedder is None:
             self.logger.error(
-                'openai_key is required kwarg (setting) for RetreivalAgent ',
+                'openai_key or embedder is required kwarg (setting) '
+                'for RetreivalAgent ',
             )
-            raise ValueError('Expected openai_key argument')
+            raise ValueError('Expected openai_key or embedder argument')
 
         self.puzzle_retreival = PuzzleRetreival(
             connection_string=con_string,
             openai_key=openai_key,
             weights=self.settings.get('weights', None),
+            embedder=embedder,
+            # Fuse the vector search with tag and full text matches
+            lexical=self.settings.get('lexical', True),
+            cache=self.settings.get('cache', None),
         )
 
+        # Only queries the database the first time in this process (see
+        # `core.migrations`)
         self.puzzle_retreival.init_db()
 
-    def process(self, state: MainState) -> MainState:
+    def build_rank_prompt(
+        self,
+        puzzle: PuzzleData,
+        solutions: list[SolutionData],
+    ) -> PromptParts:
+        """
+        Create the prompt to rank the solutions of a puzzle (the solution
+        ids are the indices of the solutions, see `parse_ranking`).
+        """
+
+        inp = {
+            'problem_statement': puzzle.problem_statement,
+            'full_description': puzzle.full_description,
+            'underlying_concepts': puzzle.underlying_concepts,
+            'keywords': puzzle.keywords,
+            'solutions': [
+                {
+                    'solution_id': f'solution-{i}',
+                    'code': sol.code,
+                } for i, sol in enumerate(solutions)
+            ],
+        }
+
+        return self._get_prompt_parts(
+            'retreival_rank_solutions',
+            json_input=json.dumps(inp),
+        )
 
-        # dataclass is passed by reference
-        # so we need to deepcopy it in order to not modify the original
-        state = deepcopy(state)
+    def parse_ranking(
+        self,
+        solutions: list[SolutionData],
+        data: Any,
+    ) -> RankedSolution | None:
+        """
+        Get the top ranked solution from the response to the prompt of
+        `build_rank_prompt`.
+
+        Returns:
+            RankedSolution|None: The top ranked solution, or None if the
+                response has no valid ranking.
+        """
+
+        if not isinstance(data, dict):
+            self.logger.warning('Did not find any json in the response.')
+            return None
+
+        # Get the top ranked solution for the current puzzle
+        ranked_sols = data.get('ranked_solutions', [])
+
+        top_ranked_solution = next(
+            (
+                sol for sol in ranked_sols
+                if isinstance(sol, dict) and sol.get('rank', 0) == 1
+            ),
+            None,
+        )
+
+        if top_ranked_solution is None:
+            self.logger.error(
+                f'Could not find a top ranked solution: {ranked_sols}.',
+            )
+            return None
+
+        top_rank_id = top_ranked_solution.get('solution_id', '')
+        solution_ids = [f'solution-{i}' for i in range(len(solutions))]
+        if top_rank_id not in solution_ids:
+            self.logger.error(
+                f'Could not find a solution with the id {top_rank_id}.',
+            )
+            return None
+
+        return RankedSolution(
+            solution=solutions[solution_ids.index(top_rank_id)],
+            plan=top_ranked_solution.get('plan', ''),
+            justification=top_ranked_solution.get('justification', ''),
+        )
+
+    def rank_solutions(
+        self,
+        puzzle: PuzzleData,
+        solutions: list[SolutionData],
+        timeout: float | None = None,
+    ) -> RankedSolution | None:
+        """
+        Rank the solutions of a puzzle with the model.
+
+        Args:
+            puzzle (PuzzleData): The puzzle.
+            solutions (list[SolutionData]): The solutions of the puzzle.
+            timeout (float|None): The timeout of the model request (seconds).
+
+        Returns:
+            RankedSolution|None: The top ranked solution, or None if the
+                ranking failed.
+        """
+
+        prompt = self.build_rank_prompt(puzzle, solutions)
+
+        self.logger.debug(f'Retreival agent prompt: {prompt}')
+
+        try:
+            data = self.model.prompt_json(
+                prompt.user,
+                SCHEMAS['retreival_rank_solutions'],
+                name='retreival_rank_solutions',
+                system=prompt.system,
+                timeout=timeout,
+            )
+        except ModelError as e:
+            self.logger.error(
+                f'Ranking request failed for puzzle '
+                f'{puzzle.day}-{puzzle.year}: {e}',
+            )
+            return None
+        self.logger.debug(f'Model response: {data}')
+
+        return self.parse_ranking(solutions, data)
+
+    def _gate_puzzles(self, puzzles: list[PuzzleData]) -> list[PuzzleData]:
+        """
+        Skip the similar puzzles that are not worth ranking, before any
+        model request: puzzles without solutions and weak matches (see
+        `min_similarity` and `max_similarity_gap`). Puzzles with an unknown
+        number of solutions or similarity are kept.
+
+        Args:
+            puzzles (list[PuzzleData]): The similar puzzles.
+
+        Returns:
+            list[PuzzleData]: The puzzles to rank.
+        """
+
+        gated = [puzzle for puzzle in puzzles if puzzle.solutions != 0]
+        if len(gated) < len(puzzles):
+            self.logger.debug(
+                f'Skipping {len(puzzles) - len(gated)} similar puzzles '
+                'without solutions',
+            )
+
+        similarities = [
+            puzzle.similarity for puzzle in gated
+            if puzzle.similarity is not None
+        ]
+        if not similarities:
+            return gated
+
+        threshold = self.min_similarity
+        if self.max_similarity_gap is not None:
+            gap_threshold = max(similarities) - self.max_similarity_gap
+            threshold = (
+                gap_threshold if threshold is None
+                else max(threshold, gap_threshold)
+            )
+        if threshold is None:
+            return gated
+
+        kept: list[PuzzleData] = []
+        weak: list[PuzzleData] = []
+        for puzzle in gated:
+            if puzzle.similarity is not None and puzzle.similarity < threshold:
+                weak.append(puzzle)
+            else:
+                kept.append(puzzle)
+
+        if weak:
+            self.logger.info(
+                f'Skipping {len(weak)} weakly similar puzzles '
+                f'(similarity below {threshold:.3f}: '
+                + ', '.join(
+                    f'{puzzle.day}-{puzzle.year} {puzzle.similarity:.3f}'
+                    for puzzle in weak
+                )
+                + ')',
+            )
+
+        return kept
+
+    def collect_candidates(self, state: MainState) -> list[RankingCandidate]:
+        """
+        Get the similar puzzles with their precomputed ranking, or with the
+        solutions that still have to be ranked (puzzles without solutions
+        are skipped).
+
+        Args:
+            state (MainState): The state with the (pre-processed) puzzle.
+
+        Returns:
+            list[RankingCandidate]: The puzzles, most similar first.
+        """
 
         # Retreive all similar puzzles
         puzzles = self.puzzle_retreival.get_similar_puzzles_from_state(
@@ -62,14 +293,36 @@ class RetrievalAgent(BaseAgent):
         )
 
         self.logger.debug(f'Found {len(puzzles)} similar puzzles')
+        puzzles = self._gate_puzzles(puzzles)
+
+        # Precomputed rankings (see scripts/rank_solutions.py), the other
+        # puzzles are ranked with the model
+        rankings: dict[int, RankedSolution] = {}
+        if self.ranking_version is not None:
+            rankings = self.puzzle_retreival.get_solution_rankings(
+                puzzles, self.ranking_version,
+            )
+            self.logger.debug(
+                f'Found {len(rankings)} precomputed rankings '
+                f'(version {self.ranking_version})',
+            )
 
-        puzzles_with_solutions: list[tuple[Puzzle, str]] = []
-
+        candidates: list[RankingCandidate] = []
         for puzzle in puzzles:
+            ranked_solution = (
+                rankings.get(puzzle.id) if puzzle.id is not None else None
+            )
+            if ranked_solution is not None:
+                candidates.append(
+                    RankingCandidate(puzzle, [], ranked_solution),
+                )
+                continue
+
             puzzle_solutions = self.puzzle_retreival.get_solutions(
                 puzzle.year,
                 puzzle.day,
                 limit=self.retreival_limit,
+                token_budget=self.solution_token_budget,
             )
 
             self.logger.debug(
@@ -84,93 +337,28 @@ class RetrievalAgent(BaseAgent):
                 )
                 continue
 
-            inp = {
-                'problem_statement': puzzle.problem_statement,
-                'full_description': puzzle.full_description,
-                'underlying_concepts': puzzle.underlying_concepts,
-                'keywords': puzzle.keywords,
-                'solutions': [
-                    {
-                        'solution_id': f'solution-{i}',
-                        'code': sol.code,
-                    } for i, sol in enumerate(puzzle_solutions)
-                ],
-            }
+            candidates.append(RankingCandidate(puzzle, puzzle_solutions, None))
 
-            prompt = self._get_prompt(
-                'retreival_rank_solutions',
-                json_input=json.dumps(inp),
-            )
-
-            self.logger.debug(f'Retreival agent prompt: {prompt}')
+        return candidates
 
-            ret = self.model.prompt(prompt)
-            self.logger.debug(f'Model response: {ret}')
-
-            if not ret:
-                self.logger.warning('RetreivalAgent response is empty')
-                continue
-
-            # Extract json
-            extracted = extract_json_from_markdown(ret)
-            try:
-                if not extracted:
-                    self.logger.warning(
-                        'Did not find any json in the response',
-                    )
-                    return self._invalid_response_retry(state)
-                if len(extracted) < 1:
-                    self.logger.warning(
-                        f'Did not find any json in the response, {extracted=}',
-                    )
-                    return self._invalid_response_retry(state)
-                data = json.loads(extracted[0])
-                self.logger.trace(f'Extracted {extracted} json from response')
-            except json.JSONDecodeError as e:
-                self.logger.warning(f'Could not decode json: {e=}')
-                return self._invalid_response_retry(state)
-            except Exception as e:
-                self.logger.warning(f'Could not decode json: {e=}')
-                return self._invalid_response_retry(state)
-
-            # Get the top ranked solution for the current puzzle
-            ranked_sols = data.get('ranked_solutions', [])
-
-            top_ranked_solution = next(
-                (sol for sol in ranked_sols if sol.get('rank', 0) == 1),
-                None,
-            )
-
-            if top_ranked_solution is None:
-                self.logger.error(
-                    'Could not find a top ranked solution: ', ranked_sols,
-                )
-                return self._invalid_response_retry(state)
-
-            top_rank_id = top_ranked_solution.get('solution_id', '')
-            top_rank_plan = top_ranked_solution.get('plan', '')
-
-            top_solution_code = list(
-                filter(
-                    lambda x: x['solution_id'] ==
-                    top_rank_id, inp['solutions'],
-                ),
-            )
-
-            if len(top_solution_code) < 1:
-                self.logger.error(
-                    'Could not find a solution with the given id',
-                    top_rank_id,
-                )
-                return self._invalid_response_retry(state)
-
-            top_solution_code = top_solution_code[0]
+    def apply_rankings(
+        self,
+        state: MainState,
+        ranked: list[tuple[PuzzleData, RankedSolution]],
+    ) -> MainState:
+        """
+        Set the top ranked solutions of the similar puzzles as the examples
+        of the state.
+        """
 
+        puzzles_with_solutions: list[tuple[Puzzle, str]] = []
+        for puzzle, ranked_solution in ranked:
             self.logger.debug(
                 (
                     'Top ranked solution for puzzle '
                     f'{puzzle.day}-{puzzle.year} is '
-                    f'{top_solution_code} with plan {top_rank_plan}'
+                    f'{ranked_solution.solution} with plan '
+                    f'{ranked_solution.plan}'
                 ),
             )
 
@@ -178,14 +366,40 @@ class RetrievalAgent(BaseAgent):
                 (
                     Puzzle(
                         description=puzzle.full_description,
-                        solution=top_solution_code,
+                        solution=ranked_solution.solution.code,
                         year=puzzle.year,
                         day=puzzle.day,
                     ),
-                    top_rank_plan,
+                    ranked_solution.plan,
                 ),
             )
 
         state.retreived_puzzles = puzzles_with_solutions
 
         return state
+
+    def process(self, state: MainState) -> MainState:
+
+        # dataclass is passed by reference
+        # so we need to deepcopy it in order to not modify the original
+        state = deepcopy(state)
+
+        ranked: list[tuple[PuzzleData, RankedSolution]] = []
+        for candidate in self.collect_candidates(state):
+            ranked_solution = candidate.ranked or self.rank_solutions(
+                candidate.puzzle,
+                candidate.solutions,
+                timeout=state.remaining_time(),
+            )
+            if ranked_solution is None:
+                # Keep the puzzles that were already ranked
+                self.logger.warning(
+                    f'Could not rank the solutions for puzzle '
+                    f'{candidate.puzzle.day}-{candidate.puzzle.year}. '
+                    'Skipping...',
+                )
+                continue
+
+            ranked.append((candidate.puzzle, ranked_solution))
+
+        return self.apply_rankings(state, ranked)
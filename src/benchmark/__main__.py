@@ -0,0 +1,540 @@
+import argparse
+import os
+import sys
+from datetime import datetime
+
+import pandas as pd
+from benchmark.batch import run_batched
+from benchmark.loadtest import run_loadtest
+from benchmark.mock_server import Latency
+from benchmark.mock_server import load_fixtures
+from benchmark.mock_server import MockServer
+from benchmark.report import check_results_path
+from benchmark.report import compare
+from benchmark.report import load_results
+from benchmark.report import results_frame
+from benchmark.report import summarize
+from benchmark.report import write_results
+from benchmark.runner import load_configs
+from benchmark.runner import load_prices
+from benchmark.runner import recording_factory
+from benchmark.runner import replay_factory
+from benchmark.runner import run_matrix
+from benchmark.runner import RunConfig
+from benchmark.startup import measure_startup
+from benchmark.suite import DEFAULT_TEST_DATA
+from benchmark.suite import load_suite
+from core.embeddings import EMBEDDERS
+from core.retreival_cache import RetreivalCache
+from dotenv import load_dotenv
+from loguru import logger
+from main import get_model
+from models.batch import create_batch_backend
+from models.recording import RecordingStore
+
+
+def _parse_args() -> argparse.Namespace:
+
+    parser = argparse.ArgumentParser(
+        'benchmark',
+        description='Benchmark the system on the Advent of Code test data',
+    )
+    parser.add_argument(
+        '-l', '--log-level',
+        type=str,
+        default='WARNING',
+        choices=['TRACE', 'DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+        help='Set the logging level',
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser(
+        'run', help='Run a matrix of configurations on the test data',
+    )
+    run_parser.add_argument(
+        '--models',
+        type=str,
+        nargs='*',
+        default=[],
+        help='Default models to run (one configuration per model)',
+    )
+    run_parser.add_argument(
+        '--configs',
+        type=str,
+        help='A json file with the configurations to run',
+    )
+    run_parser.add_argument(
+        '--disable-agents',
+        type=str,
+        nargs='*',
+        default=[],
+        choices=['preprocess', 'retreival', 'planning', 'coding', 'debugging'],
+        help='The agents to disable (for the --models configurations)',
+    )
+    run_parser.add_argument(
+        '--embedder',
+        type=str,
+        default='openai',
+        choices=EMBEDDERS,
+        help='The embedder for the retrieval agent (for --models)',
+    )
+    run_parser.add_argument(
+        '--ranking-version',
+        type=str,
+        help='Use the precomputed solution rankings (for --models)',
+    )
+    run_parser.add_argument(
+        '--time-budget',
+        type=float,
+        help='The time budget per puzzle in seconds (for --models)',
+    )
+    run_parser.add_argument(
+        '--pipeline-coding',
+        action='store_true',
+        help='Code every plan as soon as it is generated (for --models)',
+    )
+    run_parser.add_argument(
+        '--retreival-cache',
+        type=str,
+        help=(
+            'Directory to cache the retrieval results in, shared by the '
+            'runs (default: not cached)'
+        ),
+    )
+    run_parser.add_argument(
+        '--share-retreival-cache',
+        action='store_true',
+        help=(
+            'Share the retrieval results between the runs in memory (if '
+            'there is no --retreival-cache)'
+        ),
+    )
+    run_parser.add_argument(
+        '--days',
+        type=int,
+        nargs='*',
+        help='The days to run (default: all)',
+    )
+    run_parser.add_argument(
+        '--test-data',
+        type=str,
+        default=DEFAULT_TEST_DATA,
+        help='The test data directory',
+    )
+    run_parser.add_argument(
+        '--workers',
+        type=int,
+        default=4,
+        help='The number of puzzles solved at the same time',
+    )
+    run_parser.add_argument(
+        '--repeats',
+        type=int,
+        default=1,
+        help='The number of times each puzzle is solved',
+    )
+    run_parser.add_argument(
+        '--prices',
+        type=str,
+        help='A json file with the model prices (USD per million tokens)',
+    )
+    recording_group = run_parser.add_mutually_exclusive_group()
+    recording_group.add_argument(
+        '--record',
+        type=str,
+        help='Record the model requests and responses in this sqlite file',
+    )
+    recording_group.add_argument(
+        '--replay',
+        type=str,
+        help='Replay the model responses recorded in this file (offline)',
+    )
+    run_parser.add_argument(
+        '--replay-latency',
+        type=float,
+        default=0.0,
+        help=(
+            'Simulate this fraction of the recorded latency when replaying '
+            '(0: no latency, 1: the recorded latency)'
+        ),
+    )
+    run_parser.add_argument(
+        '--batch',
+        type=str,
+        choices=['local', 'provider'],
+        help=(
+            'Send the preprocessing, ranking and confidence requests as '
+            'batch jobs (provider: the batch API of OpenAI/Anthropic, local: '
+            'a simulated batch service)'
+        ),
+    )
+    run_parser.add_argument(
+        '--batch-poll-interval',
+        type=float,
+        help='The seconds between the status checks of the batch jobs',
+    )
+    run_parser.add_argument(
+        '--output',
+        type=str,
+        default=(
+            'experiments/results/benchmark/'
+            f'benchmark-{datetime.now():%Y%m%d-%H%M%S}.csv'
+        ),
+        help='The results file (.csv or .parquet)',
+    )
+    run_parser.add_argument(
+        '--compare',
+        type=str,
+        help='A previous results file to compare against',
+    )
+    run_parser.add_argument(
+        '--fail-on-regression',
+        action='store_true',
+        help='Exit with status 1 if there are regressions',
+    )
+
+    compare_parser = subparsers.add_parser(
+        'compare', help='Compare two results files',
+    )
+    compare_parser.add_argument('current', type=str)
+    compare_parser.add_argument('previous', type=str)
+    compare_parser.add_argument(
+        '--fail-on-regression',
+        action='store_true',
+        help='Exit with status 1 if there are regressions',
+    )
+
+    loadtest_parser = subparsers.add_parser(
+        'loadtest',
+        help=(
+            'Load test the pipeline against a local mock of the model API '
+            '(no network)'
+        ),
+    )
+    loadtest_parser.add_argument(
+        '--runs',
+        type=int,
+        default=100,
+        help='The number of puzzles to solve',
+    )
+    loadtest_parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=16,
+        help='The number of puzzles solved at the same time',
+    )
+    loadtest_parser.add_argument(
+        '--disable-agents',
+        type=str,
+        nargs='*',
+        default=['retreival'],
+        choices=['preprocess', 'retreival', 'planning', 'coding', 'debugging'],
+        help='The agents to disable (default: retreival, it needs the db)',
+    )
+    loadtest_parser.add_argument(
+        '--days',
+        type=int,
+        nargs='*',
+        help='The days to solve (default: all)',
+    )
+    loadtest_parser.add_argument(
+        '--test-data',
+        type=str,
+        default=DEFAULT_TEST_DATA,
+        help='The test data directory',
+    )
+    loadtest_parser.add_argument(
+        '--pipeline-coding',
+        action='store_true',
+        help='Code every plan as soon as it is generated',
+    )
+    _add_mock_server_arguments(loadtest_parser)
+
+    startup_parser = subparsers.add_parser(
+        'startup',
+        help='Measure the cold start (import) time with -X importtime',
+    )
+    startup_parser.add_argument(
+        '--module',
+        type=str,
+        default='main',
+        help='The module to import (default: the CLI)',
+    )
+    startup_parser.add_argument(
+        '--runs',
+        type=int,
+        default=5,
+        help='The number of fresh interpreters to measure',
+    )
+    startup_parser.add_argument(
+        '--top',
+        type=int,
+        default=15,
+        help='The number of slowest imports to show',
+    )
+    startup_parser.add_argument(
+        '--output',
+        type=str,
+        help='Append the result to this csv file (to track it over time)',
+    )
+    startup_parser.add_argument(
+        '--max-ms',
+        type=float,
+        help='Exit with status 1 if the median import time is higher',
+    )
+
+    mock_server_parser = subparsers.add_parser(
+        'mock-server',
+        help=(
+            'Serve the mock of the model API (e.g. for OPENAI_BASE_URL), '
+            'until interrupted'
+        ),
+    )
+    mock_server_parser.add_argument(
+        '--host',
+        type=str,
+        default='127.0.0.1',
+        help='The host to listen on',
+    )
+    mock_server_parser.add_argument(
+        '--port',
+        type=int,
+        default=8000,
+        help='The port to listen on',
+    )
+    _add_mock_server_arguments(mock_server_parser)
+
+    return parser.parse_args()
+
+
+def _add_mock_server_arguments(parser: argparse.ArgumentParser) -> None:
+
+    parser.add_argument(
+        '--latency',
+        type=float,
+        default=0.5,
+        help='The median latency of a model request (seconds)',
+    )
+    parser.add_argument(
+        '--latency-sigma',
+        type=float,
+        default=0.5,
+        help='The spread of the (log-normal) latency, 0 for constant',
+    )
+    parser.add_argument(
+        '--rate-limit-rate',
+        type=float,
+        default=0.0,
+        help='The fraction of requests that fail with 429',
+    )
+    parser.add_argument(
+        '--server-error-rate',
+        type=float,
+        default=0.0,
+        help='The fraction of requests that fail with 500',
+    )
+    parser.add_argument(
+        '--fixtures',
+        type=str,
+        help='A json file with scripted responses, see `load_fixtures`',
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        help='Seed for the latencies and injected errors',
+    )
+
+
+def _report_regressions(
+    current: pd.DataFrame,
+    previous: pd.DataFrame,
+    fail: bool,
+) -> None:
+
+    regressions = compare(current, previous)
+    if regressions.empty:
+        print('No regressions')
+        return
+
+    print('Regressions:')
+    print(regressions.to_string(index=False))
+    if fail:
+        sys.exit(1)
+
+
+def _run(args: argparse.Namespace) -> None:
+
+    configs = [
+        RunConfig(
+            name=model,
+            default_model=model,
+            disabled_agents=tuple(args.disable_agents),
+            embedder=args.embedder,
+            ranking_version=args.ranking_version,
+            time_budget=args.time_budget,
+            pipeline_coding=args.pipeline_coding,
+        )
+        for model in args.models
+    ]
+    if args.configs:
+        configs.extend(load_configs(args.configs))
+    if not configs:
+        raise SystemExit('No configurations, use --models and/or --configs')
+
+    # Fail before the runs, not when their results are written
+    try:
+        check_results_path(args.output)
+        if args.compare:
+            check_results_path(args.compare)
+    except ValueError as e:
+        raise SystemExit(str(e)) from None
+
+    puzzles = load_suite(args.test_data, days=args.days)
+    prices = load_prices(args.prices) if args.prices else None
+
+    model_factory = get_model
+    if args.record:
+        model_factory = recording_factory(RecordingStore(args.record))
+    elif args.replay:
+        model_factory = replay_factory(
+            RecordingStore(args.replay), args.replay_latency,
+        )
+
+    retreival_cache = None
+    if args.retreival_cache:
+        retreival_cache = RetreivalCache(args.retreival_cache)
+    elif args.share_retreival_cache:
+        retreival_cache = RetreivalCache()
+
+    if args.batch:
+        results = []
+        # The stages of a configuration are batched over all puzzles, the
+        # configurations run one after the other
+        for config in configs:
+            results.extend(
+                run_batched(
+                    config,
+                    puzzles,
+                    lambda model_name: create_batch_backend(
+                        args.batch,
+                        model_name,
+                        model_factory,
+                        poll_interval=args.batch_poll_interval,
+                    ),
+                    repeats=args.repeats,
+                    workers=args.workers,
+                    prices=prices,
+                    model_factory=model_factory,
+                    retreival_cache=retreival_cache,
+                ),
+            )
+    else:
+        results = run_matrix(
+            configs,
+            puzzles,
+            workers=args.workers,
+            repeats=args.repeats,
+            prices=prices,
+            model_factory=model_factory,
+            retreival_cache=retreival_cache,
+        )
+
+    df = results_frame(results)
+    write_results(df, args.output)
+    logger.success(f'Results written to {args.output}')
+    print(summarize(df).to_string())
+
+    if args.compare:
+        _report_regressions(
+            df, load_results(args.compare), args.fail_on_regression,
+        )
+
+
+def _mock_server(
+    args: argparse.Namespace,
+    host: str = '127.0.0.1',
+    port: int = 0,
+) -> MockServer:
+
+    return MockServer(
+        host,
+        port,
+        fixtures=load_fixtures(args.fixtures) if args.fixtures else None,
+        latency=Latency(args.latency, args.latency_sigma),
+        rate_limit_rate=args.rate_limit_rate,
+        server_error_rate=args.server_error_rate,
+        seed=args.seed,
+    )
+
+
+def _startup(args: argparse.Namespace) -> None:
+
+    result = measure_startup(args.module, runs=args.runs, top=args.top)
+    print(result)
+
+    if args.output:
+        row = pd.DataFrame(
+            [
+                {
+                    'time': datetime.now().isoformat(timespec='seconds'),
+                    'module': result.module,
+                    'runs': result.runs,
+                    'median_ms': result.median_ms,
+                    'min_ms': result.min_ms,
+                    'max_ms': result.max_ms,
+                },
+            ],
+        )
+        row.to_csv(
+            args.output,
+            mode='a',
+            header=not os.path.exists(args.output),
+            index=False,
+        )
+
+    if args.max_ms is not None and result.median_ms > args.max_ms:
+        logger.error(
+            f'Import time {result.median_ms:.1f}ms is over {args.max_ms}ms',
+        )
+        sys.exit(1)
+
+
+def _loadtest(args: argparse.Namespace) -> None:
+
+    puzzles = load_suite(args.test_data, days=args.days)
+    with _mock_server(args) as server:
+        result = run_loadtest(
+            server,
+            puzzles,
+            runs=args.runs,
+            concurrency=args.concurrency,
+            disabled_agents=tuple(args.disable_agents),
+            pipeline_coding=args.pipeline_coding,
+        )
+
+    print(result)
+
+
+if __name__ == '__main__':
+
+    args = _parse_args()
+
+    load_dotenv()
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    if args.command == 'run':
+        _run(args)
+    elif args.command == 'startup':
+        _startup(args)
+    elif args.command == 'loadtest':
+        _loadtest(args)
+    elif args.command == 'mock-server':
+        _mock_server(args, args.host, args.port).serve_forever()
+    elif args.command == 'compare':
+        _report_regressions(
+            load_results(args.current),
+            load_results(args.previous),
+            args.fail_on_regression,
+        )
@@ -0,0 +1,400 @@
+import copy
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any
+
+from agents.base_agent import BaseAgent
+from agents.planning_agent import PlanningAgent
+from agents.pre_processing_agent import PreProcessingAgent
+from benchmark.runner import AGENT_NAMES
+from benchmark.runner import build_run_agents
+from benchmark.runner import build_run_result
+from benchmark.runner import initial_state
+from benchmark.runner import Prices
+from benchmark.runner import RunConfig
+from benchmark.runner import RunResult
+from benchmark.runner import solve_run
+from benchmark.suite import BenchmarkPuzzle
+from core.retreival_cache import RetreivalCache
+from core.state import MainState
+from loguru import logger
+from main import get_model
+from models.base_model import BaseLanguageModel
+from models.batch import BaseBatchBackend
+from models.batch import BatchRequest
+from models.batch import BatchResult
+from models.errors import ModelError
+from prompts.schemas import SCHEMAS
+from utils.util_types import AgentSettings
+from utils.util_types import PromptParts
+from utils.util_types import SolutionPlan
+
+# The agents with batched requests (in execution order), the agents after
+# them run with regular requests
+BATCH_STAGES = ('preprocess', 'retreival', 'planning')
+
+
+@dataclass
+class _BatchRun:
+    """
+    A run of a puzzle in a batched sweep.
+    """
+
+    puzzle: BenchmarkPuzzle
+    repeat: int
+    agents_models: dict[str, BaseLanguageModel]
+    agents: tuple[tuple[BaseAgent, AgentSettings], ...]
+    state: MainState
+    error: str | None = None
+
+    def agent(self, agent_name: str) -> BaseAgent | None:
+        """
+        The agent if it is enabled and the run did not fail.
+        """
+
+        if self.error is not None:
+            return None
+
+        for agent, settings in self.agents:
+            if agent.name == agent_name and settings.enabled:
+                return agent
+        return None
+
+    def fail(self, stage: str, error: Exception) -> None:
+
+        logger.exception(
+            f'Run {self.puzzle.year}-{self.puzzle.day} failed in '
+            f'{stage}: {error}',
+        )
+        self.error = f'{type(error).__name__}: {error}'
+
+
+def _request(custom_id: str, prompt: PromptParts, name: str) -> BatchRequest:
+    return BatchRequest(custom_id, prompt.user, SCHEMAS[name], name,
+                        prompt.system)
+
+
+def _run_batch(
+    backend: BaseBatchBackend,
+    batch: list[BatchRequest],
+) -> dict[str, BatchResult]:
+    """
+    Run the batch job, a failed job (e.g. timed out) fails all its requests
+    (so they fall back to regular requests).
+    """
+
+    try:
+        return backend.run(batch)
+    except ModelError as e:
+        logger.error(f'Batch job of {len(batch)} requests failed: {e}')
+        return {
+            request.custom_id: BatchResult(request.custom_id, None, str(e))
+            for request in batch
+        }
+
+
+def _preprocess_stage(
+    runs: list[_BatchRun],
+    backend: BaseBatchBackend,
+) -> None:
+
+    requests: dict[str, tuple[_BatchRun, PreProcessingAgent]] = {}
+    batch: list[BatchRequest] = []
+    for i, run in enumerate(runs):
+        agent = run.agent('preprocess')
+        if not isinstance(agent, PreProcessingAgent):
+            continue
+        requests[str(i)] = (run, agent)
+        batch.append(
+            _request(str(i), agent.build_prompt(run.state), 'pre_processing'),
+        )
+
+    results = _run_batch(backend, batch)
+    for custom_id, (run, agent) in requests.items():
+        result = results[custom_id]
+        run.agents_models['preprocess'].add_usage(result.usage)
+        try:
+            if isinstance(result.response, dict):
+                run.state = agent.apply_response(
+                    copy.deepcopy(run.state), result.response,
+                )
+            else:
+                logger.warning(
+                    f'Batched preprocessing failed ({result.error}), '
+                    'sending a regular request',
+                )
+                run.state = agent.process(run.state)
+        except Exception as e:
+            run.fail('preprocess', e)
+
+
+def _retreival_stage(
+    runs: list[_BatchRun],
+    backend: BaseBatchBackend,
+    executor: ThreadPoolExecutor,
+) -> None:
+
+    from agents.retreival_agent import RankingCandidate
+    from agents.retreival_agent import RetrievalAgent
+
+    def collect(
+        run: _BatchRun,
+        agent: RetrievalAgent,
+    ) -> list[RankingCandidate] | None:
+        try:
+            return agent.collect_candidates(run.state)
+        except Exception as e:
+            run.fail('retreival', e)
+            return None
+
+    # The database queries are not batched, but run at the same time
+    agents = {
+        i: agent for i, run in enumerate(runs)
+        if isinstance(agent := run.agent('retreival'), RetrievalAgent)
+    }
+    candidates = dict(
+        zip(
+            agents,
+            executor.map(lambda i: collect(runs[i], agents[i]), agents),
+        ),
+    )
+
+    batch = [
+        _request(
+            f'{i}-{j}',
+            agents[i].build_rank_prompt(
+                candidate.puzzle, candidate.solutions,
+            ),
+            'retreival_rank_solutions',
+        )
+        for i, run_candidates in candidates.items()
+        for j, candidate in enumerate(run_candidates or [])
+        if candidate.ranked is None
+    ]
+    results = _run_batch(backend, batch)
+
+    for i, run_candidates in candidates.items():
+        run, agent = runs[i], agents[i]
+        if run_candidates is None:
+            continue
+
+        try:
+            ranked = []
+            for j, candidate in enumerate(run_candidates):
+                ranked_solution = candidate.ranked
+                result = results.get(f'{i}-{j}')
+                if result is not None:
+                    run.agents_models['retreival'].add_usage(result.usage)
+                    if result.response is not None:
+                        ranked_solution = agent.parse_ranking(
+                            candidate.solutions, result.response,
+                        )
+                    else:
+                        logger.warning(
+                            f'Batched ranking failed ({result.error}), '
+                            'sending a regular request',
+                        )
+                        ranked_solution = agent.rank_solutions(
+                            candidate.puzzle, candidate.solutions,
+                        )
+                if ranked_solution is not None:
+                    ranked.append((candidate.puzzle, ranked_solution))
+
+            run.state = agent.apply_rankings(copy.deepcopy(run.state), ranked)
+        except Exception as e:
+            run.fail('retreival', e)
+
+
+def _planning_stage(
+    runs: list[_BatchRun],
+    backend: BaseBatchBackend,
+    executor: ThreadPoolExecutor,
+) -> None:
+
+    def generate(
+        run: _BatchRun,
+        agent: PlanningAgent,
+    ) -> list[SolutionPlan] | None:
+        try:
+            return agent.generate_plans(run.state)
+        except Exception as e:
+            run.fail('planning', e)
+            return None
+
+    # The plans are streamed with regular requests (at the same time), only
+    # their confidence scores are batched
+    agents = {
+        i: agent for i, run in enumerate(runs)
+        if isinstance(agent := run.agent('planning'), PlanningAgent)
+    }
+    plans = dict(
+        zip(
+            agents,
+            executor.map(lambda i: generate(runs[i], agents[i]), agents),
+        ),
+    )
+
+    batch = [
+        _request(
+            f'{i}-{j}',
+            agents[i].build_confidence_prompt(plan.plan),
+            'planning_confidence',
+        )
+        for i, run_plans in plans.items()
+        for j, plan in enumerate(run_plans or [])
+        if plan.plan
+    ]
+    results = _run_batch(backend, batch)
+
+    for i, run_plans in plans.items():
+        run, agent = runs[i], agents[i]
+        if run_plans is None:
+            continue
+
+        scored = []
+        for j, plan in enumerate(run_plans):
+            result = results.get(f'{i}-{j}')
+            if result is None:
+                scored.append(plan)
+                continue
+
+            run.agents_models['planning'].add_usage(result.usage)
+            # A failed request has a confidence of 0 (as a failed regular
+            # request)
+            confidence = agent.parse_confidence(result.response)
+            scored.append(SolutionPlan(plan.plan, confidence))
+
+        try:
+            run.state = agent.apply_confidences(
+                copy.deepcopy(run.state), scored,
+            )
+        except Exception as e:
+            run.fail('planning', e)
+
+
+def run_batched(
+    config: RunConfig,
+    puzzles: list[BenchmarkPuzzle],
+    backend_factory: Callable[[str], BaseBatchBackend],
+    repeats: int = 1,
+    workers: int = 4,
+    prices: Prices | None = None,
+    model_factory: Callable[[str], BaseLanguageModel] = get_model,
+    retreival_cache: RetreivalCache | None = None,
+) -> list[RunResult]:
+    """
+    Run a configuration on the puzzles (like `run_matrix`), with the json
+    requests of the preprocessing, the solution ranking and the plan
+    confidence sent as batch jobs, for large offline sweeps.
+
+    Every stage runs for all puzzles at once: its requests are sent as one
+    batch job and the responses are applied to the state of each puzzle.
+    Requests that failed in the batch job (or whose whole job failed, e.g.
+    timed out) are sent again as regular requests (failed confidence
+    requests score 0, as in a regular run). The
+    plans are generated (without `pipeline_coding`), and the coding and
+    debugging agents run, with regular requests (`workers` puzzles at the
+    same time).
+
+    Note: the time of a result is the time from the start of the sweep
+    until the puzzle was solved (including the waiting for the batch jobs),
+    the time budget only applies to the coding and debugging.
+
+    Args:
+        config (RunConfig): The configuration to run.
+        puzzles (list[BenchmarkPuzzle]): The puzzles to solve.
+        backend_factory (Callable[[str], BaseBatchBackend]): Creates the
+            batch backend for a model name (see
+            `models.batch.create_batch_backend`).
+        repeats (int): The number of times each puzzle is solved.
+        workers (int): The number of puzzles processed at the same time in
+            the regular requests.
+        prices (Prices|None): The model prices, to compute the cost.
+        model_factory (Callable[[str], BaseLanguageModel]): Creates a model
+            from the model name.
+        retreival_cache (RetreivalCache|None): Cache for the retrieval
+            results, shared by all runs (default: not cached).
+
+    Returns:
+        list[RunResult]: The results, sorted by day and repeat.
+    """
+
+    start = time.perf_counter()
+    runs: list[_BatchRun] = []
+    for puzzle in puzzles:
+        for repeat in range(repeats):
+            agents_models = {
+                agent_name: model_factory(config.model_for(agent_name))
+                for agent_name in AGENT_NAMES
+            }
+            state = initial_state(config, puzzle)
+            # The time budget starts after the batched stages
+            state.deadline = None
+            run = _BatchRun(puzzle, repeat, agents_models, (), state)
+            try:
+                run.agents = build_run_agents(
+                    config, puzzle, agents_models, retreival_cache,
+                )
+            except Exception as e:
+                run.fail('setup', e)
+            runs.append(run)
+
+    backends: dict[str, BaseBatchBackend] = {}
+
+    def backend(agent_name: str) -> BaseBatchBackend:
+        model_name = config.model_for(agent_name)
+        if model_name not in backends:
+            backends[model_name] = backend_factory(model_name)
+        return backends[model_name]
+
+    results: list[RunResult] = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        stages: tuple[tuple[str, Callable[[], Any]], ...] = (
+            (
+                'preprocess',
+                lambda: _preprocess_stage(runs, backend('preprocess')),
+            ),
+            (
+                'retreival',
+                lambda: _retreival_stage(
+                    runs, backend('retreival'), executor,
+                ),
+            ),
+            (
+                'planning',
+                lambda: _planning_stage(runs, backend('planning'), executor),
+            ),
+        )
+        for stage, run_stage in stages:
+            if not any(run.agent(stage) is not None for run in runs):
+                continue
+
+            logger.info(f'Running the {stage} stage of {len(runs)} runs')
+            run_stage()
+
+        def solve(run: _BatchRun) -> RunResult:
+            if run.error is None:
+                agents = tuple(
+                    (agent, settings) for agent, settings in run.agents
+                    if agent.name not in BATCH_STAGES
+                )
+                if config.time_budget is not None:
+                    run.state.deadline = time.monotonic() + config.time_budget
+                try:
+                    run.state = solve_run(
+                        config, run.puzzle, run.state, agents,
+                        run.agents_models,
+                    )
+                except Exception as e:
+                    run.fail('solve', e)
+
+            return build_run_result(
+                config, run.puzzle, run.repeat, run.state, run.agents_models,
+                prices, time.perf_counter() - start, run.error,
+            )
+
+        results.extend(executor.map(solve, runs))
+
+    return sorted(results, key=lambda result: (result.day, result.repeat))
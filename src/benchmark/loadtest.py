@@ -0,0 +1,138 @@
+import itertools
+import time
+from concurrent.futures import as_completed
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+from benchmark.mock_server import MockServer
+from benchmark.runner import run_puzzle
+from benchmark.runner import RunConfig
+from benchmark.runner import RunResult
+from benchmark.suite import BenchmarkPuzzle
+from models.openai_model import OpenAILanguageModel
+from models.retry import RetryPolicy
+from tqdm import tqdm
+
+# Retry quickly, the injected errors are not real overload
+LOADTEST_RETRY_POLICY = RetryPolicy(base_delay=0.1, max_delay=1.0)
+
+
+class LoadTestResult(NamedTuple):
+    """
+    Throughput and latency of the pipeline against the mock server.
+    """
+
+    runs: int
+    concurrency: int
+    # Wall clock time of the load test (seconds)
+    elapsed: float
+    # Completed runs per second
+    throughput: float
+    # Latency of a run (seconds)
+    p50: float
+    p95: float
+    p99: float
+    max: float
+    # Runs that raised an error (not unsolved puzzles, those are expected
+    # with mock responses)
+    errors: int
+    # Model requests per second (including retries)
+    requests_per_second: float
+    server_stats: dict[str, int]
+
+    def __str__(self) -> str:
+        return '\n'.join(
+            [
+                f'runs:        {self.runs} (concurrency {self.concurrency})',
+                f'elapsed:     {self.elapsed:.2f}s',
+                f'throughput:  {self.throughput:.2f} runs/s, '
+                f'{self.requests_per_second:.1f} requests/s',
+                f'latency:     p50 {self.p50:.3f}s, p95 {self.p95:.3f}s, '
+                f'p99 {self.p99:.3f}s, max {self.max:.3f}s',
+                f'errors:      {self.errors}',
+                f'server:      {self.server_stats}',
+            ],
+        )
+
+
+def run_loadtest(
+    server: MockServer,
+    puzzles: list[BenchmarkPuzzle],
+    runs: int = 100,
+    concurrency: int = 16,
+    disabled_agents: tuple[str, ...] = ('retreival',),
+    n_plans: int = 3,
+    pipeline_coding: bool = False,
+) -> LoadTestResult:
+    """
+    Solve puzzles with the orchestrator at a high concurrency against the
+    mock server, to measure the throughput and tail latency of our own code.
+
+    Note: the retrieval agent needs the database, so it is disabled by
+    default.
+
+    Args:
+        server (MockServer): The (started) mock server.
+        puzzles (list[BenchmarkPuzzle]): The puzzles (repeated until there
+            are `runs` runs).
+        runs (int): The number of runs.
+        concurrency (int): The number of runs at the same time.
+        disabled_agents (tuple[str, ...]): The agents to disable.
+        n_plans (int): The number of plans of the planning agent.
+        pipeline_coding (bool): Code every plan as soon as it is generated.
+
+    Returns:
+        LoadTestResult: The throughput and latencies.
+    """
+
+    config = RunConfig(
+        name='loadtest',
+        default_model='mock',
+        disabled_agents=disabled_agents,
+        n_plans=n_plans,
+        embedder='hashing',
+        pipeline_coding=pipeline_coding,
+    )
+
+    def model_factory(model_name: str) -> OpenAILanguageModel:
+        return OpenAILanguageModel(
+            model_name,
+            api_key='mock',
+            retry_policy=LOADTEST_RETRY_POLICY,
+            base_url=server.url,
+        )
+
+    jobs = list(itertools.islice(itertools.cycle(puzzles), runs))
+    requests_before = server.stats['requests']
+    results: list[RunResult] = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(
+                run_puzzle, config, puzzle, repeat,
+                model_factory=model_factory,
+            )
+            for repeat, puzzle in enumerate(jobs)
+        ]
+        for future in tqdm(
+            as_completed(futures), total=len(futures), desc='Load test',
+        ):
+            results.append(future.result())
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([result.time for result in results])
+    requests = server.stats['requests'] - requests_before
+    return LoadTestResult(
+        runs=len(results),
+        concurrency=concurrency,
+        elapsed=elapsed,
+        throughput=len(results) / elapsed,
+        p50=float(np.percentile(latencies, 50)),
+        p95=float(np.percentile(latencies, 95)),
+        p99=float(np.percentile(latencies, 99)),
+        max=float(latencies.max()),
+        errors=sum(result.error is not None for result in results),
+        requests_per_second=requests / elapsed,
+        server_stats=dict(server.stats),
+    )
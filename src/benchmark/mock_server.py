@@ -0,0 +1,402 @@
+import json
+import math
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from typing import Any
+from typing import NamedTuple
+
+from core.embeddings import HashingEmbedder
+from loguru import logger
+from utils.tokens import count_tokens
+
+# Returned for requests without a matching fixture (and without a schema):
+# a markdown block for the planning agent and a json block for the
+# debugging agent
+DEFAULT_RESPONSE = '```markdown\nMock plan.\n```\n```json\n{}\n```'
+# Number of chunks of a streamed response
+STREAM_CHUNKS = 8
+
+
+class Latency(NamedTuple):
+    """
+    A log-normal latency distribution (constant if `sigma` is 0).
+    """
+
+    # The median latency (seconds)
+    median: float = 0.0
+    # The standard deviation of the log of the latency
+    sigma: float = 0.0
+
+    def sample(self, rng: random.Random) -> float:
+        if self.median <= 0:
+            return 0.0
+        return self.median * math.exp(self.sigma * rng.gauss(0.0, 1.0))
+
+
+class Fixture(NamedTuple):
+    """
+    A scripted response: the content is returned for every chat request of
+    which the last message contains `match`.
+    """
+
+    match: str
+    content: str
+
+
+def load_fixtures(path: str) -> list[Fixture]:
+    """
+    Load the fixtures from a json file, e.g.:
+    `[{"match": "expected_output", "content": "..."}]`
+    """
+
+    with open(path, 'r') as f:
+        return [Fixture(raw['match'], raw['content']) for raw in json.load(f)]
+
+
+def schema_instance(schema: dict[str, Any], name: str = '') -> Any:
+    """
+    A minimal instance of a json schema (for structured output requests
+    without a matching fixture). Fields named `code` get a valid program.
+    """
+
+    schema_type = schema.get('type')
+    if schema_type == 'object':
+        return {
+            key: schema_instance(value, key)
+            for key, value in schema.get('properties', {}).items()
+        }
+    elif schema_type == 'array':
+        return [schema_instance(schema.get('items', {}), name)]
+    elif schema_type == 'integer':
+        return 1
+    elif schema_type == 'number':
+        return 0.5
+    elif schema_type == 'boolean':
+        return True
+
+    return 'print(0)' if name == 'code' else 'mock'
+
+
+class MockServer:
+    """
+    A local stand-in for an OpenAI-compatible API (chat completions, with
+    streaming, and embeddings), to load test the pipeline without network.
+
+    The responses come from the fixtures, or are generated from the json
+    schema of a structured output request. Every request waits for a latency
+    sampled from `latency` (split over the chunks when streaming), and fails
+    with a 429 or 500 with the given probabilities.
+
+    Usage:
+        with MockServer(latency=Latency(0.5, 0.3)) as server:
+            model = OpenAILanguageModel('mock', 'key', base_url=server.url)
+    """
+
+    def __init__(
+        self,
+        host: str = '127.0.0.1',
+        port: int = 0,
+        fixtures: list[Fixture] | None = None,
+        latency: Latency = Latency(),
+        rate_limit_rate: float = 0.0,
+        server_error_rate: float = 0.0,
+        embedding_dimension: int = 1536,
+        seed: int | None = None,
+    ):
+        """
+        Args:
+            host (str): The host to listen on.
+            port (int): The port to listen on (0: a free port).
+            fixtures (list[Fixture]|None): The scripted responses.
+            latency (Latency): The latency of a request.
+            rate_limit_rate (float): The fraction of requests that fail with
+                429 (rate limit).
+            server_error_rate (float): The fraction of requests that fail
+                with 500.
+            embedding_dimension (int): The dimension of the embeddings.
+            seed (int|None): Seed for the latencies and errors.
+        """
+
+        self.fixtures = fixtures or []
+        self.latency = latency
+        self.rate_limit_rate = rate_limit_rate
+        self.server_error_rate = server_error_rate
+        self.embedder = HashingEmbedder(embedding_dimension)
+        self.logger = logger.bind(name='MockServer')
+
+        self.stats: dict[str, int] = {
+            'requests': 0,
+            'chat': 0,
+            'streamed': 0,
+            'embeddings': 0,
+            'rate_limited': 0,
+            'server_errors': 0,
+        }
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+        server = self
+
+        class Handler(_Handler):
+            mock = server
+
+        self._httpd = _Server((host, port), Handler)
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        """
+        The base url for the OpenAI client.
+        """
+
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host!s}:{port}/v1'
+
+    def start(self) -> 'MockServer':
+        """
+        Serve in a background thread.
+        """
+
+        self._thread = threading.Thread(
+            target=self._httpd.serve_forever, name='mock-server', daemon=True,
+        )
+        self._thread.start()
+        self.logger.info(f'Mock server listening on {self.url}')
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def serve_forever(self) -> None:
+        """
+        Serve in the current thread (until interrupted).
+        """
+
+        self.logger.info(f'Mock server listening on {self.url}')
+        try:
+            self._httpd.serve_forever()
+        finally:
+            self._httpd.server_close()
+
+    def __enter__(self) -> 'MockServer':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def _count(self, stat: str) -> None:
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _sample(self) -> tuple[float, float]:
+        """
+        Sample the latency and the error roll of a request.
+        """
+
+        with self._lock:
+            return self.latency.sample(self._rng), self._rng.random()
+
+    def _injected_error(self, roll: float) -> int | None:
+
+        if roll < self.rate_limit_rate:
+            self._count('rate_limited')
+            return 429
+        if roll < self.rate_limit_rate + self.server_error_rate:
+            self._count('server_errors')
+            return 500
+        return None
+
+    def _chat_content(self, body: dict[str, Any]) -> str:
+
+        messages = body.get('messages') or [{}]
+        last_message = messages[-1].get('content') or ''
+        for fixture in self.fixtures:
+            if fixture.match in last_message:
+                return fixture.content
+
+        response_format = body.get('response_format') or {}
+        if response_format.get('type') == 'json_schema':
+            schema = response_format['json_schema'].get('schema', {})
+            return json.dumps(schema_instance(schema))
+        elif response_format.get('type') == 'json_object':
+            return '{}'
+
+        return DEFAULT_RESPONSE
+
+
+class _Server(ThreadingHTTPServer):
+
+    daemon_threads = True
+    # Many clients connect at the same time in a load test
+    request_queue_size = 256
+
+    def handle_error(self, request: Any, client_address: Any) -> None:
+        # Clients cancel requests (timeouts, streams closed after a block)
+        if not isinstance(
+            sys.exc_info()[1], (BrokenPipeError, ConnectionResetError),
+        ):
+            super().handle_error(request, client_address)
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    mock: MockServer
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # Requests are counted in the stats instead
+        pass
+
+    def _send_json(
+        self,
+        status: int,
+        data: Any,
+        headers: dict[str, str] | None = None,
+    ) -> None:
+
+        payload = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_error(self, status: int) -> None:
+
+        kind = 'rate_limit_error' if status == 429 else 'server_error'
+        self._send_json(
+            status,
+            {'error': {'message': f'Injected {status}', 'type': kind}},
+            headers={'Retry-After': '0'} if status == 429 else None,
+        )
+
+    def do_POST(self) -> None:
+
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError:
+            self._send_json(400, {'error': {'message': 'Invalid json'}})
+            return
+
+        mock = self.mock
+        mock._count('requests')
+        latency, roll = mock._sample()
+
+        status = mock._injected_error(roll)
+        if status is not None:
+            self._send_error(status)
+            return
+
+        if self.path.endswith('/embeddings'):
+            time.sleep(latency)
+            self._embeddings(body)
+        elif self.path.endswith('/chat/completions'):
+            self._chat(body, latency)
+        else:
+            self._send_json(404, {'error': {'message': 'Unknown endpoint'}})
+
+    def _embeddings(self, body: dict[str, Any]) -> None:
+
+        self.mock._count('embeddings')
+        texts = body.get('input') or []
+        if isinstance(texts, str):
+            texts = [texts]
+
+        self._send_json(
+            200, {
+                'object': 'list',
+                'model': body.get('model', 'mock'),
+                'data': [
+                    {'object': 'embedding', 'index': i, 'embedding': vector}
+                    for i, vector in enumerate(self.mock.embedder.embed(texts))
+                ],
+                'usage': {
+                    'prompt_tokens': sum(count_tokens(t) for t in texts),
+                    'total_tokens': sum(count_tokens(t) for t in texts),
+                },
+            },
+        )
+
+    def _chat(self, body: dict[str, Any], latency: float) -> None:
+
+        self.mock._count('chat')
+        content = self.mock._chat_content(body)
+        prompt_tokens = sum(
+            count_tokens(message.get('content') or '')
+            for message in body.get('messages', [])
+        )
+        usage = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': count_tokens(content),
+            'total_tokens': prompt_tokens + count_tokens(content),
+            'prompt_tokens_details': {'cached_tokens': 0},
+        }
+        base = {
+            'id': f'chatcmpl-mock-{time.monotonic_ns()}',
+            'created': int(time.time()),
+            'model': body.get('model', 'mock'),
+        }
+
+        if not body.get('stream'):
+            time.sleep(latency)
+            self._send_json(
+                200, {
+                    **base,
+                    'object': 'chat.completion',
+                    'choices': [{
+                        'index': 0,
+                        'message': {'role': 'assistant', 'content': content},
+                        'finish_reason': 'stop',
+                    }],
+                    'usage': usage,
+                },
+            )
+            return
+
+        self.mock._count('streamed')
+        size = max(1, math.ceil(len(content) / STREAM_CHUNKS))
+        chunks: list[dict[str, Any]] = [
+            {
+                'choices': [{
+                    'index': 0,
+                    'delta': {'content': content[i:i + size]},
+                    'finish_reason': None,
+                }],
+            }
+            for i in range(0, len(content), size)
+        ]
+        chunks.append(
+            {'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]},
+        )
+        if (body.get('stream_options') or {}).get('include_usage'):
+            chunks.append({'choices': [], 'usage': usage})
+
+        # No content length, the end of the stream is the end of the
+        # connection
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        try:
+            for chunk in chunks:
+                time.sleep(latency / len(chunks))
+                data = json.dumps(
+                    {**base, 'object': 'chat.completion.chunk', **chunk},
+                )
+                self.wfile.write(f'data: {data}\n\n'.encode('utf-8'))
+                self.wfile.flush()
+            self.wfile.write(b'data: [DONE]\n\n')
+        except (BrokenPipeError, ConnectionResetError):
+            # The client cancelled the stream (see `prompt_until_block`)
+            pass
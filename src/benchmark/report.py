@@ -0,0 +1,159 @@
+import importlib.util
+import os
+
+import numpy as np
+import pandas as pd
+from benchmark.runner import RunResult
+
+# Relative increase of the median time that counts as a regression
+LATENCY_TOLERANCE = 0.2
+
+
+def results_frame(results: list[RunResult]) -> pd.DataFrame:
+    """
+    Convert the run results to a dataframe (one row per run).
+    """
+
+    return pd.DataFrame(results, columns=list(RunResult._fields))
+
+
+def check_results_path(path: str) -> None:
+    """
+    Check that results can be written to and read from the file (before a
+    run, so that its results are not lost).
+
+    Raises:
+        ValueError: If the extension is not supported, or no parquet engine
+            (pyarrow or fastparquet) is installed for a parquet file.
+    """
+
+    if path.endswith('.csv'):
+        return
+    if not path.endswith('.parquet'):
+        raise ValueError(f'Unsupported results file format: {path}')
+
+    if not any(
+        importlib.util.find_spec(engine) is not None
+        for engine in ('pyarrow', 'fastparquet')
+    ):
+        raise ValueError(
+            f'Can not write {path}: parquet files need pyarrow '
+            '(see requirements.txt)',
+        )
+
+
+def write_results(df: pd.DataFrame, path: str) -> None:
+    """
+    Write the results to a csv or parquet file (based on the extension).
+    """
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if path.endswith('.parquet'):
+        df.to_parquet(path, index=False)
+    elif path.endswith('.csv'):
+        df.to_csv(path, index=False)
+    else:
+        raise ValueError(f'Unsupported results file format: {path}')
+
+
+def load_results(path: str) -> pd.DataFrame:
+    """
+    Load results written by `write_results`.
+    """
+
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    elif path.endswith('.csv'):
+        return pd.read_csv(path, keep_default_na=True)
+
+    raise ValueError(f'Unsupported results file format: {path}')
+
+
+def summarize(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Summarize the results per configuration.
+
+    Returns:
+        pd.DataFrame: The success rate, time percentiles, mean debug attempts,
+            runs over the time budget, token usage and cost for each
+            configuration.
+    """
+
+    def _summary(group: pd.DataFrame) -> pd.Series:
+        p50, p90, p95 = np.percentile(group['time'], [50, 90, 95])
+        return pd.Series(
+            {
+                'runs': len(group),
+                'solved': int(group['success'].sum()),
+                'success_rate': group['success'].mean(),
+                'time_p50': p50,
+                'time_p90': p90,
+                'time_p95': p95,
+                'time_max': group['time'].max(),
+                'debug_attempts_mean': group['debug_attempts'].mean(),
+                'errors': int(group['error'].notna().sum()),
+                'deadline_exceeded': int(
+                    group['deadline_exceeded_by'].notna().sum(),
+                ),
+                'input_tokens': int(group['input_tokens'].sum()),
+                'output_tokens': int(group['output_tokens'].sum()),
+                'cached_tokens': int(group['cached_tokens'].sum()),
+                # The cost is unknown if any of the models has no price
+                'cost': (
+                    group['cost'].sum()
+                    if group['cost'].notna().all() else np.nan
+                ),
+            },
+        )
+
+    return df.groupby('config').apply(_summary, include_groups=False)
+
+
+def compare(
+    current: pd.DataFrame,
+    previous: pd.DataFrame,
+    latency_tolerance: float = LATENCY_TOLERANCE,
+) -> pd.DataFrame:
+    """
+    Compare the results against a previous results file.
+
+    A regression is a puzzle (per configuration) with a lower success rate
+    than before, or a configuration where the median time increased by more
+    than `latency_tolerance`. Only configurations and puzzles present in both
+    results are compared.
+
+    Args:
+        current (pd.DataFrame): The current results.
+        previous (pd.DataFrame): The previous results.
+        latency_tolerance (float): The allowed relative increase of the
+            median time.
+
+    Returns:
+        pd.DataFrame: The regressions (config, year, day, kind, before, after),
+            empty if there are none.
+    """
+
+    keys = ['config', 'year', 'day']
+    success = pd.merge(
+        previous.groupby(keys)['success'].mean().rename('before'),
+        current.groupby(keys)['success'].mean().rename('after'),
+        left_index=True,
+        right_index=True,
+    ).reset_index()
+    success = success[success['after'] < success['before']]
+    success.insert(3, 'kind', 'success')
+
+    latency = pd.merge(
+        previous.groupby('config')['time'].median().rename('before'),
+        current.groupby('config')['time'].median().rename('after'),
+        left_index=True,
+        right_index=True,
+    ).reset_index()
+    latency = latency[
+        latency['after'] > latency['before'] * (1 + latency_tolerance)
+    ]
+    latency.insert(1, 'year', None)
+    latency.insert(2, 'day', None)
+    latency.insert(3, 'kind', 'time_p50')
+
+    return pd.concat([success, latency], ignore_index=True)
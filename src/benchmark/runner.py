@@ -0,0 +1,416 @@
+import json
+import os
+import time
+from collections.abc import Callable
+from concurrent.futures import as_completed
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from typing import NamedTuple
+
+from agents.base_agent import BaseAgent
+from benchmark.suite import BenchmarkPuzzle
+from core.embeddings import get_embedder
+from core.orchestrator import Orchestrator
+from core.retreival_cache import RetreivalCache
+from core.state import MainState
+from loguru import logger
+from main import build_agents
+from main import check_solution
+from main import get_model
+from models.base_model import BaseLanguageModel
+from models.recording import RecordingLanguageModel
+from models.recording import RecordingStore
+from models.recording import ReplayLanguageModel
+from models.usage import TokenUsage
+from tqdm import tqdm
+from utils.util_types import AgentSettings
+from utils.util_types import Puzzle
+
+AGENT_NAMES = ('preprocess', 'retreival', 'planning', 'coding', 'debugging')
+
+# Model name -> price in USD per million tokens, e.g.:
+# {"gpt-4o": {"input": 2.5, "cached": 1.25, "output": 10.0}}
+Prices = dict[str, dict[str, float]]
+
+
+class RunConfig(NamedTuple):
+    """
+    A configuration of the system to benchmark.
+    """
+
+    name: str
+    default_model: str
+    # Agent name -> model name (overrides the default model)
+    agent_models: dict[str, str] = {}
+    disabled_agents: tuple[str, ...] = ()
+    n_plans: int = 3
+    # The embedder for the retrieval agent (see `core.embeddings`)
+    embedder: str = 'openai'
+    # Use the precomputed solution rankings of this version
+    ranking_version: str | None = None
+    # Retrieval gating of weak matches (see `build_agents`)
+    min_similarity: float | None = None
+    max_similarity_gap: float | None = None
+    # The time budget per puzzle (seconds), no budget if None
+    time_budget: float | None = None
+    # Code every plan as soon as it is generated (see `build_agents`)
+    pipeline_coding: bool = False
+
+    def model_for(self, agent_name: str) -> str:
+        return self.agent_models.get(agent_name) or self.default_model
+
+
+class RunResult(NamedTuple):
+    """
+    The result of solving one puzzle with one configuration.
+    """
+
+    config: str
+    default_model: str
+    year: int
+    day: int
+    repeat: int
+    success: bool
+    time: float
+    debug_attempts: int
+    n_retreived_puzzles: int
+    requests: int
+    input_tokens: int
+    output_tokens: int
+    cached_tokens: int
+    cost: float | None
+    error: str | None
+    code: str | None
+    # The agent that was running when the time budget ran out
+    deadline_exceeded_by: str | None
+
+
+def load_configs(path: str) -> list[RunConfig]:
+    """
+    Load the run configurations from a json file.
+
+    The file contains a list of objects with the fields of `RunConfig`, e.g.:
+    `[{"name": "no-retreival", "default_model": "gemini-2.0-flash",
+    "disabled_agents": ["retreival"]}]`
+
+    Args:
+        path (str): The path to the json file.
+
+    Returns:
+        list[RunConfig]: The run configurations.
+    """
+
+    with open(path, 'r') as f:
+        raw_configs = json.load(f)
+
+    configs = []
+    for raw in raw_configs:
+        unknown_agents = (
+            set(raw.get('agent_models', {}))
+            | set(raw.get('disabled_agents', []))
+        ) - set(AGENT_NAMES)
+        if unknown_agents:
+            raise ValueError(
+                f'Unknown agents in config {raw["name"]}: {unknown_agents}',
+            )
+
+        configs.append(
+            RunConfig(
+                name=raw['name'],
+                default_model=raw['default_model'],
+                agent_models=raw.get('agent_models', {}),
+                disabled_agents=tuple(raw.get('disabled_agents', [])),
+                n_plans=raw.get('n_plans', 3),
+                embedder=raw.get('embedder', 'openai'),
+                ranking_version=raw.get('ranking_version', None),
+                min_similarity=raw.get('min_similarity', None),
+                max_similarity_gap=raw.get('max_similarity_gap', None),
+                time_budget=raw.get('time_budget', None),
+                pipeline_coding=raw.get('pipeline_coding', False),
+            ),
+        )
+
+    return configs
+
+
+def load_prices(path: str) -> Prices:
+    """
+    Load the model prices (USD per million tokens) from a json file.
+    """
+
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def _usage_cost(
+    model_name: str,
+    usage: TokenUsage,
+    prices: Prices,
+) -> float | None:
+
+    if model_name not in prices:
+        return None
+
+    price = prices[model_name]
+    # Cached tokens are part of the input tokens, but are billed differently
+    uncached_tokens = usage.input_tokens - usage.cached_tokens
+    cost = (
+        uncached_tokens * price.get('input', 0.0)
+        + usage.cached_tokens * price.get('cached', price.get('input', 0.0))
+        + usage.output_tokens * price.get('output', 0.0)
+    )
+    return cost / 1_000_000
+
+
+def recording_factory(
+    store: RecordingStore,
+    model_factory: Callable[[str], BaseLanguageModel] = get_model,
+) -> Callable[[str], BaseLanguageModel]:
+    """
+    A model factory that records the requests of the models in `store`.
+    """
+
+    return lambda model_name: RecordingLanguageModel(
+        model_factory(model_name), store,
+    )
+
+
+def replay_factory(
+    store: RecordingStore,
+    latency_scale: float = 0.0,
+) -> Callable[[str], BaseLanguageModel]:
+    """
+    A model factory that replays the requests recorded in `store` (see
+    `recording_factory`).
+    """
+
+    return lambda model_name: ReplayLanguageModel(
+        model_name, store, latency_scale,
+    )
+
+
+def initial_state(config: RunConfig, puzzle: BenchmarkPuzzle) -> MainState:
+    """
+    Create the state of a run (with the deadline of the time budget).
+    """
+
+    state = MainState(
+        puzzle=Puzzle(
+            description=puzzle.description,
+            solution=None,
+            year=puzzle.year,
+            day=puzzle.day,
+        ),
+    )
+    if config.time_budget is not None:
+        state.deadline = time.monotonic() + config.time_budget
+    return state
+
+
+def build_run_agents(
+    config: RunConfig,
+    puzzle: BenchmarkPuzzle,
+    agents_models: dict[str, BaseLanguageModel],
+    retreival_cache: RetreivalCache | None,
+) -> tuple[tuple[BaseAgent, AgentSettings], ...]:
+    """
+    Create the agents of a run with the settings of the configuration.
+    """
+
+    return build_agents(
+        agents_models,
+        puzzle_input=puzzle.input_,
+        expected_output=puzzle.expected_output,
+        disabled_agents=list(config.disabled_agents),
+        n_plans=config.n_plans,
+        embedder=(
+            get_embedder(config.embedder, os.getenv('OPENAI_API_KEY'))
+            if 'retreival' not in config.disabled_agents else None
+        ),
+        retreival_cache=retreival_cache,
+        ranking_version=config.ranking_version,
+        pipeline_coding=config.pipeline_coding,
+        min_similarity=config.min_similarity,
+        max_similarity_gap=config.max_similarity_gap,
+    )
+
+
+def solve_run(
+    config: RunConfig,
+    puzzle: BenchmarkPuzzle,
+    state: MainState,
+    agents: tuple[tuple[BaseAgent, AgentSettings], ...],
+    agents_models: dict[str, BaseLanguageModel],
+) -> MainState:
+    """
+    Run the agents on the state, and check the code if the debugging agent
+    is disabled.
+    """
+
+    state = Orchestrator(agents, {}).solve_puzzle(state)
+    if 'debugging' in config.disabled_agents:
+        state = check_solution(
+            state,
+            model=agents_models['debugging'],
+            puzzle_input=puzzle.input_,
+            expected_output=puzzle.expected_output,
+        )
+    return state
+
+
+def build_run_result(
+    config: RunConfig,
+    puzzle: BenchmarkPuzzle,
+    repeat: int,
+    state: MainState,
+    agents_models: dict[str, BaseLanguageModel],
+    prices: Prices | None,
+    elapsed: float,
+    error: str | None,
+) -> RunResult:
+    """
+    Create the result of a run, with the usage and cost of its models.
+    """
+
+    usage = TokenUsage()
+    cost: float | None = 0.0
+    for model in agents_models.values():
+        usage = usage + model.usage
+        model_cost = _usage_cost(model.model_name, model.usage, prices or {})
+        if model_cost is None or cost is None:
+            cost = None
+        else:
+            cost += model_cost
+
+    return RunResult(
+        config=config.name,
+        default_model=config.default_model,
+        year=puzzle.year,
+        day=puzzle.day,
+        repeat=repeat,
+        success=state.is_solved,
+        time=elapsed,
+        debug_attempts=state.debug_attempts,
+        n_retreived_puzzles=len(state.retreived_puzzles),
+        requests=usage.requests,
+        input_tokens=usage.input_tokens,
+        output_tokens=usage.output_tokens,
+        cached_tokens=usage.cached_tokens,
+        cost=cost,
+        error=error,
+        code=state.final_code or state.generated_code,
+        deadline_exceeded_by=state.deadline_exceeded_by,
+    )
+
+
+def run_puzzle(
+    config: RunConfig,
+    puzzle: BenchmarkPuzzle,
+    repeat: int = 0,
+    prices: Prices | None = None,
+    model_factory: Callable[[str], BaseLanguageModel] = get_model,
+    retreival_cache: RetreivalCache | None = None,
+) -> RunResult:
+    """
+    Solve one puzzle with one configuration.
+
+    Fresh models are created for every run, so that the token usage only
+    contains the requests of this run.
+
+    Args:
+        config (RunConfig): The configuration to run.
+        puzzle (BenchmarkPuzzle): The puzzle to solve.
+        repeat (int): The index of the repetition (for repeated runs).
+        prices (Prices|None): The model prices, to compute the cost.
+        model_factory (Callable[[str], BaseLanguageModel]): Creates a model
+            from the model name.
+        retreival_cache (RetreivalCache|None): Cache for the retrieval
+            results.
+
+    Returns:
+        RunResult: The result of the run.
+    """
+
+    agents_models = {
+        agent_name: model_factory(config.model_for(agent_name))
+        for agent_name in AGENT_NAMES
+    }
+
+    error = None
+    start = time.perf_counter()
+    state = initial_state(config, puzzle)
+    try:
+        agents = build_run_agents(
+            config, puzzle, agents_models, retreival_cache,
+        )
+        state = solve_run(config, puzzle, state, agents, agents_models)
+    except Exception as e:
+        # A failing run should not stop the whole benchmark
+        logger.exception(
+            f'Run {config.name} {puzzle.year}-{puzzle.day} failed: {e}',
+        )
+        error = f'{type(e).__name__}: {e}'
+    elapsed = time.perf_counter() - start
+
+    return build_run_result(
+        config, puzzle, repeat, state, agents_models, prices, elapsed, error,
+    )
+
+
+def run_matrix(
+    configs: list[RunConfig],
+    puzzles: list[BenchmarkPuzzle],
+    workers: int = 4,
+    repeats: int = 1,
+    prices: Prices | None = None,
+    model_factory: Callable[[str], BaseLanguageModel] = get_model,
+    retreival_cache: RetreivalCache | None = None,
+) -> list[RunResult]:
+    """
+    Run every configuration on every puzzle (in parallel).
+
+    Args:
+        configs (list[RunConfig]): The configurations to run.
+        puzzles (list[BenchmarkPuzzle]): The puzzles to solve.
+        workers (int): The number of runs at the same time.
+        repeats (int): The number of times each puzzle is solved.
+        prices (Prices|None): The model prices, to compute the cost.
+        model_factory (Callable[[str], BaseLanguageModel]): Creates a model
+            from the model name.
+        retreival_cache (RetreivalCache|None): Cache for the retrieval
+            results, shared by all runs (default: not cached).
+
+    Returns:
+        list[RunResult]: The results, sorted by config, day and repeat.
+    """
+
+    jobs: list[tuple[Any, ...]] = [
+        (config, puzzle, repeat)
+        for config in configs
+        for puzzle in puzzles
+        for repeat in range(repeats)
+    ]
+
+    results = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                run_puzzle, config, puzzle, repeat, prices, model_factory,
+                retreival_cache,
+            )
+            for config, puzzle, repeat in jobs
+        ]
+        for future in tqdm(
+            as_completed(futures), total=len(futures), desc='Benchmark',
+        ):
+            result = future.result()
+            logger.info(
+                f'{result.config} {result.year}-{result.day} '
+                f'success={result.success} time={result.time:.1f}s',
+            )
+            results.append(result)
+
+    return sorted(
+        results,
+        key=lambda result: (result.config, result.day, result.repeat),
+    )
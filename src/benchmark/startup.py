@@ -0,0 +1,155 @@
+import os
+import re
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from typing import NamedTuple
+
+# A line of `python -X importtime`:
+# `import time: <self us> | <cumulative us> | <indent><module>`
+IMPORTTIME_RE = re.compile(
+    r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$',
+)
+# The src directory (the imports are relative to it)
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ImportTime(NamedTuple):
+    """
+    The import time of a module (from `python -X importtime`).
+    """
+
+    module: str
+    # Time spent in the module itself (microseconds)
+    self_us: int
+    # Time including the imports of the module (microseconds)
+    cumulative_us: int
+    # Nesting level (0: imported by the measured module or the interpreter)
+    depth: int
+
+
+class StartupResult(NamedTuple):
+    """
+    The cold start time of a module, over several fresh interpreters.
+    """
+
+    module: str
+    runs: int
+    # The (cumulative) import time of the module (milliseconds)
+    median_ms: float
+    min_ms: float
+    max_ms: float
+    # The slowest direct and indirect imports: (module, median milliseconds)
+    slowest: list[tuple[str, float]]
+
+    def __str__(self) -> str:
+        lines = [
+            f'import {self.module}: median {self.median_ms:.1f}ms '
+            f'(min {self.min_ms:.1f}ms, max {self.max_ms:.1f}ms, '
+            f'{self.runs} runs)',
+            'Slowest imports (cumulative):',
+        ]
+        lines.extend(
+            f'  {ms:8.1f}ms  {module}' for module, ms in self.slowest
+        )
+        return '\n'.join(lines)
+
+
+def parse_importtime(output: str) -> list[ImportTime]:
+    """
+    Parse the (stderr) output of `python -X importtime`.
+    """
+
+    imports = []
+    for line in output.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if match is None:
+            continue
+
+        self_us, cumulative_us, indent, module = match.groups()
+        imports.append(
+            ImportTime(
+                module=module,
+                self_us=int(self_us),
+                cumulative_us=int(cumulative_us),
+                depth=(len(indent) - 1) // 2,
+            ),
+        )
+
+    return imports
+
+
+def import_times(module: str) -> list[ImportTime]:
+    """
+    Import the module in a fresh interpreter and get the import times.
+
+    Raises:
+        RuntimeError: If the module could not be imported.
+    """
+
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=SRC_DIR,
+        env={**os.environ, 'PYTHONPATH': SRC_DIR},
+        capture_output=True,
+        text=True,
+    )
+    if process.returncode != 0:
+        raise RuntimeError(
+            f'Could not import {module}:\n{process.stderr[-2000:]}',
+        )
+
+    return parse_importtime(process.stderr)
+
+
+def measure_startup(
+    module: str = 'main',
+    runs: int = 5,
+    top: int = 15,
+) -> StartupResult:
+    """
+    Measure the cold start (import) time of a module, e.g. of the CLI.
+
+    Every run imports the module in a new interpreter with
+    `-X importtime`, so the times include all the (third party) imports
+    the module triggers.
+
+    Args:
+        module (str): The module to import.
+        runs (int): The number of interpreters to start.
+        top (int): The number of slowest imports to report.
+
+    Returns:
+        StartupResult: The import times.
+    """
+
+    totals: list[float] = []
+    cumulative: dict[str, list[float]] = defaultdict(list)
+    for _ in range(runs):
+        times = import_times(module)
+        for import_time in times:
+            cumulative[import_time.module].append(
+                import_time.cumulative_us / 1000,
+            )
+            if import_time.module == module:
+                totals.append(import_time.cumulative_us / 1000)
+
+    slowest = sorted(
+        (
+            (name, statistics.median(values))
+            for name, values in cumulative.items()
+            if name != module
+        ),
+        key=lambda item: item[1],
+        reverse=True,
+    )[:top]
+
+    return StartupResult(
+        module=module,
+        runs=runs,
+        median_ms=statistics.median(totals),
+        min_ms=min(totals),
+        max_ms=max(totals),
+        slowest=slowest,
+    )
@@ -0,0 +1,69 @@
+import json
+import os
+from typing import NamedTuple
+
+DEFAULT_TEST_DATA = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    '..', '..', 'experiments', 'test_data',
+)
+
+
+class BenchmarkPuzzle(NamedTuple):
+    """
+    A puzzle of the benchmark suite, with its input and expected output.
+    """
+
+    year: int
+    day: int
+    description: str
+    input_: str
+    expected_output: str
+
+
+def load_suite(
+        test_data_dir: str = DEFAULT_TEST_DATA,
+        days: list[int] | None = None,
+        answers_file: str = 'answers2024.json',
+) -> list[BenchmarkPuzzle]:
+    """
+    Load the benchmark puzzles from the test data directory.
+
+    The directory contains `puzzles/day_XX.txt` with the descriptions and an
+    answers file with the input and expected output (part 1) for each day.
+
+    Args:
+        test_data_dir (str): The test data directory.
+        days (list[int]|None): Only load these days (default: all days).
+        answers_file (str): The name of the answers file.
+
+    Returns:
+        list[BenchmarkPuzzle]: The puzzles, sorted by day.
+    """
+
+    with open(os.path.join(test_data_dir, answers_file), 'r') as f:
+        answers = {int(item['day']): item for item in json.load(f)}
+
+    puzzles_dir = os.path.join(test_data_dir, 'puzzles')
+    puzzles = []
+    for file_name in sorted(os.listdir(puzzles_dir)):
+        if not file_name.endswith('.txt'):
+            continue
+
+        day = int(file_name.split('_')[-1].split('.')[0])
+        if day not in answers or (days is not None and day not in days):
+            continue
+
+        with open(os.path.join(puzzles_dir, file_name), 'r') as f:
+            description = f.read()
+
+        puzzles.append(
+            BenchmarkPuzzle(
+                year=int(answers[day]['year']),
+                day=day,
+                description=description,
+                input_=answers[day]['input'],
+                expected_output=str(answers[day]['part1']),
+            ),
+        )
+
+    return sorted(puzzles, key=lambda puzzle: puzzle.day)
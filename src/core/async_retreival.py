@@ -0,0 +1,397 @@
+import asyncio
+from dataclasses import asdict
+
+import numpy as np
+from agents.pre_processing_agent import PreProcessingAgent
+from core.embeddings import BaseEmbedder
+from core.retreival import BaseRetreival
+from core.retreival import BUMP_CORPUS_VERSION_QUERY
+from core.retreival import CORPUS_VERSION_QUERY
+from core.retreival import EXISTING_SOLUTION_QUERY
+from core.retreival import field_embedding_rows
+from core.retreival import INSERT_FIELD_EMBEDDING_QUERY
+from core.retreival import INSERT_PUZZLE_QUERY
+from core.retreival import INSERT_SOLUTION_QUERY
+from core.retreival import INSERT_TAG_QUERY
+from core.retreival import puzzle_from_row
+from core.retreival import PUZZLE_ID_QUERY
+from core.retreival import puzzle_values
+from core.retreival import PuzzleData
+from core.retreival import select_solutions
+from core.retreival import similar_puzzles_query
+from core.retreival import solution_candidates_params
+from core.retreival import SOLUTION_CANDIDATES_QUERY
+from core.retreival import solution_values
+from core.retreival import SolutionData
+from core.retreival import tag_rows
+from core.retreival_cache import RetreivalCache
+from core.state import MainState
+from pgvector.psycopg import register_vector_async
+from psycopg import AsyncCursor
+from psycopg_pool import AsyncConnectionPool
+from utils.util_types import Puzzle
+
+
+class AsyncPuzzleRetreival(BaseRetreival):
+    """
+    Async variant of `PuzzleRetreival`, on a pool of async connections.
+
+    The queries are the same as those of `PuzzleRetreival`. The blocking
+    work (embeddings, pre-processing, hashing and selecting solutions) runs
+    in a thread, so the event loop is free while it runs and many retrievals
+    can share a few connections.
+
+    Note: the schema is migrated by `PuzzleRetreival.init_db`.
+
+    Usage:
+        async with AsyncPuzzleRetreival(connection_string, ...) as retreival:
+            puzzles = await retreival.get_similar_puzzles_from_state(state)
+    """
+
+    def __init__(
+        self,
+        connection_string: str,
+        openai_key: str | None = None,
+        *,  # named arguments only
+        pre_processing_agent: PreProcessingAgent | None = None,
+        weights: dict[str, float] | None = None,
+        embedder: BaseEmbedder | None = None,
+        lexical: bool = True,
+        cache: RetreivalCache | None = None,
+        min_connections: int = 1,
+        max_connections: int = 10,
+    ):
+        """
+        Args:
+            connection_string (str): The database connection string.
+            openai_key (str|None): The OpenAI API key, used for the default
+                embedder (when no embedder is given).
+            pre_processing_agent (PreProcessingAgent|None): The agent used to
+                pre-process puzzles that are added by description.
+            weights (dict[str, float]|None): The weight of each field in the
+                similarity (see `EMBEDDING_FIELDS`).
+            embedder (BaseEmbedder|None): The embedder for the puzzles
+                (default: OpenAI text-embedding-3-small).
+            lexical (bool): Fuse the vector ranking with the lexical rankings.
+            cache (RetreivalCache|None): Cache for the similar puzzles and
+                solutions (not cached if not given).
+            min_connections (int): The number of connections kept open.
+            max_connections (int): The maximum number of connections.
+        """
+
+        super().__init__(
+            connection_string,
+            openai_key,
+            pre_processing_agent=pre_processing_agent,
+            weights=weights,
+            embedder=embedder,
+            lexical=lexical,
+            cache=cache,
+        )
+
+        # The pool is opened in `open` (it needs a running event loop), the
+        # embeddings are sent as binary vectors
+        self.pool = AsyncConnectionPool(
+            connection_string,
+            min_size=min_connections,
+            max_size=max_connections,
+            open=False,
+            configure=register_vector_async,
+        )
+
+    async def open(self) -> None:
+        """
+        Open the connection pool.
+        """
+
+        await self.pool.open()
+
+    async def close(self) -> None:
+        """
+        Close the connection pool.
+        """
+
+        await self.pool.close()
+
+    async def __aenter__(self) -> 'AsyncPuzzleRetreival':
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def _corpus_version(self) -> int:
+
+        async with self.pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(CORPUS_VERSION_QUERY)
+                version = await cur.fetchone()
+
+        return version[0] if version is not None else 0
+
+    async def _puzzle_id(
+        self,
+        cur: AsyncCursor,
+        year: int,
+        day: int,
+    ) -> int | None:
+
+        await cur.execute(PUZZLE_ID_QUERY, (year, day))
+        puzzle_id = await cur.fetchone()
+        return puzzle_id[0] if puzzle_id is not None else None
+
+    async def add_puzzle_from_state(self, state: MainState) -> int:
+        """
+        Add a puzzle from the state to the database.
+
+        Args:
+            state (MainState): The state containing the puzzle.
+
+        Returns:
+            int: The ID of the added puzzle.
+        """
+
+        puzzle_data = self._state_to_puzzle_data(state)
+        field_embeddings: dict[str, np.ndarray] = await asyncio.to_thread(
+            self._compute_field_embeddings, puzzle_data,
+        )
+        embedding = self._compute_weighted_embedding(field_embeddings)
+
+        async with self.pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    INSERT_PUZZLE_QUERY, puzzle_values(puzzle_data, embedding),
+                )
+                puzzle_id = await cur.fetchone()
+                if puzzle_id is None:
+                    self.logger.error(
+                        f'Failed to add puzzle to the database. {puzzle_id=}',
+                    )
+                    return 0
+
+                puzzle_id = puzzle_id[0]
+                await cur.executemany(
+                    INSERT_FIELD_EMBEDDING_QUERY,
+                    field_embedding_rows(puzzle_id, field_embeddings),
+                )
+                await cur.executemany(
+                    INSERT_TAG_QUERY, tag_rows(puzzle_id, puzzle_data),
+                )
+                await cur.execute(BUMP_CORPUS_VERSION_QUERY)
+                await conn.commit()
+
+        self.logger.info(
+            f'Puzzle {puzzle_data.year}-{puzzle_data.day} '
+            f'added with ID {puzzle_id}.',
+        )
+        return puzzle_id
+
+    async def add_puzzle(self, puzzle: Puzzle) -> int:
+        """
+        Add a puzzle to the database.
+
+        Note: this method requires a pre-processing agent to be available.
+
+        Args:
+            puzzle (Puzzle): The puzzle to add.
+
+        Returns:
+            int: The ID of the added puzzle.
+        """
+
+        assert self.pre_processing_agent is not None, (
+            'Pre-processing agent is not available.'
+        )
+
+        async with self.pool.connection() as conn:
+            async with conn.cursor() as cur:
+                puzzle_id = await self._puzzle_id(cur, puzzle.year, puzzle.day)
+
+        if puzzle_id is not None:
+            self.logger.info(
+                f'Puzzle {puzzle.year}-{puzzle.day} already exists.',
+            )
+            return puzzle_id
+
+        state = await asyncio.to_thread(
+            self.pre_processing_agent.process, MainState(puzzle=puzzle),
+        )
+        return await self.add_puzzle_from_state(state)
+
+    async def add_solution(self, solution: SolutionData) -> int:
+        """
+        Add a solution to the database (see `PuzzleRetreival.add_solution`).
+
+        Args:
+            solution (SolutionData): The solution to add.
+
+        Returns:
+            int: The ID of the added (or the existing) solution, 0 if the
+                puzzle does not exist.
+        """
+
+        async with self.pool.connection() as conn:
+            async with conn.cursor() as cur:
+                puzzle_id = await self._puzzle_id(
+                    cur, solution.puzzle_year, solution.puzzle_day,
+                )
+                if puzzle_id is None:
+                    self.logger.error(
+                        f'Puzzle {solution.puzzle_year}-'
+                        f'{solution.puzzle_day} does not exist.',
+                    )
+                    return 0
+
+                # Hashing parses the code, so it runs in a thread
+                values = await asyncio.to_thread(
+                    solution_values, puzzle_id, solution,
+                )
+                await cur.execute(
+                    EXISTING_SOLUTION_QUERY,
+                    (puzzle_id, solution.author, values.code_hash),
+                )
+                existing_solution = await cur.fetchone()
+                if existing_solution is not None:
+                    self.logger.info(
+                        f'Solution by {solution.author} for puzzle '
+                        f'{solution.puzzle_year}-{solution.puzzle_day} '
+                        'already exists.',
+                    )
+                    return existing_solution[0]
+
+                await cur.execute(INSERT_SOLUTION_QUERY, values)
+                solution_id = await cur.fetchone()
+                if solution_id is None:
+                    return 0
+
+                await cur.execute(BUMP_CORPUS_VERSION_QUERY)
+                await conn.commit()
+
+        self.logger.info(f'Solution added with ID {solution_id[0]}.')
+        return solution_id[0]
+
+    async def get_similar_puzzles_from_state(
+        self,
+        state: MainState,
+        limit: int = 3,
+    ) -> list[PuzzleData]:
+        """
+        Get the most similar puzzles (see `similar_puzzles_query`).
+
+        Args:
+            state (MainState): The state with the (pre-processed) puzzle.
+            limit (int): The number of puzzles.
+
+        Returns:
+            list[PuzzleData]: The puzzles, most similar first.
+        """
+
+        puzzle_data = self._state_to_puzzle_data(state)
+        if self.cache is None:
+            return await self._query_similar_puzzles(puzzle_data, limit)
+
+        key = self._similar_puzzles_key(
+            puzzle_data, limit, await self._corpus_version(),
+        )
+        cached = await asyncio.to_thread(self.cache.get, key)
+        if cached is not None:
+            self.logger.debug('Using cached similar puzzles')
+            return [PuzzleData(**puzzle) for puzzle in cached]
+
+        puzzles = await self._query_similar_puzzles(puzzle_data, limit)
+        await asyncio.to_thread(
+            self.cache.put, key, [asdict(puzzle) for puzzle in puzzles],
+        )
+        return puzzles
+
+    async def _query_similar_puzzles(
+        self,
+        puzzle_data: PuzzleData,
+        limit: int,
+    ) -> list[PuzzleData]:
+
+        query_embeddings = await asyncio.to_thread(
+            self._compute_query_embeddings, [puzzle_data],
+        )
+        query, params = similar_puzzles_query(
+            [puzzle_data],
+            query_embeddings,
+            self._query_fields(),
+            self.lexical,
+            limit,
+            self._weight_total(),
+        )
+
+        async with self.pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(query, params)
+                return [puzzle_from_row(row) for row in await cur.fetchall()]
+
+    async def get_solutions(
+        self,
+        puzzle_year: int,
+        puzzle_day: int,
+        limit: int = 3,
+        token_budget: int | None = None,
+        language: str | None = None,
+    ) -> list[SolutionData]:
+        """
+        Get diverse solutions of a puzzle within a token budget (see
+        `PuzzleRetreival.get_solutions`).
+
+        Args:
+            puzzle_year (int): The year of the puzzle.
+            puzzle_day (int): The day of the puzzle.
+            limit (int): The maximum number of solutions.
+            token_budget (int|None): The maximum total number of tokens of
+                the solutions (no limit if None).
+            language (str|None): Only get solutions in this language.
+
+        Returns:
+            list[SolutionData]: The solutions.
+        """
+
+        if self.cache is None:
+            return await self._query_solutions(
+                puzzle_year, puzzle_day, limit, token_budget, language,
+            )
+
+        key = self._solutions_key(
+            puzzle_year, puzzle_day, limit, token_budget, language,
+            await self._corpus_version(),
+        )
+        cached = await asyncio.to_thread(self.cache.get, key)
+        if cached is not None:
+            return [SolutionData(**solution) for solution in cached]
+
+        solutions = await self._query_solutions(
+            puzzle_year, puzzle_day, limit, token_budget, language,
+        )
+        await asyncio.to_thread(
+            self.cache.put, key, [asdict(solution) for solution in solutions],
+        )
+        return solutions
+
+    async def _query_solutions(
+        self,
+        puzzle_year: int,
+        puzzle_day: int,
+        limit: int,
+        token_budget: int | None,
+        language: str | None,
+    ) -> list[SolutionData]:
+
+        async with self.pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    SOLUTION_CANDIDATES_QUERY,
+                    solution_candidates_params(
+                        puzzle_year, puzzle_day, limit, language,
+                    ),
+                )
+                rows = await cur.fetchall()
+
+        return await asyncio.to_thread(
+            select_solutions, rows, puzzle_year, puzzle_day, limit,
+            token_budget,
+        )
@@ -0,0 +1,147 @@
+import hashlib
+import math
+import re
+from abc import ABC
+from abc import abstractmethod
+from collections import Counter
+
+from loguru import logger
+from models.registry import openai_client
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+class BaseEmbedder(ABC):
+    """Abstract base class for text embedders"""
+
+    def __init__(self, name: str, dimension: int):
+        """
+        Args:
+            name (str): The name of the embedder (stored in the database, so
+                that embeddings of different embedders are not mixed).
+            dimension (int): The dimension of the embeddings.
+        """
+
+        self.name = name
+        self.dimension = dimension
+        self.logger = logger.bind(embedder=name)
+
+    @abstractmethod
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        """
+        Create an embedding for each of the texts.
+
+        Args:
+            texts (list[str]): The texts to embed.
+
+        Returns:
+            list[list[float]]: The embeddings (in the same order).
+        """
+        pass
+
+    def __str__(self) -> str:
+        return f'{self.__class__.__name__}({self.name}, {self.dimension})'
+
+
+class OpenAIEmbedder(BaseEmbedder):
+    """
+    Embeddings from the OpenAI API (all texts are sent in one request).
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        model_name: str = 'text-embedding-3-small',
+        dimension: int = 1536,
+        base_url: str | None = None,
+    ):
+        super().__init__(model_name, dimension)
+
+        # The client of the models is shared, but the embeddings are not
+        # retried by a model, so the SDK retries them
+        self.client = openai_client(api_key, base_url).with_options(
+            max_retries=2,
+        )
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+
+        # The API does not accept empty strings
+        texts = [text or ' ' for text in texts]
+        response = self.client.embeddings.create(
+            input=texts,
+            model=self.name,
+        )
+
+        return [
+            item.embedding
+            for item in sorted(response.data, key=lambda item: item.index)
+        ]
+
+
+class HashingEmbedder(BaseEmbedder):
+    """
+    Local embeddings using the hashing trick (no network, no model files).
+
+    The words and word bigrams of the text are hashed into `dimension`
+    buckets (with a hashed sign, so collisions cancel out on average) and
+    weighted by their sublinear term frequency. The vectors are normalized,
+    so the cosine similarity is the (hashed) tf similarity of the texts.
+    """
+
+    def __init__(self, dimension: int = 1024):
+        super().__init__(f'hashing-{dimension}', dimension)
+
+    def _bucket(self, token: str) -> tuple[int, float]:
+
+        digest = hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest()
+        value = int.from_bytes(digest, 'little')
+        sign = 1.0 if value & 1 else -1.0
+        return (value >> 1) % self.dimension, sign
+
+    def _embed_one(self, text: str) -> list[float]:
+
+        words = TOKEN_RE.findall(text.lower())
+        tokens = words + [
+            f'{first} {second}' for first, second in zip(words, words[1:])
+        ]
+
+        # Plain python: the vectors are sparse, and the CLI does not have to
+        # import numpy when retrieval is disabled
+        vector = [0.0] * self.dimension
+        for token, count in Counter(tokens).items():
+            bucket, sign = self._bucket(token)
+            vector[bucket] += sign * (1.0 + math.log(count))
+
+        norm = math.sqrt(sum(value * value for value in vector))
+        if norm > 0:
+            vector = [value / norm for value in vector]
+
+        return vector
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        return [self._embed_one(text) for text in texts]
+
+
+EMBEDDERS = ('openai', 'hashing')
+
+
+def get_embedder(name: str, openai_key: str | None = None) -> BaseEmbedder:
+    """
+    Create an embedder by name.
+
+    Args:
+        name (str): `openai` or `hashing` (local, offline).
+        openai_key (str|None): The OpenAI API key (for `openai`).
+
+    Returns:
+        BaseEmbedder: The embedder.
+    """
+
+    if name == 'openai':
+        if not openai_key:
+            raise ValueError('The openai embedder requires an OpenAI key')
+        return OpenAIEmbedder(openai_key)
+    elif name == 'hashing':
+        return HashingEmbedder()
+
+    raise ValueError(f'Unknown embedder: {name}')
@@ -0,0 +1,293 @@
+import threading
+from collections.abc import Callable
+from typing import NamedTuple
+
+import psycopg
+from loguru import logger
+from psycopg import sql
+
+# Text search configuration of the problem statement index
+TEXT_SEARCH_CONFIG = 'english'
+# Key of the advisory lock that serializes migrations between processes
+MIGRATION_LOCK_KEY = 7_241_003
+
+
+class Migration(NamedTuple):
+    """
+    A versioned change of the retrieval schema.
+
+    Note: the first migrations have to be idempotent, because databases
+    created before the migrations were versioned already contain (part of)
+    their tables.
+    """
+
+    version: int
+    name: str
+    # Applies the migration, called with a cursor and the embedding dimension
+    apply: Callable[[psycopg.Cursor, int], None]
+
+
+def _create_tables(cur: psycopg.Cursor, vector_dimension: int) -> None:
+
+    cur.execute('CREATE EXTENSION IF NOT EXISTS vector;')
+    # Note: the dimension is part of the type, so it can not be passed as a
+    # query parameter
+    cur.execute(
+        sql.SQL("""
+    CREATE TABLE IF NOT EXISTS puzzles (
+      id SERIAL PRIMARY KEY,
+      year INT NOT NULL,
+      day INT NOT NULL,
+      full_description TEXT,
+      problem_statement TEXT,
+      keywords TEXT,
+      underlying_concepts TEXT,
+      embedding VECTOR({vector_dimension}),
+      UNIQUE(year, day)
+    );
+    CREATE INDEX IF NOT EXISTS idx_embedding ON puzzles
+        USING ivfflat (embedding vector_l2_ops) WITH (lists = 100);
+    """).format(vector_dimension=sql.Literal(vector_dimension)),
+    )
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS solutions (
+      id SERIAL PRIMARY KEY,
+      puzzle_id INT NOT NULL,
+      code TEXT NOT NULL,
+      author VARCHAR(255),
+      source VARCHAR(255),
+      created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+      FOREIGN KEY (puzzle_id) REFERENCES puzzles(id)
+        ON DELETE CASCADE
+    );
+    CREATE INDEX IF NOT EXISTS idx_solutions_puzzle_id ON solutions(puzzle_id);
+    """)
+
+
+def _create_embedding_meta(cur: psycopg.Cursor, vector_dimension: int) -> None:
+
+    # The corpus version is bumped whenever puzzles or solutions are added,
+    # to invalidate cached retrieval results
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS embedding_meta (
+      id INT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+      embedder TEXT NOT NULL,
+      dimension INT NOT NULL
+    );
+    ALTER TABLE embedding_meta
+        ADD COLUMN IF NOT EXISTS corpus_version INT NOT NULL DEFAULT 0;
+    """)
+
+
+def _add_solution_hashes(cur: psycopg.Cursor, vector_dimension: int) -> None:
+
+    # Hash of the normalized code (see `utils.code_hash`) to deduplicate
+    # solutions, and the size for the selection
+    cur.execute("""
+    ALTER TABLE solutions
+        ADD COLUMN IF NOT EXISTS code_hash TEXT,
+        ADD COLUMN IF NOT EXISTS code_length INT,
+        ADD COLUMN IF NOT EXISTS language TEXT,
+        ADD COLUMN IF NOT EXISTS tokens INT;
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_solutions_code_hash
+        ON solutions(puzzle_id, code_hash);
+    """)
+
+
+def _create_puzzle_embeddings(
+    cur: psycopg.Cursor,
+    vector_dimension: int,
+) -> None:
+
+    # Per field embeddings (normalized), the similarity is the weighted sum
+    # of the similarities of the fields
+    cur.execute(
+        sql.SQL("""
+    CREATE TABLE IF NOT EXISTS puzzle_embeddings (
+      puzzle_id INT NOT NULL,
+      field TEXT NOT NULL,
+      embedding VECTOR({vector_dimension}) NOT NULL,
+      PRIMARY KEY (puzzle_id, field),
+      FOREIGN KEY (puzzle_id) REFERENCES puzzles(id)
+        ON DELETE CASCADE
+    );
+    """).format(vector_dimension=sql.Literal(vector_dimension)),
+    )
+
+
+def _create_solution_rankings(
+    cur: psycopg.Cursor,
+    vector_dimension: int,
+) -> None:
+
+    # Precomputed top ranked solution (and plan) for each puzzle, per
+    # version of the ranking (see scripts/rank_solutions.py)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS solution_rankings (
+      puzzle_id INT NOT NULL,
+      version TEXT NOT NULL,
+      solution_id INT NOT NULL,
+      plan TEXT NOT NULL,
+      justification TEXT,
+      created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+      PRIMARY KEY (puzzle_id, version),
+      FOREIGN KEY (puzzle_id) REFERENCES puzzles(id)
+        ON DELETE CASCADE,
+      FOREIGN KEY (solution_id) REFERENCES solutions(id)
+        ON DELETE CASCADE
+    );
+    """)
+
+
+def _create_lexical_search(
+    cur: psycopg.Cursor,
+    vector_dimension: int,
+) -> None:
+
+    # Normalized keywords and concepts (see `core.retreival.normalize_tag`),
+    # indexed by tag, and a full text index over the problem statement
+    cur.execute(
+        sql.SQL("""
+    CREATE TABLE IF NOT EXISTS puzzle_tags (
+      puzzle_id INT NOT NULL,
+      kind TEXT NOT NULL,
+      tag TEXT NOT NULL,
+      PRIMARY KEY (puzzle_id, kind, tag),
+      FOREIGN KEY (puzzle_id) REFERENCES puzzles(id)
+        ON DELETE CASCADE
+    );
+    CREATE INDEX IF NOT EXISTS idx_puzzle_tags_tag ON puzzle_tags(tag);
+    ALTER TABLE puzzles ADD COLUMN IF NOT EXISTS
+        problem_tsv TSVECTOR GENERATED ALWAYS AS (
+            to_tsvector({config}, coalesce(problem_statement, ''))
+        ) STORED;
+    CREATE INDEX IF NOT EXISTS idx_puzzles_problem_tsv
+        ON puzzles USING GIN (problem_tsv);
+    """).format(config=sql.Literal(TEXT_SEARCH_CONFIG)),
+    )
+
+
+# New migrations are appended (never change an applied migration)
+MIGRATIONS = (
+    Migration(1, 'create puzzles and solutions', _create_tables),
+    Migration(2, 'create embedding meta', _create_embedding_meta),
+    Migration(3, 'add solution hashes', _add_solution_hashes),
+    Migration(4, 'create puzzle embeddings', _create_puzzle_embeddings),
+    Migration(5, 'create solution rankings', _create_solution_rankings),
+    Migration(6, 'create lexical search', _create_lexical_search),
+)
+LATEST_VERSION = MIGRATIONS[-1].version
+
+# The tables of the schema (dropped in `drop_schema`)
+TABLES = (
+    'solution_rankings',
+    'solutions',
+    'puzzle_embeddings',
+    'puzzle_tags',
+    'puzzles',
+    'embedding_meta',
+    'schema_migrations',
+)
+
+# The schemas that are known to be up to date in this process
+_ready_schemas: set[tuple] = set()
+_ready_lock = threading.Lock()
+
+
+def schema_version(cur: psycopg.Cursor) -> int:
+    """
+    The version of the last applied migration (0 for a new database).
+    """
+
+    cur.execute("SELECT to_regclass('schema_migrations');")
+    table = cur.fetchone()
+    if table is None or table[0] is None:
+        return 0
+
+    cur.execute('SELECT MAX(version) FROM schema_migrations;')
+    version = cur.fetchone()
+    return version[0] if version is not None and version[0] else 0
+
+
+def migrate(cur: psycopg.Cursor, vector_dimension: int) -> list[int]:
+    """
+    Apply the pending migrations (in the transaction of the cursor).
+
+    Concurrent migrations (e.g. parallel benchmark workers on a new
+    database) are serialized by an advisory lock, so every migration is
+    applied once.
+
+    Args:
+        cur (psycopg.Cursor): The cursor.
+        vector_dimension (int): The dimension of the embeddings.
+
+    Returns:
+        list[int]: The versions of the applied migrations.
+    """
+
+    if schema_version(cur) >= LATEST_VERSION:
+        return []
+
+    cur.execute('SELECT pg_advisory_xact_lock(%s);', (MIGRATION_LOCK_KEY,))
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+      version INT PRIMARY KEY,
+      name TEXT NOT NULL,
+      applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+    # Another process may have migrated while waiting for the lock
+    version = schema_version(cur)
+
+    applied = []
+    for migration in MIGRATIONS:
+        if migration.version <= version:
+            continue
+
+        logger.info(
+            f'Applying migration {migration.version}: {migration.name}',
+        )
+        migration.apply(cur, vector_dimension)
+        cur.execute(
+            """
+        INSERT INTO schema_migrations (version, name) VALUES (%s, %s);
+        """, (migration.version, migration.name),
+        )
+        applied.append(migration.version)
+
+    return applied
+
+
+def drop_schema(cur: psycopg.Cursor) -> None:
+    """
+    Drop all tables of the schema (and forget that it was ready).
+    """
+
+    cur.execute(
+        sql.SQL('DROP TABLE IF EXISTS {tables} CASCADE;').format(
+            tables=sql.SQL(', ').join(
+                sql.Identifier(table) for table in TABLES
+            ),
+        ),
+    )
+    with _ready_lock:
+        _ready_schemas.clear()
+
+
+def is_schema_ready(*key) -> bool:
+    """
+    Whether the schema identified by `key` (e.g. the connection string and
+    the embedder) was migrated and checked in this process.
+    """
+
+    with _ready_lock:
+        return key in _ready_schemas
+
+
+def mark_schema_ready(*key) -> None:
+    """
+    Remember that the schema identified by `key` is up to date.
+    """
+
+    with _ready_lock:
+        _ready_schemas.add(key)
@@ -59,6 +59,22 @@ class Orchestrator:
                 state = current_agent.process(state)
                 self.logger.trace(pformat(state))
 
+                if state.remaining_time() == 0 and not state.is_solved:
+                    # The requests of the agent were cancelled, so the
+                    # following agents would only work on partial results
+                    state.deadline_exceeded_by = current_agent.name
+                    state.agent_errors.append(
+                        {
+                            'agent': current_agent.name,
+                            'error': 'deadline exceeded',
+                        },
+                    )
+                    self.logger.warning(
+                        f'Deadline exceeded in {current_agent.name}, '
+                        'stopping',
+                    )
+                    break
+
             if state.is_solved:
                 self.logger.success('Puzzle solved!')
                 break
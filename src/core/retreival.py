@@ -1,13 +1,33 @@
+import threading
 from dataclasses import asdict
 from dataclasses import dataclass
+from typing import Any
 from typing import Literal
+from typing import NamedTuple
 
 import numpy as np
 import psycopg
 from agents.pre_processing_agent import PreProcessingAgent
+from core.embeddings import BaseEmbedder
+from core.embeddings import OpenAIEmbedder
+from core.migrations import drop_schema
+from core.migrations import is_schema_ready
+from core.migrations import mark_schema_ready
+from core.migrations import migrate
+from core.migrations import TEXT_SEARCH_CONFIG
+from core.retreival_cache import cache_key
+from core.retreival_cache import puzzle_fingerprint
+from core.retreival_cache import RetreivalCache
 from core.state import MainState
 from loguru import logger
-from openai import OpenAI
+from pgvector.psycopg.vector import register_vector_info
+from psycopg import sql
+from psycopg.adapt import PyFormat
+from psycopg.types import TypeInfo
+from utils.code_hash import code_hash
+from utils.code_hash import is_python
+from utils.solution_selection import select_diverse
+from utils.tokens import count_tokens
 from utils.util_types import Puzzle
 
 
@@ -17,6 +37,22 @@ DEFAULT_WEIGHTS = {
     'underlying_concepts': 0.4,
     'keywords': 0.2,
 }
+# The fields that are embedded (and stored) separately, so that the weights
+# can be changed without re-embedding the puzzles
+EMBEDDING_FIELDS = tuple(DEFAULT_WEIGHTS)
+
+# Constant of the reciprocal rank fusion (score = sum of 1 / (k + rank))
+RRF_K = 60
+# Number of candidates (per requested solution) to select solutions from
+SOLUTION_CANDIDATES_FACTOR = 10
+
+
+def normalize_tag(tag: str) -> str:
+    """
+    Normalize a keyword/concept, e.g. ` Flood-Fill ` -> `flood fill`.
+    """
+
+    return ' '.join(tag.lower().replace('-', ' ').replace('_', ' ').split())
 
 
 @dataclass
@@ -29,6 +65,13 @@ class PuzzleData:
     problem_statement: str
     keywords: list[str]
     underlying_concepts: list[str]
+    # The id in the database (None if the puzzle is not stored)
+    id: int | None = None
+    # Of a similar puzzle: the weighted cosine similarity to the query
+    # puzzle (None if the puzzle has no field embeddings) and the number of
+    # stored solutions (None if unknown)
+    similarity: float | None = None
+    solutions: int | None = None
 
 
 @dataclass
@@ -38,181 +81,647 @@ class SolutionData:
     source: Literal['github', 'reddit']
     puzzle_day: int
     puzzle_year: int
+    # The id in the database (None if the solution is not stored)
+    id: int | None = None
+    # The language of the code (None if unknown)
+    language: str | None = None
+    # The number of tokens of the code (see `utils.tokens.count_tokens`)
+    tokens: int | None = None
+
 
+class RankedSolution(NamedTuple):
+    """
+    The top ranked solution of a puzzle, with the plan that describes how the
+    solution solves the puzzle.
+    """
+
+    solution: SolutionData
+    plan: str
+    justification: str
+
+
+class SolutionValues(NamedTuple):
+    """
+    The parameters of `INSERT_SOLUTION_QUERY` (in the order of its columns).
+    """
+
+    puzzle_id: int
+    code: str
+    author: str
+    source: str
+    code_hash: str
+    code_length: int
+    language: str | None
+    tokens: int
+
+
+# The pgvector type of each database (see `register_vector_type`)
+_vector_types: dict[str, TypeInfo | None] = {}
+_vector_types_lock = threading.Lock()
+
+# Queries shared by the sync and the async retrieval (see
+# `core.async_retreival`)
+CORPUS_VERSION_QUERY = 'SELECT corpus_version FROM embedding_meta;'
+BUMP_CORPUS_VERSION_QUERY = (
+    'UPDATE embedding_meta SET corpus_version = corpus_version + 1;'
+)
+PUZZLE_ID_QUERY = """
+SELECT id FROM puzzles
+WHERE year = %s AND day = %s;
+"""
+INSERT_PUZZLE_QUERY = """
+INSERT INTO puzzles (
+    year, day, full_description, problem_statement,
+    keywords, underlying_concepts, embedding
+) VALUES (%s, %s, %s, %s, %s, %s, %b)
+RETURNING id;
+"""
+INSERT_FIELD_EMBEDDING_QUERY = """
+INSERT INTO puzzle_embeddings (puzzle_id, field, embedding)
+VALUES (%s, %s, %b::vector)
+ON CONFLICT (puzzle_id, field)
+DO UPDATE SET embedding = EXCLUDED.embedding;
+"""
+INSERT_TAG_QUERY = """
+INSERT INTO puzzle_tags (puzzle_id, kind, tag)
+VALUES (%s, %s, %s)
+ON CONFLICT DO NOTHING;
+"""
+EXISTING_SOLUTION_QUERY = """
+SELECT id FROM solutions
+WHERE puzzle_id = %s AND (author = %s OR code_hash = %s);
+"""
+INSERT_SOLUTION_QUERY = """
+INSERT INTO solutions (
+    puzzle_id, code, author, source,
+    code_hash, code_length, language, tokens
+) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+ON CONFLICT (puzzle_id, code_hash) DO NOTHING
+RETURNING id;
+"""
+# The smallest solutions are the candidates for the selection
+SOLUTION_CANDIDATES_QUERY = """
+SELECT s.code, s.author, s.source, s.id, s.language, s.tokens
+FROM solutions s
+JOIN puzzles p ON p.id = s.puzzle_id
+WHERE p."day" = %(day)s AND p."year" = %(year)s
+  AND (%(language)s::text IS NULL OR lower(s.language) = lower(%(language)s))
+ORDER BY s.tokens ASC NULLS LAST, s.id
+LIMIT %(limit)s;
+"""
+
+
+def puzzle_values(puzzle: PuzzleData, embedding: np.ndarray) -> tuple:
+    """
+    The parameters of `INSERT_PUZZLE_QUERY`.
+    """
+
+    return (
+        puzzle.year,
+        puzzle.day,
+        puzzle.full_description,
+        puzzle.problem_statement,
+        puzzle.keywords,
+        puzzle.underlying_concepts,
+        embedding,
+    )
+
+
+def field_embedding_rows(
+    puzzle_id: int,
+    field_embeddings: dict[str, np.ndarray],
+) -> list[tuple]:
+    """
+    The parameters of `INSERT_FIELD_EMBEDDING_QUERY` (one row per field).
+    """
+
+    return [
+        (puzzle_id, field, embedding)
+        for field, embedding in field_embeddings.items()
+    ]
+
+
+def tag_rows(puzzle_id: int, puzzle: PuzzleData) -> list[tuple]:
+    """
+    The parameters of `INSERT_TAG_QUERY` (one row per normalized tag).
+    """
+
+    tags = {
+        (kind, normalize_tag(tag))
+        for kind, values in (
+            ('keyword', puzzle.keywords),
+            ('concept', puzzle.underlying_concepts),
+        )
+        for tag in values
+        if normalize_tag(tag)
+    }
+    return [(puzzle_id, kind, tag) for kind, tag in sorted(tags)]
+
+
+def solution_values(puzzle_id: int, solution: SolutionData) -> SolutionValues:
+    """
+    The parameters of `INSERT_SOLUTION_QUERY`.
+    """
+
+    language = solution.language
+    if language is None and is_python(solution.code):
+        language = 'python'
+
+    return SolutionValues(
+        puzzle_id=puzzle_id,
+        code=solution.code,
+        author=solution.author,
+        source=solution.source,
+        code_hash=code_hash(solution.code, language),
+        code_length=len(solution.code),
+        language=language,
+        tokens=count_tokens(solution.code),
+    )
+
+
+def similar_puzzles_query(
+    puzzles: list[PuzzleData],
+    query_embeddings: np.ndarray,
+    fields: tuple[str, ...],
+    lexical: bool,
+    limit: int,
+    weight_total: float = 1.0,
+) -> tuple[sql.Composed, dict[str, Any]]:
+    """
+    Build the query for the most similar puzzles of each of the puzzles (all
+    answered in one round trip).
+
+    The vector similarity is the weighted sum of the cosine similarities
+    of the fields, computed in the database from the stored field
+    embeddings, so the weights can be changed without re-embedding: the
+    query embeddings are scaled by the weights (see
+    `BaseRetreival._compute_query_embeddings`) and the stored embeddings are
+    normalized, so the sum of the inner products is the weighted similarity.
+    If `lexical` is set, the vector ranking is fused with the rankings by
+    matching tags and by full text search on the problem statement
+    (reciprocal rank fusion), so exact concept matches surface even if the
+    embeddings miss them.
+
+    The rows include the vector similarity of every puzzle (divided by the
+    total weight, so it is a weighted mean of the cosine similarities) and
+    its number of solutions, so weak matches and puzzles without solutions
+    can be skipped before any further work.
+
+    Note: the embeddings are sent in the binary format, so the connection
+    needs the pgvector adapters (see `register_vector_type`).
+
+    Args:
+        puzzles (list[PuzzleData]): The (pre-processed) puzzles.
+        query_embeddings (np.ndarray): The (N puzzles, F fields, D) query
+            embeddings.
+        fields (tuple[str, ...]): The fields (F) of the query embeddings.
+        lexical (bool): Fuse with the lexical rankings.
+        limit (int): The number of puzzles per query.
+        weight_total (float): The sum of the weights of the fields.
+
+    Returns:
+        tuple[sql.Composed, dict[str, Any]]: The query and its parameters
+            (the rows are read with `puzzle_from_row`, the last column is
+            the index of the query puzzle).
+    """
+
+    params: dict[str, Any] = {
+        'limit': limit,
+        'rrf_k': RRF_K,
+        'weight_total': weight_total or 1.0,
+    }
+    query_values: list[sql.Composable] = []
+    for query_id, embeddings in enumerate(query_embeddings):
+        for field, embedding in zip(fields, embeddings):
+            name = f'embedding_{len(query_values)}'
+            query_values.append(
+                sql.SQL('({}, {}, {}::vector)').format(
+                    sql.Literal(query_id),
+                    sql.Literal(field),
+                    sql.Placeholder(name, format=PyFormat.BINARY),
+                ),
+            )
+            params[name] = embedding
+
+    ctes = [
+        sql.SQL("""
+    query_fields (query_id, field, embedding) AS (
+        VALUES {query_values}
+    )""").format(query_values=sql.SQL(', ').join(query_values)),
+        # <#> is the negative inner product
+        sql.SQL("""
+    similarities (query_id, puzzle_id, similarity) AS (
+        SELECT q.query_id, e.puzzle_id,
+               SUM(-(e.embedding <#> q.embedding)) / %(weight_total)s
+        FROM puzzle_embeddings e
+        JOIN query_fields q ON q.field = e.field
+        GROUP BY q.query_id, e.puzzle_id
+    )"""),
+    ]
+    # Each ranking is a list of (query_id, puzzle_id, rank)
+    rankings = [
+        sql.SQL("""
+        SELECT query_id, puzzle_id, RANK() OVER (
+            PARTITION BY query_id ORDER BY similarity DESC
+        ) AS rank
+        FROM similarities
+        """),
+    ]
+    if lexical:
+        tag_queries = []
+        tags = []
+        for query_id, puzzle in enumerate(puzzles):
+            puzzle_tags = {
+                normalize_tag(tag)
+                for tag in puzzle.keywords + puzzle.underlying_concepts
+            } - {''}
+            tag_queries.extend([query_id] * len(puzzle_tags))
+            tags.extend(sorted(puzzle_tags))
+
+        params['tag_queries'] = tag_queries
+        params['tags'] = tags
+        params['text_queries'] = list(range(len(puzzles)))
+        params['texts'] = [puzzle.problem_statement for puzzle in puzzles]
+        ctes.extend(
+            (
+                sql.SQL("""
+    query_tags (query_id, tag) AS (
+        SELECT * FROM unnest(%(tag_queries)s::int[], %(tags)s::text[])
+    )"""),
+                # Match any of the words of the problem statement
+                # (plainto_tsquery would require all of them)
+                sql.SQL("""
+    query_texts (query_id, query) AS (
+        SELECT query_id, replace(
+            plainto_tsquery({config}, text)::text, '&', '|'
+        )::tsquery
+        FROM unnest(%(text_queries)s::int[], %(texts)s::text[])
+            AS texts (query_id, text)
+    )""").format(config=sql.Literal(TEXT_SEARCH_CONFIG)),
+            ),
+        )
+        rankings.extend(
+            (
+                sql.SQL("""
+        SELECT q.query_id, t.puzzle_id, RANK() OVER (
+            PARTITION BY q.query_id ORDER BY COUNT(*) DESC
+        ) AS rank
+        FROM puzzle_tags t
+        JOIN query_tags q ON q.tag = t.tag
+        GROUP BY q.query_id, t.puzzle_id
+        """),
+                sql.SQL("""
+        SELECT q.query_id, p.id, RANK() OVER (
+            PARTITION BY q.query_id
+            ORDER BY ts_rank_cd(p.problem_tsv, q.query) DESC
+        ) AS rank
+        FROM puzzles p
+        JOIN query_texts q ON p.problem_tsv @@ q.query
+        """),
+            ),
+        )
 
-class PuzzleRetreival:
+    query = sql.SQL("""
+    WITH {ctes},
+    fused AS (
+        SELECT query_id, puzzle_id, SUM(1.0 / (%(rrf_k)s + rank)) AS score
+        FROM ({rankings}) AS rankings (query_id, puzzle_id, rank)
+        GROUP BY query_id, puzzle_id
+    ),
+    ranked AS (
+        SELECT query_id, puzzle_id, score, ROW_NUMBER() OVER (
+            PARTITION BY query_id ORDER BY score DESC
+        ) AS position
+        FROM fused
+    )
+    SELECT p.id, p.year, p.day, p.full_description,
+           p.problem_statement, p.keywords, p.underlying_concepts,
+           s.similarity,
+           (SELECT COUNT(*) FROM solutions s2 WHERE s2.puzzle_id = p.id),
+           t.score, t.query_id
+    FROM ranked t
+    JOIN puzzles p ON p.id = t.puzzle_id
+    LEFT JOIN similarities s
+        ON s.query_id = t.query_id AND s.puzzle_id = t.puzzle_id
+    WHERE t.position <= %(limit)s
+    ORDER BY t.query_id, t.position;
+    """).format(
+        ctes=sql.SQL(',').join(ctes),
+        rankings=sql.SQL(' UNION ALL ').join(
+            sql.SQL('({})').format(ranking) for ranking in rankings
+        ),
+    )
+
+    return query, params
+
+
+def puzzle_from_row(row: tuple) -> PuzzleData:
+    """
+    Read a row of the similar puzzles query.
+    """
+
+    return PuzzleData(
+        year=row[1],
+        day=row[2],
+        full_description=row[3],
+        problem_statement=row[4],
+        keywords=row[5],
+        underlying_concepts=row[6],
+        id=row[0],
+        similarity=float(row[7]) if row[7] is not None else None,
+        solutions=row[8],
+    )
+
+
+def register_vector_type(
+    conn: psycopg.Connection,
+    connection_string: str,
+) -> None:
+    """
+    Register the pgvector adapters on a connection, so numpy arrays are sent
+    as (binary) vectors. The vector type is looked up once per database in
+    this process.
+
+    Args:
+        conn (psycopg.Connection): The connection.
+        connection_string (str): The connection string (identifies the
+            database).
+    """
+
+    with _vector_types_lock:
+        info = _vector_types.get(connection_string)
+    if info is None:
+        info = TypeInfo.fetch(conn, 'vector')
+        with _vector_types_lock:
+            _vector_types[connection_string] = info
+
+    register_vector_info(conn, info)
+
+
+def solution_candidates_params(
+    puzzle_year: int,
+    puzzle_day: int,
+    limit: int,
+    language: str | None,
+) -> dict[str, Any]:
+    """
+    The parameters of `SOLUTION_CANDIDATES_QUERY`.
+    """
+
+    return {
+        'year': puzzle_year,
+        'day': puzzle_day,
+        'language': language,
+        'limit': max(limit * SOLUTION_CANDIDATES_FACTOR, limit),
+    }
+
+
+def select_solutions(
+    rows: list[tuple],
+    puzzle_year: int,
+    puzzle_day: int,
+    limit: int,
+    token_budget: int | None,
+) -> list[SolutionData]:
+    """
+    Select diverse solutions within the token budget from the rows of
+    `SOLUTION_CANDIDATES_QUERY` (see `utils.solution_selection`).
+    """
+
+    candidates = [
+        SolutionData(
+            code=row[0],
+            author=row[1],
+            source=row[2],
+            puzzle_day=puzzle_day,
+            puzzle_year=puzzle_year,
+            id=row[3],
+            language=row[4],
+            tokens=row[5] if row[5] is not None else count_tokens(row[0]),
+        ) for row in rows
+    ]
+
+    selected = select_diverse(
+        [candidate.code for candidate in candidates],
+        [candidate.tokens or 0 for candidate in candidates],
+        limit=limit,
+        token_budget=token_budget,
+    )
+
+    return [candidates[i] for i in selected]
+
+
+class BaseRetreival:
+    """
+    The settings, embeddings and cache keys of the retrieval, shared by the
+    sync (`PuzzleRetreival`) and async (`AsyncPuzzleRetreival`) database
+    access.
+    """
 
     def __init__(
         self,
         connection_string: str,
-        openai_key: str,
+        openai_key: str | None = None,
         *,  # named arguments only
         pre_processing_agent: PreProcessingAgent | None = None,
         weights: dict[str, float] | None = None,
+        embedder: BaseEmbedder | None = None,
+        lexical: bool = True,
+        cache: RetreivalCache | None = None,
     ):
+        """
+        Args:
+            connection_string (str): The database connection string.
+            openai_key (str|None): The OpenAI API key, used for the default
+                embedder (when no embedder is given).
+            pre_processing_agent (PreProcessingAgent|None): The agent used to
+                pre-process puzzles that are added/searched by description.
+            weights (dict[str, float]|None): The weight of each field in the
+                similarity (see `EMBEDDING_FIELDS`).
+            embedder (BaseEmbedder|None): The embedder for the puzzles
+                (default: OpenAI text-embedding-3-small).
+            lexical (bool): Fuse the vector ranking with the lexical rankings
+                (matching tags and full text search on the problem statement).
+            cache (RetreivalCache|None): Cache for the similar puzzles and
+                solutions (not cached if not given).
+        """
+
+        if embedder is None:
+            if not openai_key:
+                raise ValueError('An embedder or an OpenAI key is required')
+            embedder = OpenAIEmbedder(openai_key)
 
         self.connection_string = connection_string
-        self.client = OpenAI(api_key=openai_key)
-        self.logger = logger.bind(name='PuzzleRetreival')
+        self.embedder = embedder
+        self.logger = logger.bind(name=self.__class__.__name__)
         self.pre_processing_agent = pre_processing_agent
         self.weights = weights or DEFAULT_WEIGHTS
+        self.lexical = lexical
+        self.cache = cache
 
-    def _get_connection(self, **kwargs):
-        return psycopg.connect(self.connection_string, **kwargs)
+        unknown_fields = set(self.weights) - set(EMBEDDING_FIELDS)
+        if unknown_fields:
+            raise ValueError(f'Unknown embedding fields: {unknown_fields}')
+        if not any(self.weights.values()):
+            raise ValueError('At least one field needs a non-zero weight')
 
-    def init_db(
-            self,
-            vector_dimension: int = 1536,  # Note: default is for OpenAI small
-            force: bool = False,
-    ):
+    def _create_embedding(self, text: str) -> list[float]:
+        """
+        Create an embedding for the given text.
 
-        with self._get_connection() as conn:
-            with conn.cursor() as cur:
-                # Create pgvector extension if it doesn't exist
-                cur.execute('CREATE EXTENSION IF NOT EXISTS vector;')
-                if force:
-                    # Drop tables if they exist and force is True
-                    cur.execute("""
-                    DROP TABLE IF EXISTS solutions CASCADE;
-                    DROP TABLE IF EXISTS puzzles CASCADE;
-                    """)
-
-                # Check if tables already exist
-                cur.execute("""
-                SELECT EXISTS (
-                    SELECT FROM information_schema.tables
-                    WHERE table_name = 'puzzles'
-                );
-                """)
-
-                # TODO: Check when fetchone returns None
-                # (e.g. when the table doesn't exist, async?)
-                puzzles_exists = cur.fetchone()
-                if puzzles_exists is not None:
-                    puzzles_exists = puzzles_exists[0]
-
-                if not puzzles_exists:
-                    # Create puzzles table
-                    cur.execute(
-                        """
-                    CREATE TABLE puzzles (
-                      id SERIAL PRIMARY KEY,
-                      year INT NOT NULL,
-                      day INT NOT NULL,
-                      full_description TEXT,
-                      problem_statement TEXT,
-                      keywords TEXT,
-                      underlying_concepts TEXT,
-                      embedding VECTOR({vector_dimension}),
-                      UNIQUE(year, day)
-                    );
-                    """, (vector_dimension,),
-                    )
+        Args:
+            text (str): The text to create an embedding for.
 
-                    # Create index on embedding
-                    cur.execute("""
-                    CREATE INDEX idx_embedding ON puzzles
-                    USING ivfflat (embedding vector_l2_ops) WITH (lists = 100);
-                    """)
-                    self.logger.info('Created puzzles table and index.')
-
-                # Check if solutions table exists
-                cur.execute("""
-                SELECT EXISTS (
-                    SELECT FROM information_schema.tables
-                    WHERE table_name = 'solutions'
-                );
-                """)
-
-                # TODO: Check when fetchone returns None (see above)
-                solutions_exists = cur.fetchone()
-                if solutions_exists is not None:
-                    solutions_exists = solutions_exists[0]
-
-                if not solutions_exists:
-                    # Create solutions table
-                    cur.execute("""
-                    CREATE TABLE solutions (
-                      id SERIAL PRIMARY KEY,
-                      puzzle_id INT NOT NULL,
-                      code TEXT NOT NULL,
-                      author VARCHAR(255),
-                      source VARCHAR(255),
-                      created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                      FOREIGN KEY (puzzle_id) REFERENCES puzzles(id)
-                        ON DELETE CASCADE
-                    );
-                    """)
-                    # Create index on puzzle_id
-                    cur.execute("""
-                    CREATE INDEX idx_solutions_puzzle_id ON
-                        solutions(puzzle_id);
-                    """)
-                    self.logger.info('Created solutions table and index.')
+        Returns:
+            list[float]: The embedding vector.
+        """
 
-                conn.commit()
-                self.logger.info('Database initialization complete.')
+        return self._create_embeddings([text])[0]
 
-    def _create_embedding(self, text: str) -> list[float]:
+    def _create_embeddings(self, texts: list[str]) -> list[list[float]]:
         """
-        Create an embedding for the given text using OpenAI's API.
+        Create the embeddings for the given texts (in one batch).
 
         Args:
-            text (str): The text to create an embedding for.
+            texts (list[str]): The texts to create embeddings for.
 
         Returns:
-            list[float]: The embedding vector.
+            list[list[float]]: The embedding vectors.
         """
 
-        self.logger.trace(f'Creating embedding for {text=}')
+        self.logger.trace(f'Creating embeddings for {texts=}')
 
-        # Check that the text is not empty
-        if not text:
+        # Check that the texts are not empty
+        if not all(texts):
             self.logger.warning('Empty text provided for embedding.')
-            text = ' '
+            texts = [text or ' ' for text in texts]
 
-        response = self.client.embeddings.create(
-            input=text,
-            model='text-embedding-3-small',
-        )
+        return self.embedder.embed(texts)
+
+    def _compute_field_embeddings_batch(
+        self,
+        puzzles: list[PuzzleData],
+        fields: tuple[str, ...] = EMBEDDING_FIELDS,
+    ) -> np.ndarray:
+        """
+        Compute the (normalized) embedding of each field of the puzzles, in
+        one request to the embedder.
 
-        return response.data[0].embedding
+        Args:
+            puzzles (list[PuzzleData]): The puzzles.
+            fields (tuple[str, ...]): The fields to embed.
 
-    def _compute_weighted_embedding(
+        Returns:
+            np.ndarray: The (N puzzles, F fields, D dimensions) float32
+                embeddings.
+        """
+
+        texts = []
+        for puzzle in puzzles:
+            puzzle_data = asdict(puzzle)
+            for field in fields:
+                value = puzzle_data[field]
+                # Keywords and concepts are lists, embed them as one text
+                if isinstance(value, list):
+                    value = ', '.join(value)
+                texts.append(value)
+
+        embeddings = np.asarray(
+            self._create_embeddings(texts), dtype=np.float32,
+        ).reshape(len(puzzles), len(fields), -1)
+        norms = np.linalg.norm(embeddings, axis=2, keepdims=True)
+        return embeddings / np.where(norms > 0, norms, 1.0)
+
+    def _compute_field_embeddings(
         self,
         puzzle: PuzzleData,
-    ) -> list[float]:
+        fields: tuple[str, ...] = EMBEDDING_FIELDS,
+    ) -> dict[str, np.ndarray]:
         """
-        Compute a weighted composite embedding for the puzzle.
+        Compute the (normalized) embedding of each field of the puzzle.
 
         Args:
             puzzle (PuzzleData): The puzzle data.
+            fields (tuple[str, ...]): The fields to embed.
 
         Returns:
-            list[float]: The composite embedding.
+            dict[str, np.ndarray]: The embedding of each field.
         """
 
-        puzzle_data = asdict(puzzle)
-        # THis assumes that all the fields have a weight
-        # if they need to be included in the compsite embedding
-        embeddings = {}
-        for field in self.weights:
-            embeddings[field] = np.array(
-                self._create_embedding(puzzle_data[field]),
-            )
+        embeddings = self._compute_field_embeddings_batch([puzzle], fields)
+        return dict(zip(fields, embeddings[0]))
+
+    def _weight_vector(self, fields: tuple[str, ...]) -> np.ndarray:
+        return np.array(
+            [self.weights.get(field, 0.0) for field in fields],
+            dtype=np.float32,
+        )
+
+    def _compute_weighted_embeddings(
+        self,
+        field_embeddings: np.ndarray,
+        fields: tuple[str, ...] = EMBEDDING_FIELDS,
+    ) -> np.ndarray:
+        """
+        Compute the weighted composite embeddings from the field embeddings.
 
-        # Calculate the composite embedding
-        composite_embedding = np.zeros_like(list(embeddings.values())[0])
-        for field, weight in self.weights.items():
-            weighted_embedding = weight * embeddings[field]
-            composite_embedding += weighted_embedding
+        Note: the composite embedding (`puzzles.embedding`) is only kept for
+        compatibility, the search uses the per field embeddings.
 
-        # Normalize the embedding
-        norm = np.linalg.norm(composite_embedding)
-        if norm > 0:
-            composite_embedding = composite_embedding / norm
+        Args:
+            field_embeddings (np.ndarray): The (N, F, D) field embeddings.
+            fields (tuple[str, ...]): The fields (F) of the embeddings.
 
-        return composite_embedding.tolist()
+        Returns:
+            np.ndarray: The (N, D) normalized composite embeddings.
+        """
+
+        composite = np.einsum(
+            'nfd,f->nd', field_embeddings, self._weight_vector(fields),
+        )
+        norms = np.linalg.norm(composite, axis=1, keepdims=True)
+        return composite / np.where(norms > 0, norms, 1.0)
+
+    def _compute_weighted_embedding(
+        self,
+        field_embeddings: dict[str, np.ndarray],
+    ) -> np.ndarray:
+        """
+        Compute the weighted composite embedding of one puzzle (see
+        `_compute_weighted_embeddings`).
+        """
+
+        fields = tuple(field_embeddings)
+        stacked = np.stack([field_embeddings[field] for field in fields])
+        return self._compute_weighted_embeddings(
+            stacked[np.newaxis], fields,
+        )[0]
+
+    def _compute_query_embeddings(
+        self,
+        puzzles: list[PuzzleData],
+    ) -> np.ndarray:
+        """
+        Compute the query embeddings of the puzzles for
+        `similar_puzzles_query`: the normalized field embeddings scaled by
+        the field weights, so the inner product with the stored field
+        embeddings is the weighted cosine similarity.
+
+        Args:
+            puzzles (list[PuzzleData]): The (pre-processed) puzzles.
+
+        Returns:
+            np.ndarray: The (N, F, D) query embeddings of the fields with a
+                weight (see `_query_fields`).
+        """
+
+        fields = self._query_fields()
+        field_embeddings = self._compute_field_embeddings_batch(
+            puzzles, fields,
+        )
+        return np.einsum(
+            'nfd,f->nfd', field_embeddings, self._weight_vector(fields),
+        )
 
     def _state_to_puzzle_data(self, state: MainState) -> PuzzleData:
         """
@@ -228,6 +737,208 @@ class PuzzleRetreival:
             underlying_concepts=state.underlying_concepts,
         )
 
+    def _query_fields(self) -> tuple[str, ...]:
+        """
+        The fields that are needed for a query (the fields with a weight).
+        """
+
+        return tuple(
+            field for field, weight in self.weights.items() if weight != 0
+        )
+
+    def _weight_total(self) -> float:
+        """
+        The sum of the weights of the query fields (to normalize the
+        similarity).
+        """
+
+        return float(self._weight_vector(self._query_fields()).sum())
+
+    def _similar_puzzles_key(
+        self,
+        puzzle_data: PuzzleData,
+        limit: int,
+        corpus_version: int,
+    ) -> str:
+
+        return cache_key(
+            kind='similar_puzzles',
+            puzzle=puzzle_fingerprint(
+                puzzle_data.year,
+                puzzle_data.day,
+                puzzle_data.full_description,
+                puzzle_data.problem_statement,
+                puzzle_data.keywords,
+                puzzle_data.underlying_concepts,
+            ),
+            weights=self.weights,
+            lexical=self.lexical,
+            limit=limit,
+            embedder=self.embedder.name,
+            corpus_version=corpus_version,
+        )
+
+    def _solutions_key(
+        self,
+        puzzle_year: int,
+        puzzle_day: int,
+        limit: int,
+        token_budget: int | None,
+        language: str | None,
+        corpus_version: int,
+    ) -> str:
+
+        return cache_key(
+            kind='solutions',
+            year=puzzle_year,
+            day=puzzle_day,
+            limit=limit,
+            token_budget=token_budget,
+            language=language,
+            corpus_version=corpus_version,
+        )
+
+
+class PuzzleRetreival(BaseRetreival):
+    """
+    Retrieval of similar puzzles and their solutions (pgvector).
+    """
+
+    def _get_connection(self, **kwargs):
+        return psycopg.connect(self.connection_string, **kwargs)
+
+    def _get_vector_connection(self, **kwargs):
+        """
+        A connection with the pgvector adapters (for queries that send
+        embeddings).
+        """
+
+        conn = self._get_connection(**kwargs)
+        register_vector_type(conn, self.connection_string)
+        return conn
+
+    def init_db(
+            self,
+            vector_dimension: int | None = None,
+            force: bool = False,
+    ):
+        """
+        Migrate the database to the latest schema (see `core.migrations`).
+
+        The embedder (name and dimension) is recorded in the `embedding_meta`
+        table, so that a database created with one embedder is not queried
+        with another one. Once the schema is up to date it is not checked
+        again in this process, so creating many retrievals (e.g. an agent per
+        puzzle) does not query the database.
+
+        Args:
+            vector_dimension (int|None): The dimension of the embeddings
+                (default: the dimension of the embedder).
+            force (bool): Drop the existing tables first.
+
+        Raises:
+            ValueError: If the database was created with another embedder.
+        """
+
+        if vector_dimension is None:
+            vector_dimension = self.embedder.dimension
+
+        schema_key = (
+            self.connection_string, self.embedder.name, vector_dimension,
+        )
+        if not force and is_schema_ready(*schema_key):
+            return
+
+        with self._get_connection() as conn:
+            with conn.cursor() as cur:
+                if force:
+                    drop_schema(cur)
+
+                applied = migrate(cur, vector_dimension)
+                self._check_embedding_meta(cur, vector_dimension)
+                conn.commit()
+
+        mark_schema_ready(*schema_key)
+        if applied:
+            self.logger.info(f'Applied migrations {applied}.')
+        self.logger.debug('Database schema is up to date.')
+
+    def _check_embedding_meta(
+        self,
+        cur: psycopg.Cursor,
+        vector_dimension: int,
+    ) -> None:
+
+        # The dimension of the existing column (the type modifier of a
+        # vector column is its dimension)
+        cur.execute("""
+        SELECT atttypmod FROM pg_attribute
+        WHERE attrelid = 'puzzles'::regclass AND attname = 'embedding';
+        """)
+        column = cur.fetchone()
+        column_dimension = column[0] if column is not None else None
+        if column_dimension not in (None, -1, vector_dimension):
+            raise ValueError(
+                f'The puzzles table has {column_dimension} dimensional '
+                f'embeddings, but {self.embedder} creates {vector_dimension} '
+                'dimensional embeddings (use force to recreate the tables)',
+            )
+
+        cur.execute('SELECT embedder, dimension FROM embedding_meta;')
+        meta = cur.fetchone()
+        if meta is None:
+            # New database (or created before the meta table existed)
+            cur.execute(
+                """
+            INSERT INTO embedding_meta (embedder, dimension)
+            VALUES (%s, %s);
+            """, (self.embedder.name, vector_dimension),
+            )
+            return
+
+        embedder_name, dimension = meta
+        if (embedder_name, dimension) != (
+            self.embedder.name, vector_dimension,
+        ):
+            raise ValueError(
+                f'The database was created with the embedder {embedder_name} '
+                f'({dimension} dimensions), not with {self.embedder} '
+                '(use force to recreate the tables)',
+            )
+
+    def _bump_corpus_version(self, cur: psycopg.Cursor) -> None:
+        cur.execute(BUMP_CORPUS_VERSION_QUERY)
+
+    def _corpus_version(self) -> int:
+
+        with self._get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(CORPUS_VERSION_QUERY)
+                version = cur.fetchone()
+
+        return version[0] if version is not None else 0
+
+    def _insert_field_embeddings(
+        self,
+        cur: psycopg.Cursor,
+        puzzle_id: int,
+        field_embeddings: dict[str, np.ndarray],
+    ) -> None:
+
+        cur.executemany(
+            INSERT_FIELD_EMBEDDING_QUERY,
+            field_embedding_rows(puzzle_id, field_embeddings),
+        )
+
+    def _insert_tags(
+        self,
+        cur: psycopg.Cursor,
+        puzzle_id: int,
+        puzzle: PuzzleData,
+    ) -> None:
+
+        cur.executemany(INSERT_TAG_QUERY, tag_rows(puzzle_id, puzzle))
+
     def add_puzzle_from_state(self, state: MainState) -> int:
         """
         Add a puzzle from the state to the database.
@@ -241,41 +952,31 @@ class PuzzleRetreival:
 
         # TODO: Should we check here if the puzzle exists in the DB?
 
-        # Create the composite embedding
+        # Create the field embeddings and the composite embedding
         puzzle_data = self._state_to_puzzle_data(state)
-        embedding = self._compute_weighted_embedding(
-            puzzle_data,
-        )
+        field_embeddings = self._compute_field_embeddings(puzzle_data)
+        embedding = self._compute_weighted_embedding(field_embeddings)
 
         # Add the puzzle to the Database
-        with self._get_connection() as conn:
+        with self._get_vector_connection() as conn:
             with conn.cursor() as cur:
 
-                query = """
-                INSERT INTO puzzles (
-                    year, day, full_description, problem_statement,
-                    keywords, underlying_concepts, embedding
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s)
-                RETURNING id;
-                """
-
-                self.logger.debug(f'Executing query: {query}')
+                self.logger.debug(
+                    f'Executing query: {INSERT_PUZZLE_QUERY}',
+                )
 
                 cur.execute(
-                    query, (
-                        puzzle_data.year,
-                        puzzle_data.day,
-                        puzzle_data.full_description,
-                        puzzle_data.problem_statement,
-                        puzzle_data.keywords,
-                        puzzle_data.underlying_concepts,
-                        embedding,
-                    ),
+                    INSERT_PUZZLE_QUERY, puzzle_values(puzzle_data, embedding),
                 )
 
                 puzzle_id = cur.fetchone()
                 if puzzle_id is not None:
                     puzzle_id = puzzle_id[0]
+                    self._insert_field_embeddings(
+                        cur, puzzle_id, field_embeddings,
+                    )
+                    self._insert_tags(cur, puzzle_id, puzzle_data)
+                    self._bump_corpus_version(cur)
                     self.logger.info(
                         f'Puzzle {puzzle_data.year}-{puzzle_data.day} '
                         f'added with ID {puzzle_id}.',
@@ -310,12 +1011,7 @@ class PuzzleRetreival:
         # Check if the puzzle already exists in the DB
         with self._get_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute(
-                    """
-                SELECT id FROM puzzles
-                WHERE year = %s AND day = %s;
-                """, (puzzle.year, puzzle.day),
-                )
+                cur.execute(PUZZLE_ID_QUERY, (puzzle.year, puzzle.day))
                 exesting_puzzle = cur.fetchone()
                 if exesting_puzzle:
                     self.logger.info(
@@ -332,6 +1028,103 @@ class PuzzleRetreival:
 
         return self.add_puzzle_from_state(state)
 
+    def _fetch_puzzles(
+        self,
+        cur: psycopg.Cursor,
+        condition: sql.Composable,
+    ) -> list[tuple[int, PuzzleData]]:
+
+        # The lists are stored as postgres array literals
+        cur.execute(
+            sql.SQL("""
+        SELECT p.id, p.year, p.day, p.full_description,
+               p.problem_statement, p.keywords::text[],
+               p.underlying_concepts::text[]
+        FROM puzzles p
+        WHERE {condition};
+        """).format(condition=condition),
+        )
+
+        return [
+            (
+                row[0],
+                PuzzleData(
+                    year=row[1],
+                    day=row[2],
+                    full_description=row[3] or '',
+                    problem_statement=row[4] or '',
+                    keywords=row[5] or [],
+                    underlying_concepts=row[6] or [],
+                    id=row[0],
+                ),
+            ) for row in cur.fetchall()
+        ]
+
+    def backfill_field_embeddings(self) -> int:
+        """
+        Create the field embeddings for puzzles that do not have them (e.g.
+        puzzles added before the embeddings were stored per field).
+
+        Returns:
+            int: The number of puzzles that were updated.
+        """
+
+        with self._get_vector_connection() as conn:
+            with conn.cursor() as cur:
+                puzzles = self._fetch_puzzles(
+                    cur,
+                    sql.SQL("""(
+                    SELECT COUNT(*) FROM puzzle_embeddings e
+                    WHERE e.puzzle_id = p.id
+                ) < {n_fields}""").format(
+                        n_fields=sql.Literal(len(EMBEDDING_FIELDS)),
+                    ),
+                )
+
+                for puzzle_id, puzzle_data in puzzles:
+                    self._insert_field_embeddings(
+                        cur, puzzle_id, self._compute_field_embeddings(
+                            puzzle_data,
+                        ),
+                    )
+                    self.logger.info(
+                        f'Added field embeddings for puzzle '
+                        f'{puzzle_data.year}-{puzzle_data.day}.',
+                    )
+
+                if puzzles:
+                    self._bump_corpus_version(cur)
+                conn.commit()
+
+        return len(puzzles)
+
+    def backfill_tags(self) -> int:
+        """
+        Create the tags for puzzles that do not have them (e.g. puzzles added
+        before the tags were stored).
+
+        Returns:
+            int: The number of puzzles that were updated.
+        """
+
+        with self._get_connection() as conn:
+            with conn.cursor() as cur:
+                puzzles = self._fetch_puzzles(
+                    cur,
+                    sql.SQL("""NOT EXISTS (
+                    SELECT 1 FROM puzzle_tags t WHERE t.puzzle_id = p.id
+                )"""),
+                )
+
+                for puzzle_id, puzzle_data in puzzles:
+                    self._insert_tags(cur, puzzle_id, puzzle_data)
+
+                if puzzles:
+                    self._bump_corpus_version(cur)
+                conn.commit()
+
+        return len(puzzles)
+
     def add_solution(self, solution: SolutionData) -> int:
         """
         Add a solution to the database.
@@ -347,10 +1140,8 @@ class PuzzleRetreival:
         with self._get_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute(
-                    """
-                SELECT id FROM puzzles
-                WHERE year = %s AND day = %s;
-                """, (solution.puzzle_year, solution.puzzle_day),
+                    PUZZLE_ID_QUERY,
+                    (solution.puzzle_year, solution.puzzle_day),
                 )
                 puzzle_id = cur.fetchone()
                 if puzzle_id is None:
@@ -365,15 +1156,16 @@ class PuzzleRetreival:
 
                 puzzle_id = puzzle_id[0]
 
-        # Check that the solution exists
-        # TODO: Is this the best way to check that a soltuion doesn't exist?
+        values = solution_values(puzzle_id, solution)
+        solution_hash = values.code_hash
+
+        # Check that the solution exists (by the same author, or the same
+        # code after normalization)
         with self._get_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute(
-                    """
-                SELECT id FROM solutions
-                WHERE puzzle_id = %s AND author = %s;
-                """, (puzzle_id, solution.author),
+                    EXISTING_SOLUTION_QUERY,
+                    (puzzle_id, solution.author, solution_hash),
                 )
                 existing_solution = cur.fetchone()
                 if existing_solution:
@@ -391,22 +1183,11 @@ class PuzzleRetreival:
         with self._get_connection() as conn:
             with conn.cursor() as cur:
 
-                cur.execute(
-                    """
-                INSERT INTO solutions (
-                    puzzle_id, code, author, source
-                ) VALUES (%s, %s, %s, %s)
-                RETURNING id;
-                """, (
-                        puzzle_id,
-                        solution.code,
-                        solution.author,
-                        solution.source,
-                    ),
-                )
+                cur.execute(INSERT_SOLUTION_QUERY, values)
                 solution_id = cur.fetchone()
                 if solution_id is not None:
                     solution_id = solution_id[0]
+                    self._bump_corpus_version(cur)
                     self.logger.info(
                         f'Solution added with ID {solution_id}.',
                     )
@@ -415,52 +1196,173 @@ class PuzzleRetreival:
 
                 return 0
 
+    def backfill_solution_hashes(self) -> tuple[int, int]:
+        """
+        Hash (and measure) the solutions that were added before the code
+        hashes were stored, and remove the duplicates among them.
+
+        Note: removing a duplicate also removes the precomputed rankings that
+        use it.
+
+        Returns:
+            tuple[int, int]: The number of updated and removed solutions.
+        """
+
+        updated = 0
+        removed = 0
+        with self._get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                SELECT id, puzzle_id, code, language FROM solutions
+                WHERE code_hash IS NULL
+                ORDER BY id;
+                """,
+                )
+                rows = cur.fetchall()
+
+                for solution_id, puzzle_id, code, language in rows:
+                    solution_hash = code_hash(code, language)
+                    cur.execute(
+                        """
+                    SELECT id FROM solutions
+                    WHERE puzzle_id = %s AND code_hash = %s;
+                    """, (puzzle_id, solution_hash),
+                    )
+                    if cur.fetchone() is not None:
+                        # Keep the oldest of the duplicates
+                        cur.execute(
+                            'DELETE FROM solutions WHERE id = %s;',
+                            (solution_id,),
+                        )
+                        removed += 1
+                        continue
+
+                    if language is None and is_python(code):
+                        language = 'python'
+                    cur.execute(
+                        """
+                    UPDATE solutions
+                    SET code_hash = %s, code_length = %s, language = %s,
+                        tokens = %s
+                    WHERE id = %s;
+                    """, (
+                            solution_hash,
+                            len(code),
+                            language,
+                            count_tokens(code),
+                            solution_id,
+                        ),
+                    )
+                    updated += 1
+
+                if rows:
+                    self._bump_corpus_version(cur)
+                conn.commit()
+
+        return updated, removed
+
     def get_similar_puzzles_from_state(
         self,
         state: MainState,
         limit: int = 3,
     ) -> list[PuzzleData]:
+        """
+        Get the most similar puzzles (see `similar_puzzles_query`).
 
-        # Create PuzzleData
-        puzzle_data = self._state_to_puzzle_data(state)
-        # Create embedding
-        embedding = self._compute_weighted_embedding(puzzle_data)
+        If a cache is set, the results are cached by the (pre-processed)
+        puzzle, the retrieval settings and the corpus version.
 
-        # Query the DB for similar puzzles
-        with self._get_connection() as conn:
-            with conn.cursor() as cur:
+        Args:
+            state (MainState): The state with the (pre-processed) puzzle.
+            limit (int): The number of puzzles.
 
-                # query = """
-                # SELECT id, year, day, full_description, problem_statement,
-                #         keywords, underlying_concepts,
-                #         embedding <-> %s::vector AS distance
-                # FROM puzzles
-                # ORDER BY distance
-                # LIMIT %s;
-                # """
-
-                query = """
-                SELECT id, year, day, full_description, problem_statement,
-                       keywords, underlying_concepts,
-                       1 - (embedding <=> %s::vector) AS similarity
-                FROM puzzles
-                ORDER BY similarity DESC
-                LIMIT %s;
-                """
+        Returns:
+            list[PuzzleData]: The puzzles, most similar first (with their
+                similarity and number of solutions).
+        """
 
-                cur.execute(query, (embedding, limit))
-                results = cur.fetchall()
+        return self.get_similar_puzzles_batch([state], limit=limit)[0]
 
-                return [
-                    PuzzleData(
-                        year=result[1],
-                        day=result[2],
-                        full_description=result[3],
-                        problem_statement=result[4],
-                        keywords=result[5],
-                        underlying_concepts=result[6],
-                    ) for result in results
-                ]
+    def get_similar_puzzles_batch(
+        self,
+        states: list[MainState],
+        limit: int = 3,
+    ) -> list[list[PuzzleData]]:
+        """
+        Get the most similar puzzles of each of the puzzles, with one request
+        to the embedder and one query (see `similar_puzzles_query`).
+
+        If a cache is set, only the puzzles that are not cached are queried.
+
+        Args:
+            states (list[MainState]): The states with the (pre-processed)
+                puzzles.
+            limit (int): The number of puzzles per puzzle.
+
+        Returns:
+            list[list[PuzzleData]]: The puzzles of each state, most similar
+                first.
+        """
+
+        puzzles = [self._state_to_puzzle_data(state) for state in states]
+        if self.cache is None:
+            return self._query_similar_puzzles(puzzles, limit)
+
+        corpus_version = self._corpus_version()
+        keys = [
+            self._similar_puzzles_key(puzzle, limit, corpus_version)
+            for puzzle in puzzles
+        ]
+        results: list[list[PuzzleData] | None] = []
+        for key in keys:
+            cached = self.cache.get(key)
+            results.append(
+                None if cached is None
+                else [PuzzleData(**puzzle) for puzzle in cached],
+            )
+
+        missing = [i for i, result in enumerate(results) if result is None]
+        if len(missing) < len(results):
+            self.logger.debug(
+                f'Using cached similar puzzles for '
+                f'{len(results) - len(missing)} puzzles',
+            )
+        if missing:
+            queried = self._query_similar_puzzles(
+                [puzzles[i] for i in missing], limit,
+            )
+            for i, similar in zip(missing, queried):
+                results[i] = similar
+                self.cache.put(keys[i], [asdict(puzzle) for puzzle in similar])
+
+        return [result or [] for result in results]
+
+    def _query_similar_puzzles(
+        self,
+        puzzles: list[PuzzleData],
+        limit: int,
+    ) -> list[list[PuzzleData]]:
+
+        query, params = similar_puzzles_query(
+            puzzles,
+            self._compute_query_embeddings(puzzles),
+            self._query_fields(),
+            self.lexical,
+            limit,
+            self._weight_total(),
+        )
+
+        # Query the DB for similar puzzles
+        with self._get_vector_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(query, params)
+                rows = cur.fetchall()
+
+        results: list[list[PuzzleData]] = [[] for _ in puzzles]
+        for row in rows:
+            results[row[-1]].append(puzzle_from_row(row))
+        return results
 
     def get_similar_puzzles(
         self,
@@ -485,32 +1387,180 @@ class PuzzleRetreival:
         puzzle_year: int,
         puzzle_day: int,
         limit: int = 3,
+        token_budget: int | None = None,
+        language: str | None = None,
     ) -> list[SolutionData]:
+        """
+        Get diverse solutions of a puzzle within a token budget (see
+        `utils.solution_selection.select_diverse`).
+
+        Args:
+            puzzle_year (int): The year of the puzzle.
+            puzzle_day (int): The day of the puzzle.
+            limit (int): The maximum number of solutions.
+            token_budget (int|None): The maximum total number of tokens of
+                the solutions (no limit if None).
+            language (str|None): Only get solutions in this language.
+
+        Returns:
+            list[SolutionData]: The solutions.
+        """
+
+        if self.cache is None:
+            return self._query_solutions(
+                puzzle_year, puzzle_day, limit, token_budget, language,
+            )
+
+        key = self._solutions_key(
+            puzzle_year, puzzle_day, limit, token_budget, language,
+            self._corpus_version(),
+        )
+        cached = self.cache.get(key)
+        if cached is not None:
+            return [SolutionData(**solution) for solution in cached]
+
+        solutions = self._query_solutions(
+            puzzle_year, puzzle_day, limit, token_budget, language,
+        )
+        self.cache.put(key, [asdict(solution) for solution in solutions])
+        return solutions
+
+    def _query_solutions(
+        self,
+        puzzle_year: int,
+        puzzle_day: int,
+        limit: int,
+        token_budget: int | None,
+        language: str | None,
+    ) -> list[SolutionData]:
+
+        with self._get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    SOLUTION_CANDIDATES_QUERY,
+                    solution_candidates_params(
+                        puzzle_year, puzzle_day, limit, language,
+                    ),
+                )
+                rows = cur.fetchall()
+
+        return select_solutions(
+            rows, puzzle_year, puzzle_day, limit, token_budget,
+        )
+
+    def get_puzzles(
+        self,
+        unranked_version: str | None = None,
+    ) -> list[PuzzleData]:
+        """
+        Get the stored puzzles.
+
+        Args:
+            unranked_version (str|None): Only get the puzzles without a
+                precomputed ranking of this version.
+
+        Returns:
+            list[PuzzleData]: The puzzles.
+        """
+
+        condition: sql.Composable = sql.SQL('TRUE')
+        if unranked_version is not None:
+            condition = sql.SQL("""NOT EXISTS (
+                SELECT 1 FROM solution_rankings r
+                WHERE r.puzzle_id = p.id AND r.version = {version}
+            )""").format(version=sql.Literal(unranked_version))
 
         with self._get_connection() as conn:
             with conn.cursor() as cur:
+                puzzles = self._fetch_puzzles(cur, condition)
+
+        return [puzzle for _, puzzle in puzzles]
+
+    def add_solution_ranking(
+        self,
+        puzzle_id: int,
+        version: str,
+        ranked_solution: RankedSolution,
+    ) -> None:
+        """
+        Store the precomputed ranking of a puzzle (replaces an existing
+        ranking of the same version).
 
+        Args:
+            puzzle_id (int): The id of the puzzle.
+            version (str): The version of the ranking.
+            ranked_solution (RankedSolution): The top ranked solution.
+        """
+
+        with self._get_connection() as conn:
+            with conn.cursor() as cur:
                 cur.execute(
                     """
-                            SELECT code, author, source
-                            FROM solutions
-                            WHERE puzzle_id = (
-                                SELECT id
-                                FROM puzzles p
-                                WHERE p."day" = %s and p."year" = %s
-                            )
-                            LIMIT %s
-                            """, (puzzle_day, puzzle_year, limit),
+                INSERT INTO solution_rankings (
+                    puzzle_id, version, solution_id, plan, justification
+                ) VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (puzzle_id, version) DO UPDATE SET
+                    solution_id = EXCLUDED.solution_id,
+                    plan = EXCLUDED.plan,
+                    justification = EXCLUDED.justification,
+                    created_at = CURRENT_TIMESTAMP;
+                """, (
+                        puzzle_id,
+                        version,
+                        ranked_solution.solution.id,
+                        ranked_solution.plan,
+                        ranked_solution.justification,
+                    ),
                 )
+                conn.commit()
+
+    def get_solution_rankings(
+        self,
+        puzzles: list[PuzzleData],
+        version: str,
+    ) -> dict[int, RankedSolution]:
+        """
+        Get the precomputed top ranked solutions of the puzzles (in one
+        query).
+
+        Args:
+            puzzles (list[PuzzleData]): The (stored) puzzles.
+            version (str): The version of the ranking.
 
+        Returns:
+            dict[int, RankedSolution]: The ranked solution for each puzzle
+                id, puzzles without a ranking are left out.
+        """
+
+        puzzle_ids = [puzzle.id for puzzle in puzzles if puzzle.id is not None]
+        if not puzzle_ids:
+            return {}
+
+        with self._get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                SELECT r.puzzle_id, r.plan, r.justification,
+                       s.id, s.code, s.author, s.source, p.year, p.day
+                FROM solution_rankings r
+                JOIN solutions s ON s.id = r.solution_id
+                JOIN puzzles p ON p.id = r.puzzle_id
+                WHERE r.version = %s AND r.puzzle_id = ANY(%s);
+                """, (version, puzzle_ids),
+                )
                 results = cur.fetchall()
 
-                return [
-                    SolutionData(
-                        code=result[0],
-                        author=result[1],
-                        source=result[2],
-                        puzzle_day=puzzle_day,
-                        puzzle_year=puzzle_year,
-                    ) for result in results
-                ]
+        return {
+            result[0]: RankedSolution(
+                solution=SolutionData(
+                    code=result[4],
+                    author=result[5],
+                    source=result[6],
+                    puzzle_day=result[8],
+                    puzzle_year=result[7],
+                    id=result[3],
+                ),
+                plan=result[1],
+                justification=result[2] or '',
+            ) for result in results
+        }
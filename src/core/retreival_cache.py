@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import threading
+from collections.abc import Sequence
+from typing import Any
+
+from loguru import logger
+
+
+def cache_key(**parts: Any) -> str:
+    """
+    Create a cache key from json serializable parts.
+    """
+
+    data = json.dumps(parts, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def puzzle_fingerprint(
+    year: int,
+    day: int,
+    description: str,
+    problem_statement: str = '',
+    keywords: Sequence[str] = (),
+    underlying_concepts: Sequence[str] = (),
+) -> str:
+    """
+    Fingerprint of a puzzle, used as its identity in the cache.
+
+    Note: the query embeddings and tags are computed from the pre-processing
+    output (problem statement, keywords, ...), which differs between
+    (pre-processing) models and is empty when the pre-processing is
+    disabled, so it is part of the fingerprint.
+    """
+
+    digest = cache_key(
+        description=description,
+        problem_statement=problem_statement,
+        keywords=list(keywords),
+        underlying_concepts=list(underlying_concepts),
+    )
+    return f'{year}-{day}-{digest}'
+
+
+class RetreivalCache:
+    """
+    Cache of retrieval results (similar puzzles and their solutions).
+
+    The results are kept in memory and, if a directory is given, on disk (as
+    json files) so they are shared between processes. The keys include the
+    version of the corpus, so results are invalidated when puzzles or
+    solutions are added.
+    """
+
+    def __init__(self, directory: str | None = None):
+        """
+        Args:
+            directory (str|None): The directory for the disk cache (only
+                cached in memory if not given).
+        """
+
+        self.directory = directory
+        self.logger = logger.bind(name='RetreivalCache')
+        self.hits = 0
+        self.misses = 0
+
+        self._memory: dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        assert self.directory is not None
+        return os.path.join(self.directory, f'{key}.json')
+
+    def get(self, key: str) -> Any | None:
+        """
+        Get a cached value.
+
+        Returns:
+            Any|None: The value, or None if it is not cached.
+        """
+
+        with self._lock:
+            if key in self._memory:
+                self.hits += 1
+                return self._memory[key]
+
+        value = None
+        if self.directory is not None and os.path.exists(self._path(key)):
+            try:
+                with open(self._path(key), 'r') as f:
+                    value = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                self.logger.warning(f'Could not read cache entry {key}: {e}')
+
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._memory[key] = value
+            return value
+
+    def put(self, key: str, value: Any) -> None:
+        """
+        Cache a (json serializable) value.
+        """
+
+        with self._lock:
+            self._memory[key] = value
+
+        if self.directory is None:
+            return
+
+        # Write to a temporary file first, so readers never see a partial
+        # entry
+        tmp_path = f'{self._path(key)}.{os.getpid()}.{threading.get_ident()}'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(value, f)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            self.logger.warning(f'Could not write cache entry {key}: {e}')
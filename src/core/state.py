@@ -1,3 +1,4 @@
+import time
 from dataclasses import dataclass
 from dataclasses import field
 from typing import Any
@@ -45,6 +46,10 @@ class MainState:
 
     # Coding output
     generated_code: str | None = None
+    # Code written for the plans while planning (pipelined planning), plan
+    # -> code. The coding agent uses the code of the selected plan instead
+    # of prompting the model again.
+    candidate_code: dict[str, str] = field(default_factory=dict)
 
     # Debugging output
     final_code: str | None = None
@@ -60,3 +65,20 @@ class MainState:
     )  # List of agent logs
     agent_errors: list[dict[str, Any]] = field(default_factory=list)
     current_step: str | None = None
+
+    # The time (`time.monotonic()`) by which the puzzle has to be solved,
+    # no deadline if None. The agents derive the timeouts of their model
+    # requests from it.
+    deadline: float | None = None
+    # The agent that was running when the deadline passed
+    deadline_exceeded_by: str | None = None
+
+    def remaining_time(self) -> float | None:
+        """
+        The number of seconds until the deadline (at least 0), or None if
+        there is no deadline.
+        """
+
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
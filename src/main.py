@@ -1,22 +1,23 @@
 import argparse
 import os
 import sys
+import time
 
 from agents.base_agent import BaseAgent
 from agents.coding_agent import CodingAgent
 from agents.debugging_agent import DebuggingAgent
 from agents.planning_agent import PlanningAgent
 from agents.pre_processing_agent import PreProcessingAgent
-from agents.retreival_agent import RetrievalAgent
+from core.embeddings import BaseEmbedder
+from core.embeddings import EMBEDDERS
+from core.embeddings import get_embedder
 from core.orchestrator import Orchestrator
+from core.retreival_cache import RetreivalCache
 from core.state import MainState
 from dotenv import load_dotenv
 from loguru import logger
-from models.anthropic_model import AnthropicLanguageModel
 from models.base_model import BaseLanguageModel
-from models.deepseek_model import DeepseekLanguageModel
-from models.gemini_model import GeminiLanguageModel
-from models.openai_model import OpenAILanguageModel
+from models.registry import create_model
 from utils.util_types import AgentSettings
 from utils.util_types import Puzzle
 from utils.util_types import TestCase
@@ -92,6 +93,62 @@ def _parse_args() -> argparse.Namespace:
         type=str,
         help='Model to use for the debugging agent',
     )
+    # Retrieval configuration
+    parser.add_argument(
+        '--embedder',
+        type=str,
+        default='openai',
+        choices=EMBEDDERS,
+        help=(
+            'The embedder for the retrieval agent (must match the embedder '
+            'the database was created with)'
+        ),
+    )
+    parser.add_argument(
+        '--retreival-cache',
+        type=str,
+        help='Directory to cache the retrieval results in',
+    )
+    parser.add_argument(
+        '--ranking-version',
+        type=str,
+        help=(
+            'Use the precomputed solution rankings of this version '
+            '(see scripts/rank_solutions.py)'
+        ),
+    )
+    parser.add_argument(
+        '--min-similarity',
+        type=float,
+        help=(
+            'Skip similar puzzles with a lower similarity (weighted cosine '
+            'similarity) instead of ranking their solutions'
+        ),
+    )
+    parser.add_argument(
+        '--max-similarity-gap',
+        type=float,
+        help=(
+            'Skip similar puzzles with a similarity more than this below '
+            'the most similar puzzle'
+        ),
+    )
+    parser.add_argument(
+        '--time-budget',
+        type=float,
+        help=(
+            'The time budget for the puzzle in seconds (model requests are '
+            'cancelled when it runs out)'
+        ),
+    )
+    parser.add_argument(
+        '--pipeline-coding',
+        action='store_true',
+        help=(
+            'Code every plan as soon as it is generated (the confidence '
+            'scores only decide which code is debugged first)'
+        ),
+    )
     # Logging configuration
     parser.add_argument(
         '-l', '--log-level',
@@ -104,35 +161,182 @@ def _parse_args() -> argparse.Namespace:
     return parser.parse_args()
 
 
-def _get_model(model_name: str) -> BaseLanguageModel:
+def get_model(model_name: str) -> BaseLanguageModel:
+    """
+    Create the model with the name (see `models.registry.create_model`).
+    """
 
-    if model_name.startswith('gemini'):
-        return GeminiLanguageModel(
-            api_key=os.getenv('GEMINI_API_KEY') or '',
-            model_name=model_name,
-        )
-    elif (
-        model_name.startswith('openai') or
-        model_name.startswith('gpt') or
-        model_name.startswith('o3') or
-        model_name.startswith('o4')
-    ):
-        return OpenAILanguageModel(
-            api_key=os.getenv('OPENAI_API_KEY') or '',
-            model_name=model_name,
-        )
-    elif model_name.startswith('deepseek'):
-        return DeepseekLanguageModel(
-            api_key=os.getenv('DEEPSEEK_API_KEY') or '',
-            model_name=model_name,
-        )
-    elif model_name.startswith('anthropic') or model_name.startswith('claude'):
-        return AnthropicLanguageModel(
-            api_key=os.getenv('ANTHROPIC_API_KEY') or '',
-            model_name=model_name,
+    # The provider modules are imported lazily (see `models.registry`)
+    return create_model(model_name)
+
+
+def build_agents(
+    agents_models: dict[str, BaseLanguageModel],
+    puzzle_input: str,
+    expected_output: str | None,
+    disabled_agents: list[str] | None = None,
+    n_plans: int = 3,
+    embedder: BaseEmbedder | None = None,
+    retreival_cache: RetreivalCache | None = None,
+    ranking_version: str | None = None,
+    pipeline_coding: bool = False,
+    min_similarity: float | None = None,
+    max_similarity_gap: float | None = None,
+) -> tuple[tuple[BaseAgent, AgentSettings], ...]:
+    """
+    Create the agents of the system (in execution order).
+
+    Args:
+        agents_models (dict[str, BaseLanguageModel]): The model for each
+            agent (preprocess, retreival, planning, coding, debugging).
+        puzzle_input (str): The input for the puzzle.
+        expected_output (str|None): The expected output for the puzzle.
+        disabled_agents (list[str]|None): The names of the agents to disable.
+        n_plans (int): The number of plans the planning agent generates.
+        embedder (BaseEmbedder|None): The embedder for the retrieval agent
+            (default: OpenAI embeddings).
+        retreival_cache (RetreivalCache|None): Cache for the retrieval
+            results (shared between runs).
+        ranking_version (str|None): Use the precomputed solution rankings
+            of this version in the retrieval agent.
+        pipeline_coding (bool): Let the planning agent code every plan as
+            soon as it is generated (the plans are generated concurrently and
+            the confidence scores only order the candidates).
+        min_similarity (float|None): The retrieval agent skips similar
+            puzzles with a lower similarity (no threshold if None).
+        max_similarity_gap (float|None): The retrieval agent skips similar
+            puzzles with a similarity more than this below the most similar
+            puzzle (no gating if None).
+
+    Returns:
+        tuple[tuple[BaseAgent, AgentSettings], ...]: The agents and their
+            settings, to be passed to the `Orchestrator`.
+    """
+
+    disabled_agents = disabled_agents or []
+
+    def is_enabled(agent_name: str) -> bool:
+        return agent_name not in disabled_agents
+
+    agents: list[tuple[BaseAgent, AgentSettings]] = [
+        (
+            PreProcessingAgent(
+                'preprocess', model=agents_models['preprocess'],
+            ),
+            AgentSettings(enabled=is_enabled('preprocess'), can_debug=False),
+        ),
+    ]
+
+    # The retrieval agent connects to the database when it is created,
+    # so it is left out completely when it is disabled (and its modules are
+    # not imported)
+    if is_enabled('retreival'):
+        from agents.retreival_agent import RetrievalAgent
+
+        agents.append(
+            (
+                RetrievalAgent(
+                    'retreival',
+                    model=agents_models['retreival'],
+                    connection_string=os.getenv('DB_CONNECTION_STRING') or '',
+                    openai_key=os.getenv('OPENAI_API_KEY') or '',
+                    # Use default weights
+                    weights=None,
+                    embedder=embedder,
+                    cache=retreival_cache,
+                    ranking_version=ranking_version,
+                    min_similarity=min_similarity,
+                    max_similarity_gap=max_similarity_gap,
+                ),
+                AgentSettings(enabled=True, can_debug=False),
+            ),
         )
 
-    raise ValueError(f'Unknown model name: {model_name}')
+    coding_agent = CodingAgent('coding', model=agents_models['coding'])
+    agents.extend(
+        (
+            (
+                PlanningAgent(
+                    'planning',
+                    model=agents_models['planning'],
+                    n_plans=n_plans,
+                    coding_agent=(
+                        coding_agent
+                        if pipeline_coding and is_enabled('coding') else None
+                    ),
+                ),
+                AgentSettings(
+                    enabled=is_enabled('planning'), can_debug=False,
+                ),
+            ),
+            (
+                coding_agent,
+                AgentSettings(enabled=is_enabled('coding'), can_debug=False),
+            ),
+            (
+                DebuggingAgent(
+                    'debugging',
+                    model=agents_models['debugging'],
+                    expected_output=expected_output,
+                    puzzle_input=puzzle_input,
+                ),
+                AgentSettings(
+                    enabled=is_enabled('debugging'), can_debug=True,
+                ),
+            ),
+        ),
+    )
+
+    return tuple(agents)
+
+
+def check_solution(
+    state: MainState,
+    model: BaseLanguageModel,
+    puzzle_input: str,
+    expected_output: str | None,
+) -> MainState:
+    """
+    Run the generated code against the puzzle input and mark the state as
+    solved if the output matches (used when the debugging agent is disabled).
+
+    Args:
+        state (MainState): The state after the agents ran.
+        model (BaseLanguageModel): The model for the debugging agent
+            (only needed to create the agent, it is not prompted).
+        puzzle_input (str): The input for the puzzle.
+        expected_output (str|None): The expected output for the puzzle.
+
+    Returns:
+        MainState: The updated state.
+    """
+
+    if expected_output is None:
+        logger.warning('No expected output, can not check the code')
+        return state
+
+    # Using debugging agent under the hood because
+    # we otherwise have to reimplement the code running
+    # but skipping all debugging steps
+    dba = DebuggingAgent(
+        'debugging',
+        model=model,
+        expected_output=expected_output,
+        puzzle_input=puzzle_input,
+    )
+    run_result = dba._run_test(
+        state.generated_code or '',
+        TestCase(
+            input_=puzzle_input,
+            expected_output=expected_output,
+        ),
+    )
+    if run_result.success:
+        logger.success('Code passed the test')
+        state.is_solved = True
+        state.final_code = state.generated_code
+
+    return state
 
 
 if __name__ == '__main__':
@@ -145,11 +349,11 @@ if __name__ == '__main__':
     logger.add(sys.stdout, level=args.log_level)
 
     agents_models = {
-        'preprocess': _get_model(args.preprocess_model or args.default_model),
-        'retreival': _get_model(args.retreival_model or args.default_model),
-        'planning': _get_model(args.planning_model or args.default_model),
-        'coding': _get_model(args.coding_model or args.default_model),
-        'debugging': _get_model(args.debugging_model or args.default_model),
+        'preprocess': get_model(args.preprocess_model or args.default_model),
+        'retreival': get_model(args.retreival_model or args.default_model),
+        'planning': get_model(args.planning_model or args.default_model),
+        'coding': get_model(args.coding_model or args.default_model),
+        'debugging': get_model(args.debugging_model or args.default_model),
     }
 
     # Quick helper lambda function to see if the agent is enabled
@@ -162,46 +366,23 @@ if __name__ == '__main__':
     with open(args.puzzle_input, 'r') as inpf:
         puzzle_input = inpf.read()
 
-    agents: tuple[tuple[BaseAgent, AgentSettings], ...] = (
-        (
-            PreProcessingAgent(
-                'preprocess', model=agents_models['preprocess'],
-            ),
-            AgentSettings(enabled=is_enabled('preprocess'), can_debug=False),
-        ),
-        (
-            RetrievalAgent(
-                'retreival',
-                model=agents_models['retreival'],
-                connection_string=os.getenv('DB_CONNECTION_STRING') or '',
-                openai_key=os.getenv('OPENAI_API_KEY') or '',
-                # Use default weights
-                weights=None,
-            ),
-            AgentSettings(enabled=is_enabled('retreival'), can_debug=False),
-        ),
-        (
-            # TODO: Make n_plans commandline argument?
-            PlanningAgent(
-                'planning',
-                model=agents_models['planning'],
-                n_plans=3,
-            ),
-            AgentSettings(enabled=is_enabled('planning'), can_debug=False),
-        ),
-        (
-            CodingAgent('coding', model=agents_models['coding']),
-            AgentSettings(enabled=is_enabled('coding'), can_debug=False),
+    agents = build_agents(
+        agents_models,
+        puzzle_input=puzzle_input,
+        expected_output=args.expected_output,
+        disabled_agents=args.disable_agents,
+        embedder=(
+            get_embedder(args.embedder, os.getenv('OPENAI_API_KEY'))
+            if is_enabled('retreival') else None
         ),
-        (
-            DebuggingAgent(
-                'debugging',
-                model=agents_models['debugging'],
-                expected_output=args.expected_output,
-                puzzle_input=puzzle_input,
-            ),
-            AgentSettings(enabled=is_enabled('debugging'), can_debug=True),
+        retreival_cache=(
+            RetreivalCache(args.retreival_cache)
+            if args.retreival_cache else None
         ),
+        ranking_version=args.ranking_version,
+        pipeline_coding=args.pipeline_coding,
+        min_similarity=args.min_similarity,
+        max_similarity_gap=args.max_similarity_gap,
     )
 
     orchestrator = Orchestrator(agents, {})
@@ -217,33 +398,35 @@ if __name__ == '__main__':
         day=args.day or 1,  # set default day to 1
     )
 
-    state = MainState(puzzle=puzzle)
+    state = MainState(
+        puzzle=puzzle,
+        deadline=(
+            time.monotonic() + args.time_budget
+            if args.time_budget is not None else None
+        ),
+    )
     ret_state = orchestrator.solve_puzzle(state)
+    if ret_state.deadline_exceeded_by is not None:
+        logger.warning(
+            f'Time budget exceeded in {ret_state.deadline_exceeded_by}',
+        )
 
     # Check if the debugging agent was disabled
     # if not: test the code here
     if not is_enabled('debugging'):
         logger.info('Debugging agent was disabled, checking code')
-        # Using debugging agent under the hood because
-        # we otherwise have to reimplement the code running
-        # but skipping all debugging steps
-        dba = DebuggingAgent(
-            'debugging',
+        ret_state = check_solution(
+            ret_state,
             model=agents_models['debugging'],
-            expected_output=args.expected_output,
             puzzle_input=puzzle_input,
+            expected_output=args.expected_output,
         )
-        run_result = dba._run_test(
-            ret_state.generated_code or '',
-            TestCase(
-                input_=puzzle_input,
-                expected_output=args.expected_output,
-            ),
-        )
-        if run_result.success:
-            logger.success('Code passed the test')
-            ret_state.is_solved = True
-            ret_state.final_code = ret_state.generated_code
+
+    for agent_name, model in agents_models.items():
+        # Only the routing model has metrics (its module may not be loaded)
+        if hasattr(model, 'metrics'):
+            for metrics in model.metrics():
+                logger.info(f'Routing ({agent_name}): {metrics}')
 
     if ret_state.is_solved:
         logger.success(f'Puzzle {puzzle.year}-{puzzle.day} solved')
@@ -1,58 +1,353 @@
+from collections.abc import Generator
+from typing import Any
+from typing import cast
+
+import anthropic
 from anthropic import Anthropic
 from anthropic import AnthropicVertex
+from anthropic.types import message_create_params
+from anthropic.types import Usage
 from models.base_model import BaseLanguageModel
+from models.batch import BaseBatchBackend
+from models.batch import BatchRequest
+from models.batch import BatchResult
+from models.batch import DEFAULT_BATCH_TIMEOUT
+from models.errors import is_retryable_status
+from models.errors import ModelError
+from models.registry import anthropic_client
+from models.registry import anthropic_vertex_client
+from models.retry import RetryPolicy
+from models.usage import TokenUsage
+
+# The parameters of a request of a message batch
+_BatchParams = message_create_params.MessageCreateParamsNonStreaming
 
 
 class AnthropicLanguageModel(BaseLanguageModel):
 
-    def __init__(self, model_name: str, api_key: str):
-        super().__init__(model_name, api_key)
+    def __init__(
+        self,
+        model_name: str,
+        api_key: str,
+        retry_policy: RetryPolicy | None = None,
+    ):
+        super().__init__(model_name, api_key, retry_policy=retry_policy)
 
+        # Shared by all models with the same key (retries are handled by
+        # BaseLanguageModel)
         self.use_vertex = '@' in model_name
+        self.client: Anthropic | AnthropicVertex
         if self.use_vertex:
-            self.client = AnthropicVertex(
-                project_id='gen-lang-client-0628958690', region='europe-west4',
+            self.client = anthropic_vertex_client(
+                'gen-lang-client-0628958690', 'europe-west4',
             )
             self.logger.info('Using Anthropic Vertex client')
         else:
-            self.client = Anthropic(api_key=api_key)
+            self.client = anthropic_client(api_key)
+
+    def _to_model_error(self, error: Exception) -> ModelError:
+
+        if isinstance(error, anthropic.APIStatusError):
+            return ModelError(
+                str(error),
+                model_name=self.model_name,
+                status_code=error.status_code,
+                retryable=is_retryable_status(error.status_code),
+            )
+
+        # Connection errors and timeouts
+        return ModelError(
+            str(error),
+            model_name=self.model_name,
+            retryable=isinstance(error, anthropic.APIConnectionError),
+        )
+
+    def _add_usage(self, usage: Usage | None) -> None:
+
+        if usage is None:
+            self._record_usage()
+            return
 
-    def prompt(self, text: str) -> str:
+        self._record_usage(
+            input_tokens=(
+                usage.input_tokens
+                + (usage.cache_read_input_tokens or 0)
+                + (usage.cache_creation_input_tokens or 0)
+            ),
+            output_tokens=usage.output_tokens,
+            cached_tokens=usage.cache_read_input_tokens,
+        )
+
+    def _request_kwargs(
+        self,
+        text: str,
+        system: str | None,
+        timeout: float | None = None,
+    ) -> dict[str, Any]:
+
+        kwargs: dict[str, Any] = {
+            'model': self.model_name,
+            'messages': [
+                {
+                    'role': 'user',
+                    'content': text,
+                },
+            ],
+            'max_tokens': 8192,
+        }
+
+        if system is not None:
+            # Mark the (static) system prompt for prompt caching
+            kwargs['system'] = [
+                {
+                    'type': 'text',
+                    'text': system,
+                    'cache_control': {'type': 'ephemeral'},
+                },
+            ]
+
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+
+        return kwargs
+
+    def _prompt(
+        self,
+        text: str,
+        system: str | None,
+        timeout: float | None = None,
+    ) -> str:
+
+        self.logger.debug(
+            (
+                f'Prompting {self} with prompt: '
+                f'{system=} {text=}'
+            ),
+        )
 
         try:
+            response = self.client.messages.create(
+                **self._request_kwargs(text, system, timeout),
+            )
+        except anthropic.AnthropicError as e:
+            self.logger.error(f'Error while prompting {self}: {e}')
+            raise self._to_model_error(e) from e
+
+        self._add_usage(response.usage)
+        if not response.content:
+            self.logger.warning(
+                'Received unexpected None response from Anthropic',
+            )
+            return ''
 
+        if not hasattr(response.content[0], 'text'):
             self.logger.debug(
-                (
-                    f'Prompting {self} with prompt: '
-                    f'{self.system_prompt=} {text=}'
-                ),
+                f'No text in response content: {response.content}',
             )
+            return ''
+
+        return getattr(response.content[0], 'text')
 
+    def _json_request_kwargs(
+        self,
+        text: str,
+        schema: dict[str, Any],
+        name: str,
+        system: str | None,
+        timeout: float | None = None,
+    ) -> dict[str, Any]:
+
+        # Structured output is done by forcing the model to call a tool
+        # that takes the schema as input
+        return {
+            **self._request_kwargs(text, system, timeout),
+            'tools': [
+                {
+                    'name': name,
+                    'description': f'Respond with the {name} json.',
+                    'input_schema': schema,
+                },
+            ],
+            'tool_choice': {'type': 'tool', 'name': name},
+        }
+
+    def _tool_input(self, content: list[Any]) -> Any | None:
+
+        for block in content:
+            if block.type == 'tool_use':
+                return block.input
+
+        self.logger.warning(f'No tool use in response content: {content}')
+        return None
+
+    def _prompt_json(
+        self,
+        text: str,
+        schema: dict[str, Any],
+        name: str,
+        system: str | None,
+        timeout: float | None = None,
+    ) -> Any | None:
+
+        self.logger.debug(f'Prompting {self} for json: {system=} {text=}')
+
+        try:
             response = self.client.messages.create(
-                model=self.model_name,
-                messages=[
+                **self._json_request_kwargs(
+                    text, schema, name, system, timeout,
+                ),
+            )
+        except anthropic.AnthropicError as e:
+            self.logger.error(f'Error while prompting {self}: {e}')
+            raise self._to_model_error(e) from e
+
+        self._add_usage(response.usage)
+        return self._tool_input(response.content)
+
+    def batch_backend(
+        self,
+        poll_interval: float = 30.0,
+        timeout: float | None = DEFAULT_BATCH_TIMEOUT,
+    ) -> 'AnthropicBatchBackend':
+        """
+        The Message Batches API for json requests to the model (see
+        `models.batch`).
+
+        Raises:
+            ValueError: For models on Vertex AI (not supported).
+        """
+
+        if self.use_vertex:
+            raise ValueError(
+                f'{self.model_name}: batch jobs are not supported on Vertex',
+            )
+        return AnthropicBatchBackend(self, poll_interval, timeout)
+
+    def _prompt_stream(
+        self,
+        text: str,
+        system: str | None,
+        timeout: float | None = None,
+    ) -> Generator[str, None, None]:
+
+        self.logger.debug(f'Streaming prompt to {self}: {system=} {text=}')
+
+        try:
+            with self.client.messages.stream(
+                **self._request_kwargs(text, system, timeout),
+            ) as stream:
+                # Leaving the context manager closes the connection
+                usage = None
+                try:
+                    for event in stream:
+                        # The snapshot is updated with the usage so far
+                        usage = stream.current_message_snapshot.usage
+                        if event.type == 'text':
+                            yield event.text
+                finally:
+                    self._add_usage(usage)
+        except anthropic.AnthropicError as e:
+            self.logger.error(f'Error while streaming from {self}: {e}')
+            raise self._to_model_error(e) from e
+
+
+class AnthropicBatchBackend(BaseBatchBackend):
+    """
+    Batch jobs with the Anthropic Message Batches API (the same requests as
+    `AnthropicLanguageModel.prompt_json`).
+    """
+
+    def __init__(
+        self,
+        model: AnthropicLanguageModel,
+        poll_interval: float = 30.0,
+        timeout: float | None = DEFAULT_BATCH_TIMEOUT,
+    ):
+        super().__init__(
+            model.model_name, poll_interval=poll_interval, timeout=timeout,
+        )
+        self.model = model
+
+    def _result(self, custom_id: str, result: Any) -> BatchResult:
+
+        if result.type != 'succeeded':
+            error = getattr(result, 'error', None)
+            return BatchResult(custom_id, None, str(error or result.type))
+
+        message = result.message
+        usage = message.usage
+        token_usage = TokenUsage(
+            requests=1,
+            input_tokens=(
+                usage.input_tokens
+                + (usage.cache_read_input_tokens or 0)
+                + (usage.cache_creation_input_tokens or 0)
+            ),
+            output_tokens=usage.output_tokens,
+            cached_tokens=usage.cache_read_input_tokens or 0,
+        )
+        return BatchResult(
+            custom_id,
+            self.model._tool_input(message.content),
+            None,
+            token_usage,
+        )
+
+    def submit(self, requests: list[BatchRequest]) -> str:
+
+        try:
+            batch = self.model.client.messages.batches.create(
+                requests=[
                     {
-                        'role': 'user',
-                        'content': text,
-                    },
+                        'custom_id': request.custom_id,
+                        # The same parameters as a regular request
+                        'params': cast(
+                            _BatchParams,
+                            self.model._json_request_kwargs(
+                                request.text,
+                                request.schema,
+                                request.name,
+                                request.system,
+                            ),
+                        ),
+                    }
+                    for request in requests
                 ],
-                max_tokens=8192,
             )
+        except anthropic.AnthropicError as e:
+            self.logger.error(f'Could not create the batch job: {e}')
+            raise self.model._to_model_error(e) from e
 
-            if not response.content:
-                self.logger.warning(
-                    'Received unexpected None response from Anthropic',
-                )
-                return ''
+        return batch.id
+
+    def is_done(self, job_id: str) -> bool:
 
-            if not hasattr(response.content[0], 'text'):
-                self.logger.debug(
-                    f'No text in response content: {response.content}',
+        try:
+            batch = self.model.client.messages.batches.retrieve(job_id)
+        except anthropic.AnthropicError as e:
+            raise self.model._to_model_error(e) from e
+
+        self.logger.debug(
+            f'Batch job {job_id}: {batch.processing_status} '
+            f'{batch.request_counts}',
+        )
+        return batch.processing_status == 'ended'
+
+    def fetch(self, job_id: str) -> list[BatchResult]:
+
+        try:
+            return [
+                self._result(response.custom_id, response.result)
+                for response in self.model.client.messages.batches.results(
+                    job_id,
                 )
-                return ''
+            ]
+        except anthropic.AnthropicError as e:
+            raise self.model._to_model_error(e) from e
 
-            return getattr(response.content[0], 'text')
+    def cancel(self, job_id: str) -> None:
 
-        except Exception as e:
-            self.logger.error(f'Error while prompting {self}: {e}')
-            return ''
+        try:
+            self.model.client.messages.batches.cancel(job_id)
+        except anthropic.AnthropicError as e:
+            self.logger.error(f'Could not cancel batch job {job_id}: {e}')
@@ -1,7 +1,18 @@
+import threading
+import time
 from abc import ABC
 from abc import abstractmethod
+from collections.abc import Generator
+from typing import Any
+from typing import Literal
 
 from loguru import logger
+from models.errors import ModelError
+from models.retry import call_with_retry
+from models.retry import RetryPolicy
+from models.usage import TokenUsage
+from utils.block_scanner import BlockScanner
+from utils.json_repair import repair_json
 
 
 class BaseLanguageModel(ABC):
@@ -12,6 +23,7 @@ class BaseLanguageModel(ABC):
             model_name: str,
             api_key: str,
             system_prompt: str | None = None,
+            retry_policy: RetryPolicy | None = None,
     ):
         """
         Initialize the language model with the model name and API key.
@@ -20,12 +32,17 @@ class BaseLanguageModel(ABC):
             model_name (str): The name of the model.
             api_key (str): The API key for the model.
             system_prompt (str|None): The system prompt for the model.
+            retry_policy (RetryPolicy|None): How failed requests are
+                retried. Defaults to `RetryPolicy()`.
         """
 
         self.model_name = model_name
         self.api_key = api_key
         self.logger = logger.bind(model=self.model_name)
         self.system_prompt = system_prompt
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.usage = TokenUsage()
+        self._usage_lock = threading.Lock()
 
         # TODO: If necessary add **kwargs and save to config?
 
@@ -41,19 +58,315 @@ class BaseLanguageModel(ABC):
         """
         self.system_prompt = text
 
-    @abstractmethod
-    def prompt(self, text: str) -> str:
+    def _record_usage(
+            self,
+            input_tokens: int | None = 0,
+            output_tokens: int | None = 0,
+            cached_tokens: int | None = 0,
+    ) -> None:
+        """
+        Add the usage of a single request to `usage`.
+
+        Args:
+            input_tokens (int|None): The number of input tokens.
+            output_tokens (int|None): The number of output tokens.
+            cached_tokens (int|None): The number of input tokens that were
+                read from the prompt cache.
+        """
+
+        with self._usage_lock:
+            self.usage = self.usage + TokenUsage(
+                requests=1,
+                input_tokens=input_tokens or 0,
+                output_tokens=output_tokens or 0,
+                cached_tokens=cached_tokens or 0,
+            )
+
+    def add_usage(self, usage: TokenUsage) -> None:
+        """
+        Add the usage of requests that were not sent by the model itself
+        (e.g. of a batch job, see `models.batch`).
+        """
+
+        with self._usage_lock:
+            self.usage = self.usage + usage
+
+    def _get_system(self, system: str | None) -> str | None:
+        return system if system is not None else self.system_prompt
+
+    def prompt(
+            self,
+            text: str,
+            *,
+            system: str | None = None,
+            timeout: float | None = None,
+    ) -> str:
         """
         Prompt the language model with a text and return the response.
 
+        Transient failures (connection errors, rate limits, server errors)
+        are retried with exponential backoff according to `retry_policy`.
+
+        Args:
+            text (str): The text to prompt the model with.
+            system (str|None): The system prompt for this request, overrides
+                `system_prompt`. Providers that support it cache the system
+                prompt, so it should be the static part of the prompt.
+            timeout (float|None): The maximum number of seconds for the
+                request, including the retries. A request that is still
+                running at the deadline is cancelled (no timeout if None).
+
+        Returns:
+            str: The response from the model.
+
+        Raises:
+            ModelError: If the request failed and could not be retried, or
+                the timeout passed.
+        """
+
+        system = self._get_system(system)
+        deadline = deadline_after(timeout)
+        return call_with_retry(
+            lambda: self._prompt(text, system, self._time_left(deadline)),
+            self.retry_policy,
+            self.logger,
+            deadline,
+        )
+
+    def prompt_until_block(
+            self,
+            text: str,
+            block: Literal['json', 'markdown'],
+            *,
+            system: str | None = None,
+            timeout: float | None = None,
+    ) -> str:
+        """
+        Prompt the language model and stream the response until the first
+        ```json (or ```markdown) block is complete. The rest of the response
+        is not generated: the stream is cancelled.
+
+        If the response contains no such block, the full response is
+        returned (like `prompt`).
+
+        Args:
+            text (str): The text to prompt the model with.
+            block (str): The type of fenced block to wait for.
+            system (str|None): The system prompt for this request, overrides
+                `system_prompt`. Providers that support it cache the system
+                prompt, so it should be the static part of the prompt.
+            timeout (float|None): The maximum number of seconds for the
+                request, including the retries. A request that is still
+                running at the deadline is cancelled (no timeout if None).
+
+        Returns:
+            str: The response up to (and including) the end of the block.
+
+        Raises:
+            ModelError: If the request failed and could not be retried, or
+                the timeout passed.
+        """
+
+        system = self._get_system(system)
+        deadline = deadline_after(timeout)
+        return call_with_retry(
+            lambda: self._read_until_block(
+                text, block, system, self._time_left(deadline),
+            ),
+            self.retry_policy,
+            self.logger,
+            deadline,
+        )
+
+    def prompt_json(
+            self,
+            text: str,
+            schema: dict[str, Any],
+            name: str = 'response',
+            *,
+            system: str | None = None,
+            timeout: float | None = None,
+    ) -> Any | None:
+        """
+        Prompt the language model for a json response that follows the
+        given schema.
+
+        Models that support structured output are constrained to the schema.
+        Otherwise the ```json block is streamed (see `prompt_until_block`).
+        In both cases the json is parsed tolerantly (see `repair_json`), so
+        small mistakes in the response do not need a new request.
+
+        Args:
+            text (str): The text to prompt the model with.
+            schema (dict): The JSON schema of the expected response.
+            name (str): The name of the schema (used by some providers).
+            system (str|None): The system prompt for this request, overrides
+                `system_prompt`. Providers that support it cache the system
+                prompt, so it should be the static part of the prompt.
+            timeout (float|None): The maximum number of seconds for the
+                request, including the retries. A request that is still
+                running at the deadline is cancelled (no timeout if None).
+
+        Returns:
+            Any|None: The parsed json, or None if no json could be recovered
+                from the response.
+
+        Raises:
+            ModelError: If the request failed and could not be retried, or
+                the timeout passed.
+        """
+
+        system = self._get_system(system)
+        deadline = deadline_after(timeout)
+        return call_with_retry(
+            lambda: self._prompt_json(
+                text, schema, name, system, self._time_left(deadline),
+            ),
+            self.retry_policy,
+            self.logger,
+            deadline,
+        )
+
+    def _time_left(self, deadline: float | None) -> float | None:
+        """
+        The timeout of the next request: the seconds until the deadline.
+
+        Raises:
+            ModelError: If the deadline passed.
+        """
+
+        if deadline is None:
+            return None
+
+        time_left = deadline - time.monotonic()
+        if time_left <= 0:
+            raise ModelError(
+                'Deadline exceeded',
+                model_name=self.model_name,
+                status_code=408,
+            )
+        return time_left
+
+    def _prompt_json(
+            self,
+            text: str,
+            schema: dict[str, Any],
+            name: str,
+            system: str | None,
+            timeout: float | None = None,
+    ) -> Any | None:
+        """
+        Send a single request for a json response (without retries).
+
+        Args:
+            text (str): The text to prompt the model with.
+            schema (dict): The JSON schema of the expected response.
+            name (str): The name of the schema.
+            system (str|None): The system prompt.
+            timeout (float|None): The timeout of the request (seconds).
+
+        Returns:
+            Any|None: The parsed json, or None if no json could be recovered.
+
+        Raises:
+            ModelError: If the request failed.
+        """
+
+        return repair_json(
+            self._read_until_block(text, 'json', system, timeout),
+        )
+
+    def _read_until_block(
+            self,
+            text: str,
+            block: Literal['json', 'markdown'],
+            system: str | None,
+            timeout: float | None = None,
+    ) -> str:
+
+        deadline = deadline_after(timeout)
+        scanner = BlockScanner(block)
+        stream = self._prompt_stream(text, system, timeout)
+        try:
+            for chunk in stream:
+                if scanner.feed(chunk):
+                    self.logger.debug(
+                        f'Received complete {block} block, '
+                        'cancelling the stream',
+                    )
+                    break
+                # The timeout of the client is per chunk, not for the
+                # whole stream
+                if deadline is not None and time.monotonic() > deadline:
+                    raise ModelError(
+                        f'Stream timed out after {timeout:.1f}s',
+                        model_name=self.model_name,
+                        status_code=408,
+                        retryable=True,
+                    )
+        finally:
+            # Closing the generator closes the underlying connection
+            stream.close()
+
+        return scanner.text
+
+    def _prompt_stream(
+            self,
+            text: str,
+            system: str | None,
+            timeout: float | None = None,
+    ) -> Generator[str, None, None]:
+        """
+        Send a single streaming request to the model (without retries).
+
+        Models that do not support streaming yield the full response at once.
+
+        Args:
+            text (str): The text to prompt the model with.
+            system (str|None): The system prompt.
+            timeout (float|None): The timeout of the request (seconds).
+
+        Yields:
+            str: The next part of the response.
+
+        Raises:
+            ModelError: If the request failed.
+        """
+
+        yield self._prompt(text, system, timeout)
+
+    @abstractmethod
+    def _prompt(
+            self,
+            text: str,
+            system: str | None,
+            timeout: float | None = None,
+    ) -> str:
+        """
+        Send a single request to the model (without retries).
+
         Args:
             text (str): The text to prompt the model with.
+            system (str|None): The system prompt.
+            timeout (float|None): The timeout of the request (seconds). The
+                request is cancelled when it passes.
 
         Returns:
             str: The response from the model.
+
+        Raises:
+            ModelError: If the request failed.
         """
 
         pass
 
     def __str__(self) -> str:
         return f"{self.__class__.__name__}(model_name='{self.model_name}')"
+
+
+def deadline_after(timeout: float | None) -> float | None:
+    """
+    The deadline (`time.monotonic()`) of a timeout, None if there is none.
+    """
+
+    return time.monotonic() + timeout if timeout is not None else None
@@ -0,0 +1,318 @@
+import threading
+import time
+import uuid
+from abc import ABC
+from abc import abstractmethod
+from collections.abc import Callable
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from typing import NamedTuple
+
+from loguru import logger
+from models.base_model import BaseLanguageModel
+from models.errors import ModelError
+from models.usage import TokenUsage
+
+# Batch jobs finish within 24 hours (the completion window of the providers)
+DEFAULT_BATCH_TIMEOUT = 24 * 60 * 60
+
+
+class BatchRequest(NamedTuple):
+    """
+    A json request of a batch job (see `BaseLanguageModel.prompt_json`).
+    """
+
+    # Identifies the request in the results (letters, digits, `-` and `_`,
+    # at most 64 characters)
+    custom_id: str
+    text: str
+    schema: dict[str, Any]
+    name: str
+    system: str | None = None
+
+
+class BatchResult(NamedTuple):
+    """
+    The result of a request of a batch job.
+    """
+
+    custom_id: str
+    # The parsed json (None if the request failed or no json could be
+    # recovered from the response)
+    response: Any | None
+    error: str | None = None
+    usage: TokenUsage = TokenUsage()
+
+
+class BaseBatchBackend(ABC):
+    """
+    Runs many json requests as one batch job: the requests are submitted at
+    once, the job is polled until it is done and the results are matched to
+    the requests by their custom id.
+
+    Batch jobs of the providers take minutes to hours, but are billed at
+    about half the price and have separate rate limits, so they are meant
+    for offline sweeps (see `benchmark.batch`).
+
+    Usage:
+        backend = model.batch_backend()
+        results = backend.run([BatchRequest('a', text, schema, 'name')])
+        results['a'].response
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        poll_interval: float = 30.0,
+        timeout: float | None = DEFAULT_BATCH_TIMEOUT,
+    ):
+        """
+        Args:
+            model_name (str): The name of the model of the requests.
+            poll_interval (float): The seconds between the status checks.
+            timeout (float|None): Cancel the job if it is not done after
+                this many seconds (no timeout if None).
+        """
+
+        self.model_name = model_name
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.logger = logger.bind(model=model_name)
+
+    @abstractmethod
+    def submit(self, requests: list[BatchRequest]) -> str:
+        """
+        Submit the requests as one batch job.
+
+        Returns:
+            str: The id of the job.
+
+        Raises:
+            ModelError: If the job could not be created.
+        """
+
+        pass
+
+    @abstractmethod
+    def is_done(self, job_id: str) -> bool:
+        """
+        Check if the job has ended (successfully or not).
+        """
+
+        pass
+
+    @abstractmethod
+    def fetch(self, job_id: str) -> list[BatchResult]:
+        """
+        Get the results of an ended job.
+        """
+
+        pass
+
+    @abstractmethod
+    def cancel(self, job_id: str) -> None:
+        """
+        Cancel the job (the finished requests may still be billed).
+        """
+
+        pass
+
+    def run(self, requests: list[BatchRequest]) -> dict[str, BatchResult]:
+        """
+        Submit the requests, wait for the job to end and get the results.
+
+        Args:
+            requests (list[BatchRequest]): The requests (with unique ids).
+
+        Returns:
+            dict[str, BatchResult]: The result of every request by its
+                custom id (with an error if the job has no result for it).
+
+        Raises:
+            ModelError: If the job could not be created, or it did not end
+                within `timeout` (the job is cancelled).
+        """
+
+        if not requests:
+            return {}
+
+        custom_ids = [request.custom_id for request in requests]
+        if len(set(custom_ids)) != len(custom_ids):
+            raise ValueError('The custom ids of the requests must be unique')
+
+        start = time.monotonic()
+        job_id = self.submit(requests)
+        self.logger.info(
+            f'Submitted batch job {job_id} with {len(requests)} requests',
+        )
+
+        while not self.is_done(job_id):
+            elapsed = time.monotonic() - start
+            if self.timeout is not None and elapsed > self.timeout:
+                self.cancel(job_id)
+                raise ModelError(
+                    f'Batch job {job_id} did not end within '
+                    f'{self.timeout:.0f}s',
+                    model_name=self.model_name,
+                    status_code=408,
+                )
+            time.sleep(self.poll_interval)
+
+        results = {result.custom_id: result for result in self.fetch(job_id)}
+        self.logger.info(
+            f'Batch job {job_id} ended after '
+            f'{time.monotonic() - start:.1f}s: '
+            f'{sum(r.error is None for r in results.values())}/'
+            f'{len(requests)} requests succeeded',
+        )
+
+        return {
+            custom_id: results.get(
+                custom_id,
+                BatchResult(custom_id, None, 'No result in the batch job'),
+            )
+            for custom_id in custom_ids
+        }
+
+
+class LocalBatchBackend(BaseBatchBackend):
+    """
+    A simulated batch service: the requests of a job are sent as regular
+    (interactive) requests in the background, so the batch code paths can
+    be used with any model, e.g. with the mock server or recorded models.
+
+    Every request is sent with a new model (the clients are shared, see
+    `models.registry`), so the usage of every request is known.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        model_factory: Callable[[], BaseLanguageModel],
+        workers: int = 8,
+        poll_interval: float = 0.1,
+        timeout: float | None = DEFAULT_BATCH_TIMEOUT,
+    ):
+        """
+        Args:
+            model_name (str): The name of the model of the requests.
+            model_factory (Callable[[], BaseLanguageModel]): Creates the
+                model for a request.
+            workers (int): The number of requests at the same time.
+            poll_interval (float): The seconds between the status checks.
+            timeout (float|None): Cancel the job if it is not done after
+                this many seconds.
+        """
+
+        super().__init__(
+            model_name,
+            poll_interval=poll_interval,
+            timeout=timeout,
+        )
+        self.model_factory = model_factory
+        self.workers = workers
+
+        self._lock = threading.Lock()
+        self._jobs: dict[str, tuple[ThreadPoolExecutor, list[Future]]] = {}
+
+    def _run_request(self, request: BatchRequest) -> BatchResult:
+
+        model = self.model_factory()
+        try:
+            response = model.prompt_json(
+                request.text,
+                request.schema,
+                name=request.name,
+                system=request.system,
+            )
+        except ModelError as e:
+            return BatchResult(request.custom_id, None, str(e), model.usage)
+
+        return BatchResult(request.custom_id, response, None, model.usage)
+
+    def submit(self, requests: list[BatchRequest]) -> str:
+
+        job_id = f'local-{uuid.uuid4().hex}'
+        executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix='batch',
+        )
+        futures = [
+            executor.submit(self._run_request, request) for request in requests
+        ]
+        with self._lock:
+            self._jobs[job_id] = (executor, futures)
+
+        return job_id
+
+    def is_done(self, job_id: str) -> bool:
+
+        with self._lock:
+            _, futures = self._jobs[job_id]
+        return all(future.done() for future in futures)
+
+    def fetch(self, job_id: str) -> list[BatchResult]:
+
+        with self._lock:
+            executor, futures = self._jobs.pop(job_id)
+        executor.shutdown(wait=False)
+
+        return [
+            future.result() for future in futures
+            if not future.cancelled()
+        ]
+
+    def cancel(self, job_id: str) -> None:
+
+        with self._lock:
+            executor, _ = self._jobs.pop(job_id)
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def create_batch_backend(
+    backend: str,
+    model_name: str,
+    model_factory: Callable[[str], BaseLanguageModel],
+    poll_interval: float | None = None,
+) -> BaseBatchBackend:
+    """
+    Create the batch backend for a model.
+
+    Args:
+        backend (str): `provider` for the batch API of the provider of the
+            model (OpenAI and Anthropic), or `local` for the simulated
+            batch service (`LocalBatchBackend`).
+        model_name (str): The name of the model.
+        model_factory (Callable[[str], BaseLanguageModel]): Creates a model
+            from the model name.
+        poll_interval (float|None): The seconds between the status checks
+            (default: the default of the backend).
+
+    Returns:
+        BaseBatchBackend: The backend.
+
+    Raises:
+        ValueError: If the backend is unknown or the model does not support
+            batch jobs.
+    """
+
+    kwargs: dict[str, Any] = (
+        {} if poll_interval is None else {'poll_interval': poll_interval}
+    )
+
+    if backend == 'local':
+        return LocalBatchBackend(
+            model_name, lambda: model_factory(model_name), **kwargs,
+        )
+
+    if backend == 'provider':
+        model = model_factory(model_name)
+        # Only the providers with a batch API implement it
+        if not hasattr(model, 'batch_backend'):
+            raise ValueError(
+                f'{model_name} does not support batch jobs (supported: '
+                'OpenAI and Anthropic models)',
+            )
+        return model.batch_backend(**kwargs)
+
+    raise ValueError(f'Unknown batch backend: {backend}')
@@ -1,4 +1,8 @@
+from typing import Any
+from typing import NoReturn
+
 from models.openai_model import OpenAILanguageModel
+from models.retry import RetryPolicy
 
 
 class DeepseekLanguageModel(OpenAILanguageModel):
@@ -9,7 +13,27 @@ class DeepseekLanguageModel(OpenAILanguageModel):
     inherit from the OpenAILanguageModel.
     """
 
-    def __init__(self, model_name: str, api_key: str):
-        super().__init__(model_name, api_key)
+    def __init__(
+        self,
+        model_name: str,
+        api_key: str,
+        retry_policy: RetryPolicy | None = None,
+        base_url: str = 'https://api.deepseek.com',
+    ):
+        super().__init__(
+            model_name, api_key, retry_policy=retry_policy, base_url=base_url,
+        )
+
+    def _response_format(
+        self,
+        schema: dict[str, Any],
+        name: str,
+    ) -> dict[str, Any]:
+
+        # Deepseek only supports json mode (without a schema)
+        return {'type': 'json_object'}
+
+    def batch_backend(self, *args: Any, **kwargs: Any) -> NoReturn:
 
-        self.client.base_url = 'https://api.deepseek.com'
+        # The OpenAI Batch API is not part of the Deepseek API
+        raise ValueError(f'{self.model_name} does not support batch jobs')
@@ -0,0 +1,45 @@
+RETRYABLE_STATUS_CODES = frozenset({408, 409, 429, 500, 502, 503, 504, 529})
+
+
+class ModelError(Exception):
+    """
+    Error raised by a language model when a request could not be completed.
+
+    Attributes:
+        model_name (str): The name of the model that raised the error.
+        status_code (int|None): The HTTP status code, if there was one.
+        retryable (bool): Whether sending the same request again may succeed
+            (e.g. connection errors, rate limits, server errors).
+    """
+
+    def __init__(
+            self,
+            message: str,
+            *,
+            model_name: str,
+            status_code: int | None = None,
+            retryable: bool = False,
+    ):
+        super().__init__(message)
+
+        self.model_name = model_name
+        self.status_code = status_code
+        self.retryable = retryable
+
+    def __str__(self) -> str:
+        status = f' (status {self.status_code})' if self.status_code else ''
+        return f'{self.model_name}: {self.args[0]}{status}'
+
+
+def is_retryable_status(status_code: int | None) -> bool:
+    """
+    Check if a request that failed with the given status code can be retried.
+
+    Args:
+        status_code (int|None): The HTTP status code of the failed request.
+
+    Returns:
+        bool: True if the request can be retried.
+    """
+
+    return status_code is not None and status_code in RETRYABLE_STATUS_CODES
@@ -1,41 +1,186 @@
-from google import genai
+from collections.abc import Generator
+from typing import Any
+
+import httpx
+from google.genai import errors as genai_errors
 from google.genai import types
 from models.base_model import BaseLanguageModel
+from models.errors import is_retryable_status
+from models.errors import ModelError
+from models.registry import gemini_client
+from models.retry import RetryPolicy
+from utils.json_repair import repair_json
 
 
 class GeminiLanguageModel(BaseLanguageModel):
 
-    def __init__(self, model_name: str, api_key: str):
-        super().__init__(model_name, api_key)
+    def __init__(
+        self,
+        model_name: str,
+        api_key: str,
+        retry_policy: RetryPolicy | None = None,
+    ):
+        """
+        Args:
+            model_name (str): The name of the model.
+            api_key (str): The API key for the model.
+            retry_policy (RetryPolicy|None): How failed requests are retried.
+        """
+        super().__init__(model_name, api_key, retry_policy=retry_policy)
+
+        # Shared by all models with the same key
+        self.client = gemini_client(api_key)
+
+    def _to_model_error(self, error: Exception) -> ModelError:
+
+        if isinstance(error, genai_errors.APIError):
+            return ModelError(
+                str(error),
+                model_name=self.model_name,
+                status_code=error.code,
+                retryable=is_retryable_status(error.code),
+            )
+
+        # Connection errors and timeouts
+        return ModelError(
+            str(error),
+            model_name=self.model_name,
+            retryable=isinstance(error, httpx.TransportError),
+        )
+
+    def _add_usage(
+        self,
+        usage: types.GenerateContentResponseUsageMetadata | None,
+    ) -> None:
+
+        if usage is None:
+            self._record_usage()
+            return
+
+        self._record_usage(
+            input_tokens=usage.prompt_token_count,
+            output_tokens=(
+                (usage.candidates_token_count or 0)
+                + (usage.thoughts_token_count or 0)
+            ),
+            cached_tokens=usage.cached_content_token_count,
+        )
 
-        self.client = genai.Client(api_key=api_key)
+    def _config(
+        self,
+        system: str | None,
+        timeout: float | None = None,
+        **kwargs: Any,
+    ) -> types.GenerateContentConfig:
 
-    def prompt(self, text: str) -> str:
+        if timeout is not None:
+            # The timeout of the request in milliseconds
+            kwargs['http_options'] = types.HttpOptions(
+                timeout=max(1, int(timeout * 1000)),
+            )
+
+        # The system instruction is a stable prefix, which is cached
+        # implicitly by the API
+        return types.GenerateContentConfig(
+            system_instruction=system,
+            **kwargs,
+        )
+
+    def _prompt(
+        self,
+        text: str,
+        system: str | None,
+        timeout: float | None = None,
+    ) -> str:
+
+        self.logger.debug(
+            (
+                f'Prompting {self} with prompt: '
+                f'{system=} {text=}'
+            ),
+        )
 
         try:
-            self.logger.debug(
-                (
-                    f'Prompting {self} with prompt: '
-                    f'{self.system_prompt=} {text=}'
-                ),
+            response = self.client.models.generate_content(
+                model=self.model_name,
+                config=self._config(system, timeout),
+                contents=text,
             )
+        except (genai_errors.APIError, httpx.HTTPError) as e:
+            self.logger.error(f'Error while prompting {self}: {e}')
+            raise self._to_model_error(e) from e
 
+        self._add_usage(response.usage_metadata)
+        if response.text is None:
+            self.logger.warning(
+                'Received unexpected None response from Google',
+            )
+            return ''
+
+        return response.text
+
+    def _prompt_json(
+        self,
+        text: str,
+        schema: dict[str, Any],
+        name: str,
+        system: str | None,
+        timeout: float | None = None,
+    ) -> Any | None:
+
+        self.logger.debug(f'Prompting {self} for json: {system=} {text=}')
+
+        try:
             response = self.client.models.generate_content(
                 model=self.model_name,
-                config=types.GenerateContentConfig(
-                    system_instruction=self.system_prompt,
+                config=self._config(
+                    system,
+                    timeout,
+                    response_mime_type='application/json',
+                    response_schema=schema,
                 ),
                 contents=text,
             )
+        except (genai_errors.APIError, httpx.HTTPError) as e:
+            self.logger.error(f'Error while prompting {self}: {e}')
+            raise self._to_model_error(e) from e
 
-            if response.text is None:
-                self.logger.warning(
-                    'Received unexpected None response from Google',
-                )
-                return ''
+        self._add_usage(response.usage_metadata)
+        if response.text is None:
+            self.logger.warning(
+                'Received unexpected None response from Google',
+            )
+            return None
 
-            return response.text
+        return repair_json(response.text)
 
-        except Exception as e:
-            self.logger.error(f'Error while prompting {self}: {e}')
-            return ''
+    def _prompt_stream(
+        self,
+        text: str,
+        system: str | None,
+        timeout: float | None = None,
+    ) -> Generator[str, None, None]:
+
+        self.logger.debug(f'Streaming prompt to {self}: {system=} {text=}')
+
+        try:
+            stream = self.client.models.generate_content_stream(
+                model=self.model_name,
+                config=self._config(system, timeout),
+                contents=text,
+            )
+            # The usage is sent (cumulative) with the chunks
+            usage = None
+            try:
+                for chunk in stream:
+                    usage = chunk.usage_metadata or usage
+                    if chunk.text:
+                        yield chunk.text
+            finally:
+                self._add_usage(usage)
+                # The stream is a generator, closing it ends the request
+                if hasattr(stream, 'close'):
+                    stream.close()
+        except (genai_errors.APIError, httpx.HTTPError) as e:
+            self.logger.error(f'Error while streaming from {self}: {e}')
+            raise self._to_model_error(e) from e
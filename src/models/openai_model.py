@@ -1,45 +1,355 @@
+import json
+from collections.abc import Generator
+from typing import Any
+
+import openai
 from models.base_model import BaseLanguageModel
-from openai import OpenAI
+from models.batch import BaseBatchBackend
+from models.batch import BatchRequest
+from models.batch import BatchResult
+from models.batch import DEFAULT_BATCH_TIMEOUT
+from models.errors import is_retryable_status
+from models.errors import ModelError
+from models.registry import openai_client
+from models.retry import RetryPolicy
+from models.usage import TokenUsage
+from openai.types import CompletionUsage
+from utils.json_repair import repair_json
+
+
+def _request_timeout(timeout: float | None) -> float | openai.NotGiven:
+    # None would disable the (default) timeout of the client
+    return timeout if timeout is not None else openai.NOT_GIVEN
 
 
 class OpenAILanguageModel(BaseLanguageModel):
 
-    def __init__(self, model_name: str, api_key: str):
-        super().__init__(model_name, api_key)
+    def __init__(
+        self,
+        model_name: str,
+        api_key: str,
+        retry_policy: RetryPolicy | None = None,
+        base_url: str | None = None,
+    ):
+        """
+        Args:
+            model_name (str): The name of the model.
+            api_key (str): The API key.
+            retry_policy (RetryPolicy|None): How failed requests are retried.
+            base_url (str|None): The url of an OpenAI compatible API
+                (default: the OpenAI API, or `OPENAI_BASE_URL`).
+        """
+
+        super().__init__(model_name, api_key, retry_policy=retry_policy)
+
+        # Shared by all models with the same key and url (retries are
+        # handled by BaseLanguageModel)
+        self.client = openai_client(api_key, base_url)
+
+    def _to_model_error(self, error: Exception) -> ModelError:
+
+        if isinstance(error, openai.APIStatusError):
+            return ModelError(
+                str(error),
+                model_name=self.model_name,
+                status_code=error.status_code,
+                retryable=is_retryable_status(error.status_code),
+            )
+
+        # Connection errors and timeouts
+        return ModelError(
+            str(error),
+            model_name=self.model_name,
+            retryable=isinstance(error, openai.APIConnectionError),
+        )
+
+    def _add_usage(self, usage: CompletionUsage | None) -> None:
 
-        self.client = OpenAI(api_key=api_key)
+        if usage is None:
+            self._record_usage()
+            return
 
-    def prompt(
+        details = usage.prompt_tokens_details
+        self._record_usage(
+            input_tokens=usage.prompt_tokens,
+            output_tokens=usage.completion_tokens,
+            cached_tokens=details.cached_tokens if details else 0,
+        )
+
+    def _messages(
         self,
         text: str,
-    ) -> str:
+        system: str | None,
+    ) -> list[dict[str, str]]:
 
+        # The system prompt goes first, so that it is a stable prefix that
+        # is cached automatically by the API (prompt caching)
         prompt = [{'role': 'user', 'content': text}]
-        if self.system_prompt is not None:
+        if system is not None:
             prompt = [
-                {'role': 'system', 'content': self.system_prompt},
+                {'role': 'system', 'content': system},
             ] + prompt
 
+        return prompt
+
+    def _prompt(
+        self,
+        text: str,
+        system: str | None,
+        timeout: float | None = None,
+    ) -> str:
+
+        prompt = self._messages(text, system)
         self.logger.debug(f'Prompting model with: {prompt}')
 
         try:
             response = self.client.chat.completions.create(
                 model=self.model_name,
                 messages=prompt,  # type: ignore
+                timeout=_request_timeout(timeout),
             )
+        except openai.OpenAIError as e:
+            self.logger.error(f'Error while prompting {self}: {e}')
+            raise self._to_model_error(e) from e
 
-            if response.choices and response.choices[0].message:
-                return response.choices[0].message.content or ''
-            else:
-                self.logger.warning(
-                    (
-                        'Received unexpected response format from OpenAI: '
-                        f'{response}'
-                    ),
-                )
-                return ''
+        self._add_usage(response.usage)
+        if response.choices and response.choices[0].message:
+            return response.choices[0].message.content or ''
+
+        self.logger.warning(
+            (
+                'Received unexpected response format from OpenAI: '
+                f'{response}'
+            ),
+        )
+        return ''
+
+    def _response_format(
+        self,
+        schema: dict[str, Any],
+        name: str,
+    ) -> dict[str, Any]:
+
+        return {
+            'type': 'json_schema',
+            'json_schema': {
+                'name': name,
+                'schema': schema,
+                # Strict mode requires all properties to be required
+                'strict': False,
+            },
+        }
+
+    def _prompt_json(
+        self,
+        text: str,
+        schema: dict[str, Any],
+        name: str,
+        system: str | None,
+        timeout: float | None = None,
+    ) -> Any | None:
+
+        prompt = self._messages(text, system)
+        response_format = self._response_format(schema, name)
+        self.logger.debug(f'Prompting model for json with: {prompt}')
+
+        try:
+            response = self.client.chat.completions.create(
+                model=self.model_name,
+                messages=prompt,  # type: ignore
+                response_format=response_format,  # type: ignore
+                timeout=_request_timeout(timeout),
+            )
+        except openai.OpenAIError as e:
+            self.logger.error(f'Error while prompting {self}: {e}')
+            raise self._to_model_error(e) from e
+
+        self._add_usage(response.usage)
+        if not response.choices or not response.choices[0].message:
+            self.logger.warning(
+                f'Received unexpected response format from OpenAI: {response}',
+            )
+            return None
+
+        return repair_json(response.choices[0].message.content or '')
+
+    def batch_backend(
+        self,
+        poll_interval: float = 30.0,
+        timeout: float | None = DEFAULT_BATCH_TIMEOUT,
+    ) -> 'OpenAIBatchBackend':
+        """
+        The batch API for json requests to the model (see `models.batch`).
+        """
+
+        return OpenAIBatchBackend(self, poll_interval, timeout)
+
+    def _prompt_stream(
+        self,
+        text: str,
+        system: str | None,
+        timeout: float | None = None,
+    ) -> Generator[str, None, None]:
+
+        prompt = self._messages(text, system)
+        self.logger.debug(f'Streaming prompt to model: {prompt}')
 
-        except Exception as e:
+        try:
+            stream = self.client.chat.completions.create(
+                model=self.model_name,
+                messages=prompt,  # type: ignore
+                stream=True,
+                # The usage is sent in the last chunk
+                stream_options={'include_usage': True},
+                timeout=_request_timeout(timeout),
+            )
+        except openai.OpenAIError as e:
             self.logger.error(f'Error while prompting {self}: {e}')
-            # TODO: Handle error better?
-            return ''
+            raise self._to_model_error(e) from e
+
+        usage = None
+        try:
+            for chunk in stream:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except openai.OpenAIError as e:
+            self.logger.error(f'Error while streaming from {self}: {e}')
+            raise self._to_model_error(e) from e
+        finally:
+            # The usage is unknown if the stream was cancelled early
+            self._add_usage(usage)
+            stream.close()
+
+
+class OpenAIBatchBackend(BaseBatchBackend):
+    """
+    Batch jobs with the OpenAI Batch API: the requests are uploaded as a
+    jsonl file of chat completion requests (the same requests as
+    `OpenAILanguageModel.prompt_json`).
+    """
+
+    # The statuses of an ended batch
+    ENDED = frozenset({'completed', 'failed', 'expired', 'cancelled'})
+
+    def __init__(
+        self,
+        model: OpenAILanguageModel,
+        poll_interval: float = 30.0,
+        timeout: float | None = DEFAULT_BATCH_TIMEOUT,
+    ):
+        super().__init__(
+            model.model_name, poll_interval=poll_interval, timeout=timeout,
+        )
+        self.model = model
+
+    def _request_line(self, request: BatchRequest) -> str:
+
+        return json.dumps(
+            {
+                'custom_id': request.custom_id,
+                'method': 'POST',
+                'url': '/v1/chat/completions',
+                'body': {
+                    'model': self.model.model_name,
+                    'messages': self.model._messages(
+                        request.text, request.system,
+                    ),
+                    'response_format': self.model._response_format(
+                        request.schema, request.name,
+                    ),
+                },
+            },
+        )
+
+    def _result(self, line: dict[str, Any]) -> BatchResult:
+
+        custom_id = line['custom_id']
+        response = line.get('response') or {}
+        body = response.get('body') or {}
+        if line.get('error') or response.get('status_code') != 200:
+            return BatchResult(
+                custom_id,
+                None,
+                str(
+                    line.get('error') or body.get('error')
+                    or f'status {response.get("status_code")}',
+                ),
+            )
+
+        usage = body.get('usage') or {}
+        details = usage.get('prompt_tokens_details') or {}
+        token_usage = TokenUsage(
+            requests=1,
+            input_tokens=usage.get('prompt_tokens') or 0,
+            output_tokens=usage.get('completion_tokens') or 0,
+            cached_tokens=details.get('cached_tokens') or 0,
+        )
+
+        choices = body.get('choices') or []
+        if not choices or not choices[0].get('message'):
+            return BatchResult(
+                custom_id, None, 'No message in the response', token_usage,
+            )
+
+        content = choices[0]['message'].get('content') or ''
+        return BatchResult(custom_id, repair_json(content), None, token_usage)
+
+    def submit(self, requests: list[BatchRequest]) -> str:
+
+        data = '\n'.join(self._request_line(request) for request in requests)
+        try:
+            batch_file = self.model.client.files.create(
+                file=('batch.jsonl', data.encode('utf-8')),
+                purpose='batch',
+            )
+            batch = self.model.client.batches.create(
+                input_file_id=batch_file.id,
+                endpoint='/v1/chat/completions',
+                completion_window='24h',
+            )
+        except openai.OpenAIError as e:
+            self.logger.error(f'Could not create the batch job: {e}')
+            raise self.model._to_model_error(e) from e
+
+        return batch.id
+
+    def is_done(self, job_id: str) -> bool:
+
+        try:
+            batch = self.model.client.batches.retrieve(job_id)
+        except openai.OpenAIError as e:
+            raise self.model._to_model_error(e) from e
+
+        self.logger.debug(
+            f'Batch job {job_id}: {batch.status} {batch.request_counts}',
+        )
+        return batch.status in self.ENDED
+
+    def fetch(self, job_id: str) -> list[BatchResult]:
+
+        try:
+            batch = self.model.client.batches.retrieve(job_id)
+            # The failed requests are in the error file
+            contents = [
+                self.model.client.files.content(file_id).text
+                for file_id in (batch.output_file_id, batch.error_file_id)
+                if file_id is not None
+            ]
+        except openai.OpenAIError as e:
+            raise self.model._to_model_error(e) from e
+
+        return [
+            self._result(json.loads(line))
+            for content in contents
+            for line in content.splitlines()
+            if line.strip()
+        ]
+
+    def cancel(self, job_id: str) -> None:
+
+        try:
+            self.model.client.batches.cancel(job_id)
+        except openai.OpenAIError as e:
+            self.logger.error(f'Could not cancel batch job {job_id}: {e}')
@@ -0,0 +1,482 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import defaultdict
+from collections.abc import Callable
+from typing import Any
+from typing import Literal
+from typing import NamedTuple
+
+from models.base_model import BaseLanguageModel
+from models.errors import ModelError
+from models.usage import TokenUsage
+
+# The kinds of requests (the public prompt methods)
+Kind = Literal['prompt', 'json', 'json_block', 'markdown_block']
+
+
+class Recording(NamedTuple):
+    """
+    A recorded response (see `RecordingStore`).
+    """
+
+    response: str
+    # Time the request took in the recorded run (seconds)
+    elapsed: float
+    usage: TokenUsage
+    # The error of a failed request (raised again when it is replayed)
+    error: ModelError | None = None
+
+
+def prompt_hash(
+    model_name: str,
+    kind: Kind,
+    text: str,
+    system: str | None,
+    schema: dict[str, Any] | None = None,
+) -> str:
+    """
+    The key of a request: everything that determines the response.
+    """
+
+    data = json.dumps(
+        [model_name, kind, system, text, schema],
+        sort_keys=True,
+        separators=(',', ':'),
+    )
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class RecordingStore:
+    """
+    The recorded responses in an (indexed) sqlite file.
+
+    A response is stored by the hash of its request and the occurrence of
+    the request: the n-th identical request of a run (e.g. the same planning
+    prompt for several plans) gets the n-th recorded response. Failed
+    requests are stored with their error, so the occurrences of a request
+    stay in the order of the recorded run. The prompts and responses are
+    compressed.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path (str): The sqlite file (created if it does not exist).
+        """
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._occurrences: dict[str, int] = defaultdict(int)
+        # The connection is shared by the threads of a benchmark (guarded by
+        # the lock)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+        CREATE TABLE IF NOT EXISTS responses (
+          prompt_hash TEXT NOT NULL,
+          occurrence INT NOT NULL,
+          model_name TEXT NOT NULL,
+          kind TEXT NOT NULL,
+          prompt BLOB NOT NULL,
+          response BLOB NOT NULL,
+          elapsed REAL NOT NULL,
+          input_tokens INT NOT NULL,
+          output_tokens INT NOT NULL,
+          cached_tokens INT NOT NULL,
+          error TEXT,
+          status_code INT,
+          retryable INT NOT NULL DEFAULT 0,
+          PRIMARY KEY (prompt_hash, occurrence)
+        );
+        """)
+        # Files recorded before the errors were stored
+        columns = {
+            row[1] for row in self._conn.execute(
+                'PRAGMA table_info(responses);',
+            )
+        }
+        if 'error' not in columns:
+            self._conn.executescript("""
+            ALTER TABLE responses ADD COLUMN error TEXT;
+            ALTER TABLE responses ADD COLUMN status_code INT;
+            ALTER TABLE responses
+                ADD COLUMN retryable INT NOT NULL DEFAULT 0;
+            """)
+        self._conn.commit()
+
+    def next_occurrence(self, key: str) -> int:
+        """
+        Count a request, returns its occurrence (0 for the first one).
+        """
+
+        with self._lock:
+            occurrence = self._occurrences[key]
+            self._occurrences[key] += 1
+        return occurrence
+
+    def put(
+        self,
+        key: str,
+        occurrence: int,
+        model_name: str,
+        kind: Kind,
+        prompt: str,
+        recording: Recording,
+    ) -> None:
+
+        error = recording.error
+        with self._lock:
+            self._conn.execute(
+                """
+            INSERT OR REPLACE INTO responses VALUES
+                (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+            """, (
+                    key,
+                    occurrence,
+                    model_name,
+                    kind,
+                    zlib.compress(prompt.encode('utf-8')),
+                    zlib.compress(recording.response.encode('utf-8')),
+                    recording.elapsed,
+                    recording.usage.input_tokens,
+                    recording.usage.output_tokens,
+                    recording.usage.cached_tokens,
+                    error.args[0] if error is not None else None,
+                    error.status_code if error is not None else None,
+                    error is not None and error.retryable,
+                ),
+            )
+            self._conn.commit()
+
+    def get(self, key: str, occurrence: int) -> Recording | None:
+        """
+        Get the recorded response of the n-th occurrence of a request (by
+        rank, so a run recorded before the errors were stored, with gaps in
+        the occurrences, is replayed in order). If the request occurred more
+        often than it was recorded, the recorded responses are repeated in
+        order.
+
+        Returns:
+            Recording|None: The response, or None if the request was not
+                recorded.
+        """
+
+        with self._lock:
+            count = self._conn.execute(
+                'SELECT COUNT(*) FROM responses WHERE prompt_hash = ?;',
+                (key,),
+            ).fetchone()[0]
+            if count == 0:
+                return None
+
+            row = self._conn.execute(
+                """
+            SELECT response, elapsed, input_tokens, output_tokens,
+                   cached_tokens, model_name, error, status_code, retryable
+            FROM responses
+            WHERE prompt_hash = ?
+            ORDER BY occurrence
+            LIMIT 1 OFFSET ?;
+            """, (key, occurrence % count),
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        return Recording(
+            response=zlib.decompress(row[0]).decode('utf-8'),
+            elapsed=row[1],
+            usage=TokenUsage(
+                requests=1,
+                input_tokens=row[2],
+                output_tokens=row[3],
+                cached_tokens=row[4],
+            ),
+            error=(
+                ModelError(
+                    row[6],
+                    model_name=row[5],
+                    status_code=row[7],
+                    retryable=bool(row[8]),
+                )
+                if row[6] is not None else None
+            ),
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _encode(kind: Kind, response: Any) -> str:
+    # The json responses are parsed, store them as json
+    return json.dumps(response) if kind == 'json' else response
+
+
+def _decode(kind: Kind, response: str) -> Any:
+    return json.loads(response) if kind == 'json' else response
+
+
+class RecordingLanguageModel(BaseLanguageModel):
+    """
+    Records the requests of a model (with the responses, timing and token
+    usage) in a `RecordingStore`, to replay a run with
+    `ReplayLanguageModel`.
+
+    The requests are sent by the wrapped model (with its retries), the token
+    usage of the wrapped model is added to the usage of this model.
+    """
+
+    def __init__(self, model: BaseLanguageModel, store: RecordingStore):
+        """
+        Args:
+            model (BaseLanguageModel): The model to record.
+            store (RecordingStore): The store for the responses.
+        """
+
+        super().__init__(
+            model.model_name,
+            model.api_key,
+            system_prompt=model.system_prompt,
+            retry_policy=model.retry_policy,
+        )
+        self.model = model
+        self.store = store
+
+    def set_system_prompt(self, text: str) -> None:
+        super().set_system_prompt(text)
+        self.model.set_system_prompt(text)
+
+    def _record(
+        self,
+        kind: Kind,
+        text: str,
+        system: str | None,
+        send: Callable[[], Any],
+        schema: dict[str, Any] | None = None,
+    ) -> Any:
+
+        system = self._get_system(system)
+        key = prompt_hash(self.model_name, kind, text, system, schema)
+        occurrence = self.store.next_occurrence(key)
+
+        # Note: with concurrent requests the usage of other requests of the
+        # wrapped model may be counted for this request
+        usage_before = self.model.usage
+        start = time.perf_counter()
+        response = None
+        error = None
+        try:
+            response = send()
+        except ModelError as e:
+            error = e
+        elapsed = time.perf_counter() - start
+        usage_after = self.model.usage
+
+        usage = TokenUsage(
+            requests=1,
+            input_tokens=usage_after.input_tokens - usage_before.input_tokens,
+            output_tokens=(
+                usage_after.output_tokens - usage_before.output_tokens
+            ),
+            cached_tokens=(
+                usage_after.cached_tokens - usage_before.cached_tokens
+            ),
+        )
+        self._record_usage(
+            usage.input_tokens, usage.output_tokens, usage.cached_tokens,
+        )
+        self.store.put(
+            key,
+            occurrence,
+            self.model_name,
+            kind,
+            text,
+            Recording(
+                _encode(kind, response) if error is None else '',
+                elapsed,
+                usage,
+                error,
+            ),
+        )
+        if error is not None:
+            raise error
+        return response
+
+    def prompt(
+            self,
+            text: str,
+            *,
+            system: str | None = None,
+            timeout: float | None = None,
+    ) -> str:
+
+        return self._record(
+            'prompt', text, system,
+            lambda: self.model.prompt(
+                text, system=self._get_system(system), timeout=timeout,
+            ),
+        )
+
+    def prompt_until_block(
+            self,
+            text: str,
+            block: Literal['json', 'markdown'],
+            *,
+            system: str | None = None,
+            timeout: float | None = None,
+    ) -> str:
+
+        kind: Kind = 'json_block' if block == 'json' else 'markdown_block'
+        return self._record(
+            kind, text, system,
+            lambda: self.model.prompt_until_block(
+                text, block, system=self._get_system(system), timeout=timeout,
+            ),
+        )
+
+    def prompt_json(
+            self,
+            text: str,
+            schema: dict[str, Any],
+            name: str = 'response',
+            *,
+            system: str | None = None,
+            timeout: float | None = None,
+    ) -> Any | None:
+
+        return self._record(
+            'json', text, system,
+            lambda: self.model.prompt_json(
+                text,
+                schema,
+                name,
+                system=self._get_system(system),
+                timeout=timeout,
+            ),
+            schema=schema,
+        )
+
+    def _prompt(
+            self,
+            text: str,
+            system: str | None,
+            timeout: float | None = None,
+    ) -> str:
+
+        return self.model._prompt(text, system, timeout)
+
+
+class ReplayLanguageModel(BaseLanguageModel):
+    """
+    Serves the responses recorded by `RecordingLanguageModel` (no network),
+    so a run can be repeated offline and deterministically.
+
+    The recorded token usage is counted as the usage of this model, so the
+    benchmark costs of a replayed run are those of the recorded run.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        store: RecordingStore,
+        latency_scale: float = 0.0,
+    ):
+        """
+        Args:
+            model_name (str): The name of the recorded model.
+            store (RecordingStore): The recorded responses.
+            latency_scale (float): Sleep for this fraction of the recorded
+                time of each request (0: respond immediately, 1: simulate
+                the recorded latency).
+        """
+
+        super().__init__(model_name, api_key='')
+        self.store = store
+        self.latency_scale = latency_scale
+
+    def _replay(
+        self,
+        kind: Kind,
+        text: str,
+        system: str | None,
+        schema: dict[str, Any] | None = None,
+        timeout: float | None = None,
+    ) -> Any:
+
+        system = self._get_system(system)
+        key = prompt_hash(self.model_name, kind, text, system, schema)
+        recording = self.store.get(key, self.store.next_occurrence(key))
+        if recording is None:
+            raise ModelError(
+                f'No recorded response for the {kind} request {key[:12]}',
+                model_name=self.model_name,
+            )
+
+        if self.latency_scale > 0:
+            latency = recording.elapsed * self.latency_scale
+            if timeout is not None and latency > timeout:
+                time.sleep(timeout)
+                raise ModelError(
+                    f'Request timed out after {timeout:.1f}s',
+                    model_name=self.model_name,
+                    status_code=408,
+                )
+            time.sleep(latency)
+
+        self._record_usage(
+            recording.usage.input_tokens,
+            recording.usage.output_tokens,
+            recording.usage.cached_tokens,
+        )
+        if recording.error is not None:
+            raise recording.error
+        return _decode(kind, recording.response)
+
+    def prompt(
+            self,
+            text: str,
+            *,
+            system: str | None = None,
+            timeout: float | None = None,
+    ) -> str:
+
+        return self._replay('prompt', text, system, timeout=timeout)
+
+    def prompt_until_block(
+            self,
+            text: str,
+            block: Literal['json', 'markdown'],
+            *,
+            system: str | None = None,
+            timeout: float | None = None,
+    ) -> str:
+
+        kind: Kind = 'json_block' if block == 'json' else 'markdown_block'
+        return self._replay(kind, text, system, timeout=timeout)
+
+    def prompt_json(
+            self,
+            text: str,
+            schema: dict[str, Any],
+            name: str = 'response',
+            *,
+            system: str | None = None,
+            timeout: float | None = None,
+    ) -> Any | None:
+
+        return self._replay(
+            'json', text, system, schema=schema, timeout=timeout,
+        )
+
+    def _prompt(
+            self,
+            text: str,
+            system: str | None,
+            timeout: float | None = None,
+    ) -> str:
+
+        return self._replay('prompt', text, system, timeout=timeout)
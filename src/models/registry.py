@@ -0,0 +1,235 @@
+import atexit
+import importlib.util
+import os
+import threading
+from collections.abc import Callable
+from typing import Any
+from typing import NamedTuple
+from typing import TypeVar
+
+import httpx
+from models.base_model import BaseLanguageModel
+from models.retry import RetryPolicy
+
+T = TypeVar('T')
+
+
+class Provider(NamedTuple):
+    """
+    A model provider: the models with a name starting with one of the
+    prefixes are created with the class from the module (imported when the
+    first model of the provider is created).
+    """
+
+    prefixes: tuple[str, ...]
+    module: str
+    class_name: str
+    # The environment variable with the API key
+    api_key_env: str
+
+
+PROVIDERS = (
+    Provider(
+        ('gemini',),
+        'models.gemini_model', 'GeminiLanguageModel', 'GEMINI_API_KEY',
+    ),
+    Provider(
+        ('openai', 'gpt', 'o3', 'o4'),
+        'models.openai_model', 'OpenAILanguageModel', 'OPENAI_API_KEY',
+    ),
+    Provider(
+        ('deepseek',),
+        'models.deepseek_model', 'DeepseekLanguageModel', 'DEEPSEEK_API_KEY',
+    ),
+    Provider(
+        ('anthropic', 'claude'),
+        'models.anthropic_model', 'AnthropicLanguageModel',
+        'ANTHROPIC_API_KEY',
+    ),
+)
+
+# Connection pool of the shared http client: the agents of all puzzles that
+# run at the same time share the connections to a provider
+HTTP_LIMITS = httpx.Limits(
+    max_connections=100,
+    max_keepalive_connections=50,
+    keepalive_expiry=120.0,
+)
+# The providers' SDKs pass their own (per request) timeouts, this is only
+# the fallback
+HTTP_TIMEOUT = httpx.Timeout(600.0, connect=10.0)
+
+_http_client: httpx.Client | None = None
+_clients: dict[tuple[str, ...], Any] = {}
+# Reentrant: creating a client gets the shared http client
+_lock = threading.RLock()
+
+
+def http2_available() -> bool:
+    """
+    Check if HTTP/2 can be used (it requires the optional `h2` package, e.g.
+    `pip install httpx[http2]`).
+    """
+
+    return importlib.util.find_spec('h2') is not None
+
+
+def shared_http_client() -> httpx.Client:
+    """
+    The http client shared by the OpenAI (compatible) and Anthropic clients
+    of the process, with keep-alive connections and HTTP/2 if available (so
+    concurrent requests to a provider share one TLS connection).
+
+    Returns:
+        httpx.Client: The client (closed at exit).
+    """
+
+    global _http_client
+
+    with _lock:
+        if _http_client is None:
+            _http_client = httpx.Client(
+                http2=http2_available(),
+                limits=HTTP_LIMITS,
+                timeout=HTTP_TIMEOUT,
+                follow_redirects=True,
+            )
+            atexit.register(_http_client.close)
+
+        return _http_client
+
+
+def get_client(key: tuple[str, ...], create: Callable[[], T]) -> T:
+    """
+    Get the client for the key, created once per process.
+
+    Args:
+        key (tuple[str, ...]): The provider and everything that configures
+            the client (e.g. the API key and the base url).
+        create (Callable[[], T]): Creates the client.
+
+    Returns:
+        T: The (shared) client.
+    """
+
+    with _lock:
+        if key not in _clients:
+            _clients[key] = create()
+
+        return _clients[key]
+
+
+def openai_client(api_key: str, base_url: str | None = None) -> Any:
+    """
+    The OpenAI client for the API key and base url (also used for OpenAI
+    compatible APIs like Deepseek).
+    """
+
+    from openai import OpenAI
+
+    return get_client(
+        ('openai', api_key, base_url or ''),
+        # Retries are handled by BaseLanguageModel
+        lambda: OpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            max_retries=0,
+            http_client=shared_http_client(),
+        ),
+    )
+
+
+def anthropic_client(api_key: str) -> Any:
+    """
+    The Anthropic client for the API key.
+    """
+
+    from anthropic import Anthropic
+
+    return get_client(
+        ('anthropic', api_key),
+        lambda: Anthropic(
+            api_key=api_key,
+            max_retries=0,
+            http_client=shared_http_client(),
+        ),
+    )
+
+
+def anthropic_vertex_client(project_id: str, region: str) -> Any:
+    """
+    The Anthropic client for Vertex AI in the project and region.
+    """
+
+    from anthropic import AnthropicVertex
+
+    return get_client(
+        ('anthropic-vertex', project_id, region),
+        lambda: AnthropicVertex(
+            project_id=project_id,
+            region=region,
+            max_retries=0,
+            http_client=shared_http_client(),
+        ),
+    )
+
+
+def gemini_client(api_key: str) -> Any:
+    """
+    The Gemini client for the API key.
+
+    Note: the genai SDK creates its own http client (it can not be given
+    one), so only the client (and its connection pool) is shared.
+    """
+
+    from google import genai
+
+    return get_client(
+        ('gemini', api_key), lambda: genai.Client(api_key=api_key),
+    )
+
+
+def create_model(model_name: str) -> BaseLanguageModel:
+    """
+    Create a model by name, with the API key from the environment.
+
+    Only the SDK of the provider of the model is imported. Several comma
+    separated names create a `RoutingLanguageModel` over the models (with
+    the timeout per request from `MODEL_ROUTER_TIMEOUT`, if set). Requests
+    are hedged after `MODEL_HEDGE_AFTER` seconds, if set (see
+    `RetryPolicy.hedge_after`).
+
+    Args:
+        model_name (str): The name of the model, e.g. `gemini-2.0-flash`.
+
+    Returns:
+        BaseLanguageModel: The model.
+
+    Raises:
+        ValueError: If no provider has a model with the name.
+    """
+
+    if ',' in model_name:
+        from models.router import RoutingLanguageModel
+
+        return RoutingLanguageModel(
+            [create_model(name.strip()) for name in model_name.split(',')],
+            timeout=float(os.getenv('MODEL_ROUTER_TIMEOUT') or 0) or None,
+        )
+
+    for provider in PROVIDERS:
+        if model_name.startswith(provider.prefixes):
+            model_class = getattr(
+                importlib.import_module(provider.module), provider.class_name,
+            )
+            return model_class(
+                api_key=os.getenv(provider.api_key_env) or '',
+                model_name=model_name,
+                retry_policy=RetryPolicy(
+                    hedge_after=(
+                        float(os.getenv('MODEL_HEDGE_AFTER') or 0) or None
+                    ),
+                ),
+            )
+
+    raise ValueError(f'Unknown model name: {model_name}')
@@ -0,0 +1,129 @@
+import random
+import time
+from collections.abc import Callable
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from typing import NamedTuple
+from typing import TypeVar
+
+from models.errors import ModelError
+
+T = TypeVar('T')
+
+
+class RetryPolicy(NamedTuple):
+    """
+    Settings for retrying failed model requests.
+
+    Attributes:
+        max_attempts (int): The maximum number of attempts per request
+            (including the first one).
+        base_delay (float): The base delay (seconds) for the exponential
+            backoff between attempts.
+        max_delay (float): The maximum delay (seconds) between attempts.
+        hedge_after (float|None): If set, a second identical request is sent
+            when the first one did not finish within this many seconds. The
+            first response to arrive is used.
+    """
+
+    max_attempts: int = 4
+    base_delay: float = 1.0
+    max_delay: float = 30.0
+    hedge_after: float | None = None
+
+
+def backoff_delay(policy: RetryPolicy, attempt: int) -> float:
+    """
+    Get the delay before the next attempt using exponential backoff with
+    full jitter.
+
+    Args:
+        policy (RetryPolicy): The retry policy.
+        attempt (int): The number of the attempt that failed (starting at 0).
+
+    Returns:
+        float: The delay in seconds.
+    """
+
+    cap = min(policy.max_delay, policy.base_delay * 2 ** attempt)
+    return random.uniform(0, cap)
+
+
+def _hedged_call(fn: Callable[[], T], hedge_after: float) -> T:
+    """
+    Call `fn` and, if it did not finish within `hedge_after` seconds, call it
+    a second time in parallel. Returns the first successful result.
+    """
+
+    executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='hedge')
+    try:
+        first = executor.submit(fn)
+        done, _ = wait({first}, timeout=hedge_after)
+        if done:
+            # The request ended before the hedge was needed (the error of a
+            # failed request is raised)
+            return first.result()
+
+        pending: set[Future[T]] = {first, executor.submit(fn)}
+        first_error: BaseException | None = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                error = future.exception()
+                if error is None:
+                    return future.result()
+                first_error = first_error or error
+
+        assert first_error is not None
+        raise first_error
+    finally:
+        # The slower request is abandoned, not waited for
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def call_with_retry(
+        fn: Callable[[], T],
+        policy: RetryPolicy,
+        logger,
+        deadline: float | None = None,
+) -> T:
+    """
+    Call `fn` and retry it on retryable `ModelError`s.
+
+    Args:
+        fn (Callable): The function performing a single request.
+        policy (RetryPolicy): The retry policy.
+        logger: The (bound) logger to report retries to.
+        deadline (float|None): Do not retry if the next attempt would start
+            after this time (`time.monotonic()`).
+
+    Returns:
+        The result of the first successful call.
+
+    Raises:
+        ModelError: If the error is not retryable or all attempts failed.
+    """
+
+    attempt = 0
+    while True:
+        try:
+            if policy.hedge_after is not None:
+                return _hedged_call(fn, policy.hedge_after)
+            return fn()
+        except ModelError as e:
+            if not e.retryable or attempt + 1 >= policy.max_attempts:
+                raise
+
+            delay = backoff_delay(policy, attempt)
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                logger.warning(f'Request failed ({e}), no time left to retry')
+                raise
+
+            attempt += 1
+            logger.warning(
+                f'Request failed ({e}), retrying '
+                f'{attempt}/{policy.max_attempts - 1} in {delay:.2f}s',
+            )
+            time.sleep(delay)
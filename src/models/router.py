@@ -0,0 +1,407 @@
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any
+from typing import Literal
+from typing import NamedTuple
+from typing import TypeVar
+
+from models.base_model import BaseLanguageModel
+from models.base_model import deadline_after
+from models.errors import ModelError
+from models.retry import call_with_retry
+from models.retry import RetryPolicy
+from models.usage import TokenUsage
+
+T = TypeVar('T')
+
+
+class BackendMetrics(NamedTuple):
+    """
+    The routing metrics of a backend of a `RoutingLanguageModel`.
+    """
+
+    model_name: str
+    # Requests sent to the backend
+    requests: int
+    # Requests that failed (including timeouts)
+    errors: int
+    timeouts: int
+    # Requests for which the backend was the first choice
+    routed: int
+    # Requests the backend got after another backend failed
+    failovers: int
+    # Over the rolling window (None without successful requests)
+    p50: float | None
+    p95: float | None
+    error_rate: float
+    healthy: bool
+
+
+class _BackendStats:
+    """
+    Rolling latencies and outcomes of a backend (guarded by the lock of the
+    router).
+    """
+
+    def __init__(self, window: int):
+
+        self.latencies: deque[float] = deque(maxlen=window)
+        self.outcomes: deque[bool] = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.routed = 0
+        self.failovers = 0
+        self.unhealthy_until = 0.0
+
+    def percentile(self, q: float) -> float | None:
+        """
+        The q-th percentile of the latencies (linear interpolation, like
+        `numpy.percentile`).
+        """
+
+        if not self.latencies:
+            return None
+
+        latencies = sorted(self.latencies)
+        position = (len(latencies) - 1) * q / 100
+        lower = int(position)
+        upper = min(lower + 1, len(latencies) - 1)
+        return latencies[lower] + (
+            (latencies[upper] - latencies[lower]) * (position - lower)
+        )
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return 1 - sum(self.outcomes) / len(self.outcomes)
+
+
+class RoutingLanguageModel(BaseLanguageModel):
+    """
+    Routes every request to the fastest healthy backend of several models
+    (e.g. of different providers), and fails over to the next backend when
+    a request fails or times out.
+
+    The backends are ordered by their rolling median latency (backends
+    without latencies first, so they are measured). A backend is unhealthy
+    for `cooldown` seconds after its error rate over the window exceeds
+    `max_error_rate`; unhealthy backends are only tried after the healthy
+    ones.
+
+    A request is sent to one backend at a time, without the retries of the
+    backend: the retries of the router (`retry_policy`) back off once all
+    backends failed. The token usage of the backends is added to the usage
+    of the router.
+
+    Usage:
+        model = RoutingLanguageModel([gemini, gpt], timeout=60)
+        model.prompt('...')
+        model.metrics()
+    """
+
+    def __init__(
+        self,
+        backends: list[BaseLanguageModel],
+        *,
+        timeout: float | None = None,
+        window: int = 50,
+        max_error_rate: float = 0.5,
+        min_requests: int = 3,
+        cooldown: float = 30.0,
+        retry_policy: RetryPolicy | None = None,
+    ):
+        """
+        Args:
+            backends (list[BaseLanguageModel]): The models to route to, in
+                order of preference (for backends with the same latency).
+            timeout (float|None): Fail over when a request takes longer than
+                this many seconds (the slow request is abandoned).
+            window (int): The number of recent requests of a backend to
+                compute the latencies and the error rate over.
+            max_error_rate (float): The error rate above which a backend is
+                unhealthy.
+            min_requests (int): The minimal number of requests in the window
+                before a backend can be marked unhealthy.
+            cooldown (float): The number of seconds a backend stays
+                unhealthy.
+            retry_policy (RetryPolicy|None): How requests are retried once
+                all backends failed.
+        """
+
+        if not backends:
+            raise ValueError('At least one backend is required')
+
+        super().__init__(
+            'router(' + ','.join(b.model_name for b in backends) + ')',
+            api_key='',
+            retry_policy=retry_policy,
+        )
+        self.backends = backends
+        self.timeout = timeout
+        self.max_error_rate = max_error_rate
+        self.min_requests = min_requests
+        self.cooldown = cooldown
+
+        self._lock = threading.Lock()
+        self._stats = [_BackendStats(window) for _ in backends]
+
+    def set_system_prompt(self, text: str) -> None:
+        super().set_system_prompt(text)
+        for backend in self.backends:
+            backend.set_system_prompt(text)
+
+    def metrics(self) -> list[BackendMetrics]:
+        """
+        The routing metrics of every backend.
+        """
+
+        now = time.monotonic()
+        with self._lock:
+            return [
+                BackendMetrics(
+                    model_name=backend.model_name,
+                    requests=stats.requests,
+                    errors=stats.errors,
+                    timeouts=stats.timeouts,
+                    routed=stats.routed,
+                    failovers=stats.failovers,
+                    p50=stats.percentile(50),
+                    p95=stats.percentile(95),
+                    error_rate=stats.error_rate,
+                    healthy=stats.unhealthy_until <= now,
+                )
+                for backend, stats in zip(self.backends, self._stats)
+            ]
+
+    def _route(self) -> list[int]:
+        """
+        The order in which the backends are tried: healthy before unhealthy,
+        then unmeasured backends, then fastest (median latency) first.
+        Backends that only failed in the window are tried last.
+        """
+
+        def key(i: int) -> tuple[bool, bool, float, int]:
+            stats = self._stats[i]
+            p50 = stats.percentile(50)
+            return (
+                stats.unhealthy_until > now,
+                len(stats.outcomes) > 0,
+                p50 if p50 is not None else float('inf'),
+                i,
+            )
+
+        now = time.monotonic()
+        with self._lock:
+            order = sorted(range(len(self.backends)), key=key)
+            self._stats[order[0]].routed += 1
+        return order
+
+    def _record_result(
+        self,
+        index: int,
+        elapsed: float,
+        error: ModelError | None,
+        timed_out: bool = False,
+        failover: bool = False,
+    ) -> None:
+
+        with self._lock:
+            stats = self._stats[index]
+            stats.requests += 1
+            stats.failovers += failover
+            stats.outcomes.append(error is None)
+            if error is None:
+                stats.latencies.append(elapsed)
+                return
+
+            stats.errors += 1
+            stats.timeouts += timed_out
+            if (
+                len(stats.outcomes) >= self.min_requests and
+                stats.error_rate > self.max_error_rate
+            ):
+                stats.unhealthy_until = time.monotonic() + self.cooldown
+                self.logger.warning(
+                    f'{self.backends[index].model_name} is unhealthy '
+                    f'(error rate {stats.error_rate:.0%}), not routing to it '
+                    f'for {self.cooldown:.0f}s',
+                )
+
+    def _call_backend(
+        self,
+        backend: BaseLanguageModel,
+        fn: Callable[[BaseLanguageModel, float | None], T],
+        timeout: float | None,
+    ) -> T:
+
+        if timeout is None:
+            return fn(backend, None)
+
+        # The backend gets the timeout as well (to cancel the request), the
+        # thread makes sure the failover is not delayed by a backend that
+        # does not respect it
+        executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='route',
+        )
+        try:
+            future = executor.submit(fn, backend, timeout)
+            try:
+                return future.result(timeout=timeout)
+            except FutureTimeoutError:
+                raise ModelError(
+                    f'Request timed out after {timeout:.1f}s',
+                    model_name=backend.model_name,
+                    status_code=408,
+                    retryable=True,
+                ) from None
+        finally:
+            # The timed out request is abandoned, not waited for
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _backend_timeout(self, deadline: float | None) -> float | None:
+
+        time_left = self._time_left(deadline)
+        if time_left is None:
+            return self.timeout
+        if self.timeout is None:
+            return time_left
+        return min(self.timeout, time_left)
+
+    def _failover(
+        self,
+        fn: Callable[[BaseLanguageModel, float | None], T],
+        deadline: float | None = None,
+    ) -> T:
+        """
+        Send a single request (without the retries of the backends) to the
+        backends in the routing order, until one succeeds.
+
+        Raises:
+            ModelError: If all backends failed (retryable if one of the
+                errors was), or the deadline passed.
+        """
+
+        errors: list[ModelError] = []
+        for attempt, index in enumerate(self._route()):
+            backend = self.backends[index]
+            if attempt > 0:
+                self.logger.warning(
+                    f'Failing over to {backend.model_name} ({errors[-1]})',
+                )
+
+            timeout = self._backend_timeout(deadline)
+            usage_before = backend.usage
+            start = time.perf_counter()
+            try:
+                result = self._call_backend(backend, fn, timeout)
+            except ModelError as e:
+                self._record_result(
+                    index,
+                    time.perf_counter() - start,
+                    e,
+                    timed_out=e.status_code == 408,
+                    failover=attempt > 0,
+                )
+                errors.append(e)
+                continue
+
+            self._record_result(
+                index, time.perf_counter() - start, None, failover=attempt > 0,
+            )
+            self._add_usage(usage_before, backend.usage)
+            return result
+
+        raise ModelError(
+            'All backends failed: ' + '; '.join(str(e) for e in errors),
+            model_name=self.model_name,
+            retryable=any(e.retryable for e in errors),
+        )
+
+    def _add_usage(self, before: TokenUsage, after: TokenUsage) -> None:
+
+        # Note: with concurrent requests the usage of other requests of the
+        # backend may be counted for this request
+        self._record_usage(
+            after.input_tokens - before.input_tokens,
+            after.output_tokens - before.output_tokens,
+            after.cached_tokens - before.cached_tokens,
+        )
+
+    def prompt(
+            self,
+            text: str,
+            *,
+            system: str | None = None,
+            timeout: float | None = None,
+    ) -> str:
+
+        system = self._get_system(system)
+        deadline = deadline_after(timeout)
+        return call_with_retry(
+            lambda: self._failover(
+                lambda b, t: b._prompt(text, system, t), deadline,
+            ),
+            self.retry_policy,
+            self.logger,
+            deadline,
+        )
+
+    def prompt_until_block(
+            self,
+            text: str,
+            block: Literal['json', 'markdown'],
+            *,
+            system: str | None = None,
+            timeout: float | None = None,
+    ) -> str:
+
+        system = self._get_system(system)
+        deadline = deadline_after(timeout)
+        return call_with_retry(
+            lambda: self._failover(
+                lambda b, t: b._read_until_block(text, block, system, t),
+                deadline,
+            ),
+            self.retry_policy,
+            self.logger,
+            deadline,
+        )
+
+    def prompt_json(
+            self,
+            text: str,
+            schema: dict[str, Any],
+            name: str = 'response',
+            *,
+            system: str | None = None,
+            timeout: float | None = None,
+    ) -> Any | None:
+
+        system = self._get_system(system)
+        deadline = deadline_after(timeout)
+        return call_with_retry(
+            lambda: self._failover(
+                lambda b, t: b._prompt_json(text, schema, name, system, t),
+                deadline,
+            ),
+            self.retry_policy,
+            self.logger,
+            deadline,
+        )
+
+    def _prompt(
+            self,
+            text: str,
+            system: str | None,
+            timeout: float | None = None,
+    ) -> str:
+
+        return self._failover(
+            lambda b, t: b._prompt(text, system, t), deadline_after(timeout),
+        )
@@ -0,0 +1,25 @@
+from dataclasses import dataclass
+
+
+@dataclass
+class TokenUsage:
+    """
+    Token usage of a language model (summed over all requests).
+
+    Note: for streamed responses that are cancelled early, some providers do
+    not report the usage. These requests are counted, but not their tokens.
+    """
+
+    requests: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    # Input tokens that were read from the provider's prompt cache
+    cached_tokens: int = 0
+
+    def __add__(self, other: 'TokenUsage') -> 'TokenUsage':
+        return TokenUsage(
+            requests=self.requests + other.requests,
+            input_tokens=self.input_tokens + other.input_tokens,
+            output_tokens=self.output_tokens + other.output_tokens,
+            cached_tokens=self.cached_tokens + other.cached_tokens,
+        )
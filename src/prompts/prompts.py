@@ -1,5 +1,7 @@
 import os
 
+from prompts.template import PromptTemplate
+
 
 def _load_prompt_from_file(prompt_name: str) -> str:
     with open(
@@ -12,12 +14,39 @@ def _load_prompt_from_file(prompt_name: str) -> str:
         return f.read()
 
 
+def _load_template(
+    name: str,
+    file_name: str,
+    placeholders: set[str],
+) -> PromptTemplate:
+    return PromptTemplate(
+        name, _load_prompt_from_file(file_name), placeholders,
+    )
+
+
+# The templates are compiled (and their placeholders checked) once, at import
 PROMPTS = {
-    'test': _load_prompt_from_file('test'),
-    'pre_processing': _load_prompt_from_file('pre_processing'),
-    'retreival_rank_solutions': _load_prompt_from_file('retreival_rank_solutions'),  # noqa: E501
-    'planning_step_by_step': _load_prompt_from_file('planning_step_by_step'),
-    'planning_confidence': _load_prompt_from_file('planning_confidence'),
-    'coding': _load_prompt_from_file('coding'),
-    'debug_error': _load_prompt_from_file('debug_error_analysis'),
+    'test': _load_template('test', 'test', set()),
+    'pre_processing': _load_template(
+        'pre_processing', 'pre_processing', {'puzzle'},
+    ),
+    'retreival_rank_solutions': _load_template(
+        'retreival_rank_solutions', 'retreival_rank_solutions',
+        {'json_input'},
+    ),
+    'planning_step_by_step': _load_template(
+        'planning_step_by_step', 'planning_step_by_step', {'json_input'},
+    ),
+    'planning_confidence': _load_template(
+        'planning_confidence', 'planning_confidence', {'json_input'},
+    ),
+    'coding': _load_template('coding', 'coding', {'json_input'}),
+    'debug_error': _load_template(
+        'debug_error', 'debug_error_analysis', {'json_input'},
+    ),
+}
+
+# (static prefix, dynamic suffix) of all prompts (see `PromptTemplate.split`)
+PROMPT_PARTS = {
+    name: template.split() for name, template in PROMPTS.items()
 }
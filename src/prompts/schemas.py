@@ -0,0 +1,76 @@
+"""
+JSON schemas of the responses expected for the prompts in `raw/`.
+
+The schemas are used for the structured output mode of the models
+(see `BaseLanguageModel.prompt_json`). They only use the subset of JSON
+schema that is supported by all providers.
+"""
+from typing import Any
+
+_STRING = {'type': 'string'}
+_STRING_LIST = {'type': 'array', 'items': _STRING}
+
+SCHEMAS: dict[str, dict[str, Any]] = {
+    'pre_processing': {
+        'type': 'object',
+        'properties': {
+            'problem_statement': _STRING,
+            'input_format': _STRING,
+            'output_format': _STRING,
+            'test_cases': {
+                'type': 'array',
+                'items': {
+                    'type': 'object',
+                    'properties': {
+                        'input': _STRING,
+                        'output': _STRING,
+                    },
+                    'required': ['input', 'output'],
+                },
+            },
+            'constraints': _STRING_LIST,
+            'keywords': _STRING_LIST,
+            'underlying_concepts': _STRING_LIST,
+            'technical_plan': _STRING,
+        },
+        'required': [
+            'problem_statement', 'input_format', 'output_format',
+            'test_cases', 'constraints', 'keywords', 'underlying_concepts',
+        ],
+    },
+    'retreival_rank_solutions': {
+        'type': 'object',
+        'properties': {
+            'ranked_solutions': {
+                'type': 'array',
+                'items': {
+                    'type': 'object',
+                    'properties': {
+                        'rank': {'type': 'integer'},
+                        'solution_id': _STRING,
+                        'justification': _STRING,
+                        'plan': _STRING,
+                    },
+                    'required': ['rank', 'solution_id', 'plan'],
+                },
+            },
+            'explanation': _STRING,
+        },
+        'required': ['ranked_solutions'],
+    },
+    'planning_confidence': {
+        'type': 'object',
+        'properties': {
+            'confidence': {'type': 'number'},
+            'explaination': _STRING,
+        },
+        'required': ['confidence'],
+    },
+    'coding': {
+        'type': 'object',
+        'properties': {
+            'code': _STRING,
+        },
+        'required': ['code'],
+    },
+}
@@ -0,0 +1,124 @@
+import hashlib
+import re
+from string import Formatter
+from typing import Any
+
+# First (single brace) placeholder in a template, e.g. `{json_input}`
+_PLACEHOLDER_RE = re.compile(r'(?<!\{)\{(\w+)\}(?!\})')
+
+
+class PromptTemplate:
+    """
+    A prompt template, parsed once into literal text and placeholders.
+
+    The template uses the `str.format` syntax, restricted to plain named
+    placeholders (`{json_input}`) and escaped braces (`{{`). Rendering joins
+    the parsed parts with the values: the values are inserted as is, so
+    large json inputs are not scanned for braces, and a missing value is an
+    error instead of an empty prompt.
+
+    Usage:
+        template = PromptTemplate('coding', 'Solve:\\n{json_input}')
+        template.render(json_input='{"a": 1}')
+    """
+
+    def __init__(
+        self,
+        name: str,
+        text: str,
+        placeholders: set[str] | None = None,
+    ):
+        """
+        Args:
+            name (str): The name of the template (for errors).
+            text (str): The template.
+            placeholders (set[str]|None): The placeholders the template must
+                have (not checked if None).
+
+        Raises:
+            ValueError: If the template is invalid or its placeholders are
+                not the expected ones.
+        """
+
+        self.name = name
+        self.text = text
+        # (literal text, placeholder or None)
+        self._parts: list[tuple[str, str | None]] = []
+
+        try:
+            parsed = list(Formatter().parse(text))
+        except ValueError as e:
+            raise ValueError(f'Invalid prompt template {name}: {e}') from e
+
+        for literal, field, format_spec, conversion in parsed:
+            if field is not None and (
+                not field.isidentifier() or format_spec or conversion
+            ):
+                raise ValueError(
+                    f'Invalid placeholder {{{field}}} in prompt template '
+                    f'{name}, only named placeholders are supported',
+                )
+            self._parts.append((literal, field))
+
+        self.placeholders = frozenset(
+            field for _, field in self._parts if field is not None
+        )
+        if placeholders is not None and self.placeholders != placeholders:
+            raise ValueError(
+                f'Prompt template {name} has the placeholders '
+                f'{sorted(self.placeholders)}, '
+                f'expected {sorted(placeholders)}',
+            )
+
+        # Identifies the template (e.g. in cache keys): changes with the text
+        self.hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def render(self, **values: Any) -> str:
+        """
+        Fill in the placeholders (values of other names are ignored).
+
+        Raises:
+            KeyError: If a placeholder has no value.
+        """
+
+        missing = self.placeholders - values.keys()
+        if missing:
+            raise KeyError(
+                f'Missing values for prompt template {self.name}: '
+                f'{sorted(missing)}',
+            )
+
+        return ''.join(
+            literal + (str(values[field]) if field is not None else '')
+            for literal, field in self._parts
+        )
+
+    def split(self) -> tuple[str, 'PromptTemplate']:
+        """
+        Split the template into a static prefix and a dynamic suffix.
+
+        The prefix is everything before the line of the first placeholder, it
+        does not depend on the input and can be sent as (cached) system
+        prompt. The suffix is still a template that has to be rendered.
+
+        Returns:
+            tuple[str, PromptTemplate]: The static prefix (rendered) and the
+                dynamic suffix.
+        """
+
+        match = _PLACEHOLDER_RE.search(self.text)
+        if match is None:
+            return '', self
+
+        line_start = self.text.rfind('\n', 0, match.start()) + 1
+        static = PromptTemplate(self.name, self.text[:line_start]).render()
+        dynamic = PromptTemplate(
+            self.name, self.text[line_start:], set(self.placeholders),
+        )
+        return static.strip(), dynamic
+
+    def __repr__(self) -> str:
+        return (
+            f'PromptTemplate({self.name!r}, '
+            f'placeholders={sorted(self.placeholders)})'
+        )
@@ -0,0 +1,159 @@
+from typing import Literal
+
+FENCE = '```'
+
+
+class BlockScanner:
+    """
+    Incrementally scans a streamed model response and detects when the first
+    ```json (or ```markdown) block is complete.
+
+    The detection mirrors `extract_json_from_markdown` and
+    `extract_markdown_from_response`, so the text received up to that point
+    contains everything the agents extract from the full response.
+    """
+
+    def __init__(self, block: Literal['json', 'markdown']):
+        """
+        Args:
+            block (str): The type of fenced block to wait for.
+        """
+
+        self.block = block
+        self.opener = f'{FENCE}{block}'
+        self.complete = False
+
+        self._buffer = ''
+        # Position up to which the buffer has been scanned
+        self._pos = 0
+        # Position after the opening fence (None if not found yet)
+        self._content_start: int | None = None
+
+        # Used when the full response is raw json (starts with `{`)
+        self._raw_json: bool | None = None
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+        # Nested code fences inside a markdown block
+        self._nested = 0
+
+    @property
+    def text(self) -> str:
+        """
+        The text received so far. For a raw json response, anything after the
+        closing brace is dropped.
+        """
+
+        if self._raw_json and self.complete:
+            return self._buffer[:self._pos]
+        return self._buffer
+
+    def feed(self, chunk: str) -> bool:
+        """
+        Feed the next chunk of the response.
+
+        Args:
+            chunk (str): The next part of the streamed response.
+
+        Returns:
+            bool: True once the block is complete.
+        """
+
+        if self.complete or not chunk:
+            return self.complete
+
+        self._buffer += chunk
+
+        if self._raw_json is None:
+            if self.block == 'json':
+                self._raw_json = self._buffer.startswith('{')
+            else:
+                self._raw_json = False
+
+        if self._raw_json:
+            self.complete = self._scan_raw_json()
+        elif self.block == 'json':
+            self.complete = self._scan_json_fence()
+        else:
+            self.complete = self._scan_markdown_fence()
+
+        return self.complete
+
+    def _scan_raw_json(self) -> bool:
+
+        while self._pos < len(self._buffer):
+            char = self._buffer[self._pos]
+            self._pos += 1
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in '{[':
+                self._depth += 1
+            elif char in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    return True
+
+        return False
+
+    def _find_opener(self) -> bool:
+
+        if self._content_start is not None:
+            return True
+
+        idx = self._buffer.find(self.opener, self._pos)
+        if idx < 0:
+            # Keep the tail, the opener might be split across chunks
+            self._pos = max(0, len(self._buffer) - len(self.opener))
+            return False
+
+        self._content_start = self._pos = idx + len(self.opener)
+        return True
+
+    def _scan_json_fence(self) -> bool:
+
+        if not self._find_opener():
+            return False
+
+        # The first fence after the opener closes the block
+        idx = self._buffer.find(FENCE, self._pos)
+        if idx < 0:
+            self._pos = max(self._pos, len(self._buffer) - len(FENCE))
+            return False
+
+        return True
+
+    def _scan_markdown_fence(self) -> bool:
+
+        if not self._find_opener():
+            return False
+
+        # Fences are only checked on complete lines: ```lang opens a nested
+        # code block, a bare ``` closes the innermost open block.
+        while True:
+            end = self._buffer.find('\n', self._pos)
+            if end < 0:
+                # Wait for the rest of the line (a closing fence at the very
+                # end of the response is handled by the end of the stream)
+                return False
+
+            line = self._buffer[self._pos:end].strip()
+            self._pos = end + 1
+
+            if not line.startswith(FENCE):
+                continue
+
+            if line == FENCE:
+                if self._nested == 0:
+                    return True
+                self._nested -= 1
+            else:
+                self._nested += 1
@@ -0,0 +1,117 @@
+import ast
+import hashlib
+import io
+import re
+import tokenize
+
+# String literals (kept as is), line comments of common languages (#, //)
+# and whitespace
+_CODE_RE = re.compile(
+    r'(?P<string>"""[\s\S]*?"""|\'\'\'[\s\S]*?\'\'\''
+    r'|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|`(?:\\.|[^`\\])*`)'
+    r'|(?P<comment>(?:#|//)[^\n]*)'
+    r'|(?P<space>\s+)',
+)
+
+# Tokens without meaning for the code (the indentation is kept)
+_SKIPPED_TOKENS = frozenset(
+    {tokenize.COMMENT, tokenize.NL, tokenize.ENCODING, tokenize.ENDMARKER},
+)
+
+
+class _StripDocstrings(ast.NodeTransformer):
+
+    def _strip(self, node: ast.AST) -> ast.AST:
+
+        body = getattr(node, 'body', None)
+        if (
+            body
+            and isinstance(body[0], ast.Expr)
+            and isinstance(body[0].value, ast.Constant)
+            and isinstance(body[0].value.value, str)
+        ):
+            node.body = body[1:] or [ast.Pass()]  # type: ignore[attr-defined]
+        self.generic_visit(node)
+        return node
+
+    visit_Module = _strip
+    visit_FunctionDef = _strip
+    visit_AsyncFunctionDef = _strip
+    visit_ClassDef = _strip
+
+
+def normalize_code(code: str, language: str | None = None) -> str:
+    """
+    Normalize code so that solutions that only differ in formatting,
+    comments or docstrings are the same.
+
+    Python code is normalized through its AST, and Python code that does not
+    parse (e.g. Python 2) through its tokens. Other languages are normalized
+    by removing the line comments and whitespace outside of string literals.
+
+    Args:
+        code (str): The code.
+        language (str|None): The language of the code (if it is not known,
+            the code is normalized as Python if it can be tokenized).
+
+    Returns:
+        str: The normalized code.
+    """
+
+    if language is None or language.lower() == 'python':
+        try:
+            tree = _StripDocstrings().visit(ast.parse(code))
+            return ast.dump(tree, annotate_fields=False)
+        except (SyntaxError, ValueError, RecursionError):
+            pass
+
+        normalized = _normalize_tokens(code)
+        if normalized is not None:
+            return normalized
+
+    return _CODE_RE.sub(lambda match: match.group('string') or '', code)
+
+
+def _normalize_tokens(code: str) -> str | None:
+    """
+    The Python tokens of the code without comments, or None if the code does
+    not consist of Python tokens.
+    """
+
+    parts = []
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(code).readline):
+            if token.type == tokenize.ERRORTOKEN and token.string.strip():
+                return None
+            if token.type in _SKIPPED_TOKENS:
+                continue
+            parts.append(
+                token.string if token.string.strip()
+                else tokenize.tok_name[token.type],
+            )
+    except (tokenize.TokenError, SyntaxError):
+        return None
+
+    return ' '.join(parts)
+
+
+def code_hash(code: str, language: str | None = None) -> str:
+    """
+    Hash of the normalized code (see `normalize_code`).
+    """
+
+    normalized = normalize_code(code, language)
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+def is_python(code: str) -> bool:
+    """
+    Check if the code is (syntactically valid) Python.
+    """
+
+    try:
+        ast.parse(code)
+    except (SyntaxError, ValueError, RecursionError):
+        return False
+
+    return True
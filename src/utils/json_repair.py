@@ -0,0 +1,193 @@
+import json
+from typing import Any
+
+FENCE = '```'
+CLOSERS = {'{': '}', '[': ']'}
+# The last characters of a complete value (or element) in a truncated
+# response, after which the open objects and lists can be closed
+VALUE_ENDS = frozenset('"}],')
+
+
+class JsonRepairer:
+    """
+    Tolerant, incremental JSON parser for model responses.
+
+    Text is fed in chunks (e.g. while streaming). Everything before the first
+    `{` or `[` is skipped and everything after the top level value is closed
+    is ignored. While scanning, common model mistakes are repaired:
+
+    - raw newlines/tabs inside strings are escaped
+    - `//` comments and trailing commas are dropped
+    - a response that was cut off after a complete value is closed (open
+      objects and lists)
+
+    A response cut off inside a string or value (e.g. half of the code or
+    of a plan) is not recovered, it is not a valid answer.
+    """
+
+    def __init__(self):
+
+        self.complete = False
+
+        self._out: list[str] = []
+        self._stack: list[str] = []
+        self._started = False
+        self._in_string = False
+        self._escaped = False
+        self._in_comment = False
+        # Last significant character outside of strings
+        self._last = ''
+
+    def feed(self, chunk: str) -> bool:
+        """
+        Feed the next part of the text.
+
+        Args:
+            chunk (str): The next part of the text.
+
+        Returns:
+            bool: True once the top level value is complete.
+        """
+
+        for char in chunk:
+            if self.complete:
+                break
+            self._feed_char(char)
+
+        return self.complete
+
+    def _feed_char(self, char: str) -> None:
+
+        if not self._started:
+            if char not in CLOSERS:
+                return
+            self._started = True
+
+        if self._in_comment:
+            if char == '\n':
+                self._in_comment = False
+            return
+
+        if self._in_string:
+            self._feed_string_char(char)
+            return
+
+        if char == '"':
+            self._in_string = True
+            self._out.append(char)
+        elif char in CLOSERS:
+            self._stack.append(CLOSERS[char])
+            self._out.append(char)
+        elif char in '}]':
+            if not self._stack or self._stack[-1] != char:
+                # Mismatched closer, ignore it
+                return
+            self._drop_trailing_comma()
+            self._stack.pop()
+            self._out.append(char)
+            if not self._stack:
+                self.complete = True
+        elif char == '/' and self._last == '/':
+            # Start of a `//` comment, remove the first slash
+            self._out.pop()
+            self._in_comment = True
+            self._last = ''
+            return
+        else:
+            self._out.append(char)
+
+        if not char.isspace():
+            self._last = char
+
+    def _feed_string_char(self, char: str) -> None:
+
+        if self._escaped:
+            self._escaped = False
+            self._out.append(char)
+        elif char == '\\':
+            self._escaped = True
+            self._out.append(char)
+        elif char == '"':
+            self._in_string = False
+            self._out.append(char)
+            self._last = char
+        elif char == '\n':
+            self._out.append('\\n')
+        elif char == '\r':
+            self._out.append('\\r')
+        elif char == '\t':
+            self._out.append('\\t')
+        else:
+            self._out.append(char)
+
+    def _drop_trailing_comma(self) -> None:
+
+        idx = len(self._out) - 1
+        while idx >= 0 and self._out[idx].isspace():
+            idx -= 1
+        if idx >= 0 and self._out[idx] == ',':
+            del self._out[idx:]
+
+    def value(self) -> Any | None:
+        """
+        Get the parsed (and repaired) value.
+
+        Returns:
+            Any|None: The parsed value, or None if nothing could be recovered
+                (including a response that was cut off inside a string or
+                value).
+        """
+
+        if not self._started or self.truncated:
+            return None
+
+        text = ''.join(self._out).rstrip()
+        if text.endswith(','):
+            text = text[:-1]
+
+        try:
+            return json.loads(text + ''.join(reversed(self._stack)))
+        except json.JSONDecodeError:
+            return None
+
+    @property
+    def truncated(self) -> bool:
+        """
+        Whether the text ended inside a string or value (the value can not
+        be recovered).
+        """
+
+        return not self.complete and (
+            self._in_string or self._last not in VALUE_ENDS
+        )
+
+
+def repair_json(text: str) -> Any | None:
+    """
+    Parse json from a model response, repairing it where possible.
+
+    If the response contains a ```json block, only that block is parsed.
+
+    Args:
+        text (str): The model response.
+
+    Returns:
+        Any|None: The parsed value, or None if nothing could be recovered.
+    """
+
+    start = text.find(f'{FENCE}json')
+    if start >= 0:
+        text = text[start + len(FENCE) + len('json'):]
+        end = text.find(FENCE)
+        if end >= 0:
+            text = text[:end]
+
+    # Fast path for valid json
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+
+    repairer = JsonRepairer()
+    repairer.feed(text)
+    return repairer.value()
@@ -0,0 +1,162 @@
+import json
+from typing import Any
+from typing import NamedTuple
+
+from utils.tokens import count_tokens
+
+# Default maximum number of tokens of a packed prompt input
+DEFAULT_TOKEN_BUDGET = 12000
+# Example fields in the order in which they are truncated (the plan is the
+# most useful part of an example, so it is truncated last)
+TRUNCATION_ORDER = ('puzzle', 'code', 'plan')
+# Fields are not truncated below this number of tokens
+MIN_FIELD_TOKENS = 64
+
+
+class PackedInput(NamedTuple):
+    """
+    A prompt input (json) packed into a token budget.
+    """
+
+    json_input: str
+    tokens: int
+    # Number of examples that were kept, truncated and dropped
+    examples: int
+    truncated: int
+    dropped: int
+
+
+def to_json(data: Any) -> str:
+    """
+    Compact json (no indentation) for prompts.
+    """
+
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False)
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """
+    Truncate a text to (about) `max_tokens` tokens, keeping the start.
+
+    Args:
+        text (str): The text.
+        max_tokens (int): The maximum number of tokens.
+
+    Returns:
+        str: The text, with a marker if it was truncated.
+    """
+
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return text
+
+    # Cut proportionally to the number of characters, and shrink until the
+    # text fits (the tokens are not spread evenly over the text)
+    length = int(len(text) * max_tokens / tokens)
+    while length > 0 and count_tokens(text[:length]) > max_tokens:
+        length = int(length * 0.9)
+
+    return f'{text[:length]}\n... [truncated {tokens - max_tokens} tokens]'
+
+
+def _example_tokens(example: dict[str, Any]) -> int:
+    return count_tokens(to_json(example))
+
+
+def _fit_example(
+    example: dict[str, Any],
+    max_tokens: int,
+) -> dict[str, Any] | None:
+
+    example = dict(example)
+    for field in TRUNCATION_ORDER:
+        excess = _example_tokens(example) - max_tokens
+        if excess <= 0:
+            return example
+
+        value = example.get(field)
+        if not isinstance(value, str):
+            continue
+
+        # Find the largest size of the field for which the example fits
+        # (the json escapes make the size of the json hard to predict)
+        low, high = MIN_FIELD_TOKENS, count_tokens(value)
+        while low < high:
+            middle = (low + high + 1) // 2
+            example[field] = truncate_tokens(value, middle)
+            if _example_tokens(example) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        example[field] = truncate_tokens(value, low)
+
+    if _example_tokens(example) <= max_tokens:
+        return example
+
+    return None
+
+
+def pack_input(
+    inp: dict[str, Any],
+    token_budget: int | None = DEFAULT_TOKEN_BUDGET,
+    examples_key: str = 'example_solutions',
+) -> PackedInput:
+    """
+    Create the (compact) json input of a prompt within a token budget.
+
+    Only the examples (`examples_key`) are shrunk to fit: the budget that is
+    left after the other fields is split evenly between the examples, and
+    the fields of an example that does not fit are truncated (see
+    `TRUNCATION_ORDER`). If the examples do not fit even when truncated, the
+    last (lowest ranked) examples are dropped.
+
+    Args:
+        inp (dict[str, Any]): The prompt input.
+        token_budget (int|None): The maximum number of tokens (no limit if
+            None).
+        examples_key (str): The key of the list of examples.
+
+    Returns:
+        PackedInput: The packed input.
+    """
+
+    examples = list(inp.get(examples_key) or [])
+    json_input = to_json(inp)
+    tokens = count_tokens(json_input)
+    if token_budget is None or tokens <= token_budget or not examples:
+        return PackedInput(json_input, tokens, len(examples), 0, 0)
+
+    base_tokens = count_tokens(to_json({**inp, examples_key: []}))
+    for n_examples in range(len(examples), 0, -1):
+        # Separators between the examples are not counted, so leave some room
+        example_budget = (token_budget - base_tokens) // n_examples - 1
+        if example_budget <= 0:
+            continue
+
+        packed = []
+        for example in examples[:n_examples]:
+            fitted = _fit_example(example, example_budget)
+            if fitted is None:
+                break
+            packed.append(fitted)
+        else:
+            json_input = to_json({**inp, examples_key: packed})
+            return PackedInput(
+                json_input=json_input,
+                tokens=count_tokens(json_input),
+                examples=n_examples,
+                truncated=sum(
+                    fitted != example
+                    for fitted, example in zip(packed, examples)
+                ),
+                dropped=len(examples) - n_examples,
+            )
+
+    json_input = to_json({**inp, examples_key: []})
+    return PackedInput(
+        json_input=json_input,
+        tokens=count_tokens(json_input),
+        examples=0,
+        truncated=0,
+        dropped=len(examples),
+    )
@@ -0,0 +1,78 @@
+import re
+
+_WORD_RE = re.compile(r'\w+')
+
+
+def _shingles(code: str, size: int = 3) -> set[tuple[str, ...]]:
+
+    words = _WORD_RE.findall(code)
+    if len(words) < size:
+        return {tuple(words)}
+    return {
+        tuple(words[i:i + size]) for i in range(len(words) - size + 1)
+    }
+
+
+def _distance(first: set, second: set) -> float:
+
+    union = first | second
+    if not union:
+        return 0.0
+    return 1.0 - len(first & second) / len(union)
+
+
+def select_diverse(
+    codes: list[str],
+    tokens: list[int],
+    limit: int,
+    token_budget: int | None = None,
+) -> list[int]:
+    """
+    Select diverse solutions within a token budget.
+
+    The selection is greedy: it starts with the smallest solution and then
+    repeatedly adds the solution that is most different (Jaccard distance of
+    the word shingles) from the already selected ones, preferring smaller
+    solutions on ties. Solutions that do not fit in the remaining budget are
+    skipped.
+
+    Args:
+        codes (list[str]): The code of the candidate solutions.
+        tokens (list[int]): The number of tokens of each candidate.
+        limit (int): The maximum number of solutions.
+        token_budget (int|None): The maximum total number of tokens of the
+            selected solutions (no limit if None).
+
+    Returns:
+        list[int]: The indices of the selected solutions.
+    """
+
+    shingles = [_shingles(code) for code in codes]
+    remaining_budget = token_budget
+
+    selected: list[int] = []
+    available = sorted(range(len(codes)), key=lambda i: tokens[i])
+    while available and len(selected) < limit:
+        if remaining_budget is not None:
+            available = [i for i in available if tokens[i] <= remaining_budget]
+            if not available:
+                break
+
+        if not selected:
+            best = available[0]
+        else:
+            # `available` is sorted by size, max keeps the first (smallest)
+            # of equally distant solutions
+            best = max(
+                available,
+                key=lambda i: min(
+                    _distance(shingles[i], shingles[j]) for j in selected
+                ),
+            )
+
+        selected.append(best)
+        available.remove(best)
+        if remaining_budget is not None:
+            remaining_budget -= tokens[best]
+
+    return selected
@@ -0,0 +1,40 @@
+import re
+from functools import lru_cache
+from typing import Any
+
+# Rough token pattern (words, numbers and single punctuation characters),
+# used when tiktoken is not installed
+TOKEN_RE = re.compile(r'\w+|[^\w\s]')
+
+
+@lru_cache(maxsize=1)
+def _get_encoding() -> Any | None:
+
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+
+    return tiktoken.get_encoding('cl100k_base')
+
+
+def count_tokens(text: str) -> int:
+    """
+    Count the tokens of a text.
+
+    Uses tiktoken (cl100k_base) if it is installed, otherwise the tokens are
+    estimated. The count is only used for budgeting, so it does not have to
+    match the tokenizer of the model exactly.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        int: The number of tokens.
+    """
+
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+
+    return len(TOKEN_RE.findall(text))
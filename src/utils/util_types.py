@@ -34,3 +34,13 @@ class AgentSettings(NamedTuple):
 
     enabled: bool
     can_debug: bool
+
+
+class PromptParts(NamedTuple):
+    """
+    A prompt split into the static system prompt (the same for every call,
+    so it can be cached by the provider) and the dynamic user prompt.
+    """
+
+    system: str | None
+    user: str
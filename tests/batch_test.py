@@ -0,0 +1,119 @@
+import threading
+
+import pytest
+from models.batch import BaseBatchBackend
+from models.batch import BatchRequest
+from models.batch import create_batch_backend
+from models.batch import LocalBatchBackend
+from models.errors import ModelError
+
+SCHEMA = {'type': 'object'}
+
+
+def _answer(text):
+    if text == 'fail':
+        raise ModelError('bad request', model_name='scripted')
+    return f'{{"text": "{text}"}}'
+
+
+def _request(custom_id, text=None):
+    return BatchRequest(custom_id, text or custom_id, SCHEMA, 'response')
+
+
+def test_local_backend_results_by_id(scripted_model):
+    backend = LocalBatchBackend(
+        'scripted', lambda: scripted_model({'unknown': _answer}),
+        poll_interval=0.01,
+    )
+
+    results = backend.run(
+        [_request('a'), _request('b'), _request('c', 'fail')],
+    )
+
+    assert list(results) == ['a', 'b', 'c']
+    assert results['a'].response == {'text': 'a'}
+    assert results['b'].response == {'text': 'b'}
+    assert results['a'].usage.requests == 1
+    # A failed request does not fail the job
+    assert results['c'].response is None
+    assert 'bad request' in results['c'].error
+
+
+def test_empty_and_duplicate_requests(scripted_model):
+    backend = LocalBatchBackend('scripted', lambda: scripted_model({}))
+
+    assert backend.run([]) == {}
+    with pytest.raises(ValueError, match='unique'):
+        backend.run([_request('a'), _request('a')])
+
+
+class _StuckBackend(BaseBatchBackend):
+
+    def __init__(self, results=None, **kwargs):
+        super().__init__('stuck', **kwargs)
+        self.results = results
+        self.cancelled = []
+
+    def submit(self, requests):
+        return 'job'
+
+    def is_done(self, job_id):
+        return self.results is not None
+
+    def fetch(self, job_id):
+        return self.results
+
+    def cancel(self, job_id):
+        self.cancelled.append(job_id)
+
+
+def test_job_is_cancelled_after_the_timeout():
+    backend = _StuckBackend(poll_interval=0.01, timeout=0.03)
+
+    with pytest.raises(ModelError) as e:
+        backend.run([_request('a')])
+
+    assert e.value.status_code == 408
+    assert backend.cancelled == ['job']
+
+
+def test_missing_results_are_errors():
+    backend = _StuckBackend(results=[])
+
+    result = backend.run([_request('a')])['a']
+
+    assert result.response is None
+    assert result.error == 'No result in the batch job'
+
+
+def test_local_cancel_skips_pending_requests(scripted_model):
+    release = threading.Event()
+
+    def blocked(text):
+        release.wait(1)
+        return '{}'
+
+    backend = LocalBatchBackend(
+        'scripted', lambda: scripted_model({'unknown': blocked}),
+        workers=1, poll_interval=0.01, timeout=0.05,
+    )
+
+    with pytest.raises(ModelError):
+        backend.run([_request('a'), _request('b')])
+    release.set()
+    assert backend._jobs == {}
+
+
+def test_create_batch_backend(scripted_model):
+
+    def factory(model_name):
+        return scripted_model({}, model_name)
+
+    local = create_batch_backend('local', 'model', factory, poll_interval=1)
+    assert isinstance(local, LocalBatchBackend)
+    assert (local.model_name, local.poll_interval) == ('model', 1)
+
+    with pytest.raises(ValueError, match='does not support batch jobs'):
+        create_batch_backend('provider', 'model', factory)
+    with pytest.raises(ValueError, match='Unknown batch backend'):
+        create_batch_backend('remote', 'model', factory)
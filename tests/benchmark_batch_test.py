@@ -0,0 +1,34 @@
+from benchmark.batch import _run_batch
+from models.batch import BaseBatchBackend
+from models.batch import BatchRequest
+
+
+class _TimingOutBackend(BaseBatchBackend):
+
+    def __init__(self):
+        super().__init__('model', poll_interval=0.01, timeout=0.02)
+
+    def submit(self, requests):
+        return 'job'
+
+    def is_done(self, job_id):
+        return False
+
+    def fetch(self, job_id):
+        return []
+
+    def cancel(self, job_id):
+        pass
+
+
+def test_failed_job_fails_all_requests():
+    batch = [
+        BatchRequest(custom_id, 'text', {}, 'response')
+        for custom_id in ('0', '1')
+    ]
+
+    results = _run_batch(_TimingOutBackend(), batch)
+
+    assert list(results) == ['0', '1']
+    assert all(result.response is None for result in results.values())
+    assert 'did not end' in results['0'].error
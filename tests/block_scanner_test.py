@@ -0,0 +1,112 @@
+import pytest
+from models.base_model import BaseLanguageModel
+from utils.block_scanner import BlockScanner
+from utils.utils import extract_json_from_markdown
+from utils.utils import extract_markdown_from_response
+
+
+def _feed(scanner: BlockScanner, text: str, size: int) -> int | None:
+    """
+    Feed the text in chunks, returns the number of chunks until the block
+    was complete (None if it was not).
+    """
+
+    for i in range(0, len(text), size):
+        if scanner.feed(text[i:i + size]):
+            return i // size + 1
+    return None
+
+
+@pytest.mark.parametrize('size', [1, 2, 5, 100])
+def test_json_fence(size):
+    text = 'Here:\n```json\n{"code": "a ``` b"}\n```\nAnd more text.'
+    scanner = BlockScanner('json')
+
+    assert _feed(scanner, text, size) is not None
+    assert scanner.complete
+    expected = extract_json_from_markdown(text)
+    assert extract_json_from_markdown(scanner.text) == expected
+
+
+@pytest.mark.parametrize('size', [1, 3, 100])
+def test_raw_json_ignores_braces_in_strings(size):
+    text = '{"a": "}{\\"", "b": [1, {"c": 2}]} trailing'
+    scanner = BlockScanner('json')
+
+    _feed(scanner, text, size)
+
+    assert scanner.complete
+    assert scanner.text == '{"a": "}{\\"", "b": [1, {"c": 2}]}'
+
+
+@pytest.mark.parametrize('size', [1, 4, 100])
+def test_markdown_with_nested_fences(size):
+    text = (
+        '```markdown\n'
+        '1. Parse the grid\n'
+        '```python\n'
+        'grid = open(0).read()\n'
+        '```\n'
+        '2. Count\n'
+        '```\n'
+        'Done'
+    )
+    scanner = BlockScanner('markdown')
+
+    chunks = _feed(scanner, text, size)
+
+    assert scanner.complete
+    # Completed at the closing fence, before the rest of the response
+    assert chunks is not None
+    assert (chunks - 1) * size < text.index('Done')
+    expected = extract_markdown_from_response(text)
+    assert extract_markdown_from_response(scanner.text) == expected
+
+
+def test_opener_split_across_chunks():
+    scanner = BlockScanner('json')
+
+    assert not scanner.feed('text ``')
+    assert not scanner.feed('`js')
+    assert not scanner.feed('on\n{"a": 1}\n`')
+    assert scanner.feed('``')
+
+
+def test_incomplete_block():
+    scanner = BlockScanner('markdown')
+
+    text = '```markdown\n1. Parse\n```python\nx\n```\n'
+
+    assert _feed(scanner, text, 1) is None
+    assert not scanner.complete
+    assert not scanner.feed('')
+
+
+class _StreamingModel(BaseLanguageModel):
+
+    def __init__(self, chunks: list[str]):
+        super().__init__('streaming', 'test')
+        self.chunks = chunks
+        self.sent = 0
+        self.closed = False
+
+    def _prompt(self, text, system, timeout=None):
+        raise NotImplementedError
+
+    def _prompt_stream(self, text, system, timeout=None):
+        try:
+            for chunk in self.chunks:
+                self.sent += 1
+                yield chunk
+        finally:
+            self.closed = True
+
+
+def test_prompt_until_block_stops_the_stream():
+    model = _StreamingModel(['```json\n{"a"', ': 1}\n``', '`\n', 'more'])
+
+    text = model.prompt_until_block('prompt', 'json')
+
+    assert extract_json_from_markdown(text) == ['{"a": 1}']
+    assert model.sent == 3
+    assert model.closed
@@ -0,0 +1,69 @@
+from utils.code_hash import code_hash
+from utils.code_hash import is_python
+from utils.code_hash import normalize_code
+
+
+def test_python_ignores_formatting_comments_and_docstrings():
+    code = 'def f(x):\n    """Doc."""\n    return x + 1  # add one\n'
+    other = '# Part 1\ndef f(x):\n\n    return (x+1)\n'
+
+    assert code_hash(code) == code_hash(other)
+    assert code_hash(code) != code_hash(code.replace('1', '2'))
+
+
+def test_python_keeps_hashes_in_strings():
+    grid = "print(sum(row.count('#') for row in grid))\n"
+
+    assert code_hash(grid) != code_hash(grid.replace('#', '.'))
+
+
+def test_python_2_ignores_comments():
+    code = 'print "#" # the wall\nx = a // b\n'
+
+    assert code_hash(code) == code_hash('print "#"\nx = a // b  # ok\n')
+    assert code_hash(code) != code_hash('print "."\nx = a // b\n')
+    assert code_hash(code) != code_hash('print "#"\nx = a\n')
+
+
+def test_python_2_keeps_the_indentation():
+    code = 'if x:\n    print "a"\n    print "b"\n'
+    dedented = 'if x:\n    print "a"\nprint "b"\n'
+
+    assert code_hash(code) != code_hash(dedented)
+
+
+def test_other_languages_keep_comment_characters_in_strings():
+    code = (
+        'fn main() {\n'
+        '    let wall = "#"; // the wall\n'
+        "    let c = '#';\n"
+        '    let url = "http://x";\n'
+        '}\n'
+    )
+    formatted = (
+        'fn main() { let wall = "#";\n'
+        "let c = '#'; let url = \"http://x\"; }"
+    )
+
+    def rust_hash(code):
+        return code_hash(code, 'rust')
+
+    assert not is_python(code)
+    assert rust_hash(code) == rust_hash(formatted)
+    assert rust_hash(code) != rust_hash(code.replace('"#"', '"."'))
+    assert rust_hash(code) != rust_hash(code.replace("'#'", "'.'"))
+    assert rust_hash(code) != rust_hash(code.replace('x"', 'y"'))
+
+
+def test_other_languages_keep_whitespace_in_strings():
+    code = 'const a = `a  b`; // x\n'
+
+    assert normalize_code(code) == 'consta=`a  b`;'
+    assert normalize_code(code, 'javascript') == 'consta=`a  b`;'
+
+
+def test_unknown_languages_that_are_not_python_tokens():
+    code = "fn f<'a>(s: &'a str) -> usize { s.matches('#').count() }\n"
+
+    assert '#' in normalize_code(code)
+    assert code_hash(code) == code_hash(code.replace(' -> ', '->'))
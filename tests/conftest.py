@@ -0,0 +1,45 @@
+import threading
+from collections.abc import Callable
+
+import pytest
+from models.base_model import BaseLanguageModel
+from prompts.prompts import PROMPT_PARTS
+
+
+class ScriptedModel(BaseLanguageModel):
+    """
+    A model that answers with the responders of the prompts (by the name of
+    the prompt, recognized by its system prompt) and counts the requests.
+    """
+
+    def __init__(
+        self,
+        responders: dict[str, Callable[[str], str]],
+        model_name: str = 'scripted',
+    ):
+        super().__init__(model_name, 'test')
+
+        self.responders = responders
+        self.requests: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _prompt_name(self, system: str | None) -> str:
+
+        for name, (static, _) in PROMPT_PARTS.items():
+            if static and static == system:
+                return name
+        return 'unknown'
+
+    def _prompt(self, text, system, timeout=None):
+
+        name = self._prompt_name(system)
+        with self._lock:
+            self.requests[name] = self.requests.get(name, 0) + 1
+        self._record_usage(input_tokens=1, output_tokens=1)
+
+        return self.responders[name](text)
+
+
+@pytest.fixture
+def scripted_model():
+    return ScriptedModel
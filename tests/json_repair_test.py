@@ -0,0 +1,67 @@
+import pytest
+from utils.json_repair import JsonRepairer
+from utils.json_repair import repair_json
+
+
+@pytest.mark.parametrize(
+    ('text', 'expected'),
+    [
+        ('{"a": 1}', {'a': 1}),
+        ('Sure!\n```json\n{"a": [1, 2]}\n```\nDone.', {'a': [1, 2]}),
+        ('The answer is {"a": 1} as requested.', {'a': 1}),
+        ('{"code": "line 1\nline 2\tend"}', {'code': 'line 1\nline 2\tend'}),
+        ('{"a": 1, // the a\n"b": [1, 2,],}', {'a': 1, 'b': [1, 2]}),
+        ('{"url": "http://x"}', {'url': 'http://x'}),
+        ('{"a": "say \\"hi\\""}', {'a': 'say "hi"'}),
+        ('{"a": 1] }', {'a': 1}),
+    ],
+)
+def test_repairs_common_mistakes(text, expected):
+    assert repair_json(text) == expected
+
+
+@pytest.mark.parametrize(
+    ('text', 'expected'),
+    [
+        ('{"a": {"b": [1, 2]', {'a': {'b': [1, 2]}}),
+        ('{"a": "complete"', {'a': 'complete'}),
+        ('{"a": 1, ', {'a': 1}),
+        ('{"plans": [{"plan": "step 1"}', {'plans': [{'plan': 'step 1'}]}),
+    ],
+)
+def test_closes_responses_cut_off_after_a_value(text, expected):
+    assert repair_json(text) == expected
+
+
+@pytest.mark.parametrize(
+    'text',
+    [
+        '{"code": "print(1',
+        '{"plans": [{"plan": "step 1',
+        '{"a": "x\\',
+        '{"a": 1, "b": tr',
+        '{"a": 1, "b',
+        '{"a": [1, 2',
+        '{"a": [',
+    ],
+)
+def test_rejects_responses_cut_off_inside_a_value(text):
+    repairer = JsonRepairer()
+    repairer.feed(text)
+
+    assert repairer.truncated
+    assert repair_json(text) is None
+
+
+@pytest.mark.parametrize('text', ['', 'no json here', '```json\n```'])
+def test_nothing_to_recover(text):
+    assert repair_json(text) is None
+
+
+def test_incremental_feed_stops_at_the_end_of_the_value():
+    repairer = JsonRepairer()
+
+    assert not repairer.feed('prefix {"a": "}')
+    assert not repairer.feed('", "b": [')
+    assert repairer.feed('1]} trailing {"c": 2}')
+    assert repairer.value() == {'a': '}', 'b': [1]}
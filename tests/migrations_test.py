@@ -0,0 +1,98 @@
+from core import migrations
+from core.migrations import LATEST_VERSION
+from core.migrations import migrate
+from core.migrations import MIGRATIONS
+
+
+class _FakeCursor:
+    """
+    Records the queries and keeps the applied versions in memory.
+    """
+
+    def __init__(self, versions=None, migrated_while_locking=None):
+        # None: no schema_migrations table yet
+        self.versions = versions
+        self.migrated_while_locking = migrated_while_locking
+        self.queries = []
+        self._result = None
+
+    def execute(self, query, params=None):
+        text = query if isinstance(query, str) else repr(query)
+        self.queries.append(text)
+
+        if 'to_regclass' in text:
+            exists = self.versions is not None
+            self._result = ('schema_migrations' if exists else None,)
+        elif 'MAX(version)' in text:
+            self._result = (max(self.versions, default=None),)
+        elif 'pg_advisory_xact_lock' in text:
+            if self.migrated_while_locking is not None:
+                self.versions = list(self.migrated_while_locking)
+        elif 'CREATE TABLE IF NOT EXISTS schema_migrations' in text:
+            if self.versions is None:
+                self.versions = []
+        elif 'INSERT INTO schema_migrations' in text:
+            self.versions.append(params[0])
+
+    def fetchone(self):
+        return self._result
+
+
+def test_versions_are_increasing():
+    versions = [migration.version for migration in MIGRATIONS]
+
+    assert versions == sorted(set(versions))
+    assert versions[0] == 1
+    assert LATEST_VERSION == versions[-1]
+
+
+def test_new_database_applies_all_in_order():
+    cur = _FakeCursor()
+
+    applied = migrate(cur, 3)
+
+    assert applied == [migration.version for migration in MIGRATIONS]
+    assert cur.versions == applied
+    lock = next(
+        i for i, q in enumerate(cur.queries) if 'pg_advisory_xact_lock' in q
+    )
+    first_insert = next(
+        i for i, q in enumerate(cur.queries)
+        if 'INSERT INTO schema_migrations' in q
+    )
+    assert lock < first_insert
+
+
+def test_applies_only_pending_migrations():
+    cur = _FakeCursor(versions=[1, 2, 3])
+
+    assert migrate(cur, 3) == list(range(4, LATEST_VERSION + 1))
+
+
+def test_up_to_date_schema_is_not_locked():
+    cur = _FakeCursor(versions=list(range(1, LATEST_VERSION + 1)))
+
+    assert migrate(cur, 3) == []
+    assert not any('pg_advisory_xact_lock' in q for q in cur.queries)
+
+
+def test_rechecks_the_version_after_the_lock():
+    # Another process migrated while this one waited for the lock
+    cur = _FakeCursor(
+        versions=[1],
+        migrated_while_locking=range(1, LATEST_VERSION + 1),
+    )
+
+    assert migrate(cur, 3) == []
+    assert not any('INSERT INTO schema_migrations' in q for q in cur.queries)
+
+
+def test_schema_ready_marks():
+    key = ('postgresql://test', 'openai')
+    assert not migrations.is_schema_ready(*key)
+
+    migrations.mark_schema_ready(*key)
+    assert migrations.is_schema_ready(*key)
+
+    migrations.drop_schema(_FakeCursor())
+    assert not migrations.is_schema_ready(*key)
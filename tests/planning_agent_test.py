@@ -0,0 +1,84 @@
+import threading
+
+from agents.coding_agent import CodingAgent
+from agents.planning_agent import PlanningAgent
+from core.state import MainState
+from utils.util_types import Puzzle
+
+
+def _state() -> MainState:
+    return MainState(
+        puzzle=Puzzle(description='Count the walls.', solution=None,
+                      year=2024, day=1),
+        problem_statement='Count the # in the grid.',
+    )
+
+
+def _flaky(response: str, failures: int, failure: str = ''):
+    """
+    Answer with `failure` `failures` times before every response (counted
+    per thread).
+    """
+
+    calls = threading.local()
+
+    def respond(text: str) -> str:
+        calls.n = getattr(calls, 'n', 0) + 1
+        return response if calls.n % (failures + 1) == 0 else failure
+
+    return respond
+
+
+PLAN = '```markdown\nCount the walls.\n```'
+CONFIDENCE = '{"confidence": 0.7}'
+CODE = '{"code": "print(1)"}'
+
+
+def test_every_plan_has_its_own_retries(scripted_model):
+    model = scripted_model({
+        'planning_step_by_step': _flaky(PLAN, failures=3),
+        'planning_confidence': lambda text: CONFIDENCE,
+    })
+    agent = PlanningAgent('planning', model=model, n_plans=2)
+
+    state = agent.process(_state())
+
+    assert [plan.plan for plan in state.generated_plans] == [
+        'Count the walls.', 'Count the walls.',
+    ]
+    assert state.selected_plan.confidence == 0.7
+    assert model.requests['planning_step_by_step'] == 8
+
+
+def test_empty_plan_after_the_retries(scripted_model):
+    model = scripted_model({
+        'planning_step_by_step': lambda text: '',
+        'planning_confidence': lambda text: CONFIDENCE,
+    })
+    agent = PlanningAgent('planning', model=model, n_plans=1)
+
+    state = agent.process(_state())
+
+    assert state.generated_plans[0].plan == ''
+    assert model.requests['planning_step_by_step'] == 4
+    assert 'planning_confidence' not in model.requests
+
+
+def test_pipelined_plans_retry_independently(scripted_model):
+    model = scripted_model({
+        'planning_step_by_step': _flaky(PLAN, failures=3),
+        'planning_confidence': lambda text: CONFIDENCE,
+        'coding': _flaky(CODE, failures=2, failure='no json'),
+    })
+    coding_agent = CodingAgent('coding', model=model)
+    agent = PlanningAgent(
+        'planning', model=model, n_plans=3, coding_agent=coding_agent,
+    )
+
+    state = agent.process(_state())
+
+    assert state.selected_plan.plan == 'Count the walls.'
+    assert all(plan.plan for plan in state.generated_plans)
+    assert state.candidate_code == {'Count the walls.': 'print(1)'}
+    assert model.requests['coding'] == 9
+    assert coding_agent.invalid_response_retries == 0
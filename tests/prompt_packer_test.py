@@ -0,0 +1,83 @@
+import json
+
+from utils.prompt_packer import pack_input
+from utils.prompt_packer import to_json
+from utils.prompt_packer import truncate_tokens
+from utils.tokens import count_tokens
+
+
+def _example(size: int) -> dict[str, str]:
+    return {
+        'puzzle': 'word ' * size,
+        'plan': 'step ' * size,
+        'code': 'x = 1\n' * size,
+    }
+
+
+def test_truncate_tokens():
+    text = 'word ' * 1000
+
+    assert truncate_tokens('short', 10) == 'short'
+    truncated = truncate_tokens(text, 100)
+    assert text.startswith(truncated.split('\n...')[0])
+    assert 'truncated' in truncated
+    assert count_tokens(truncated) < count_tokens(text)
+
+
+def test_input_within_the_budget_is_unchanged():
+    inp = {'problem_statement': 'Count', 'example_solutions': [_example(5)]}
+
+    packed = pack_input(inp, token_budget=10000)
+
+    assert packed.json_input == to_json(inp)
+    assert (packed.examples, packed.truncated, packed.dropped) == (1, 0, 0)
+    assert pack_input(inp, token_budget=None).json_input == to_json(inp)
+
+
+def test_examples_are_truncated_to_the_budget():
+    inp = {
+        'problem_statement': 'Count the walls',
+        'example_solutions': [_example(2000), _example(2000)],
+    }
+
+    packed = pack_input(inp, token_budget=3000)
+    examples = json.loads(packed.json_input)['example_solutions']
+
+    assert packed.tokens <= 3000
+    assert (packed.examples, packed.truncated, packed.dropped) == (2, 2, 0)
+    assert json.loads(packed.json_input)['problem_statement'] == (
+        'Count the walls'
+    )
+    # The plan is truncated last
+    for example in examples:
+        assert count_tokens(example['plan']) >= count_tokens(
+            example['puzzle'],
+        )
+
+
+def test_examples_are_dropped_when_they_do_not_fit():
+    inp = {
+        'problem_statement': 'word ' * 100,
+        'example_solutions': [_example(500) for _ in range(5)],
+    }
+
+    packed = pack_input(inp, token_budget=700)
+
+    assert packed.tokens <= 700
+    assert packed.dropped > 0
+    assert packed.examples + packed.dropped == 5
+    assert len(json.loads(packed.json_input)['example_solutions']) == (
+        packed.examples
+    )
+
+
+def test_no_room_for_examples():
+    inp = {
+        'problem_statement': 'word ' * 1000,
+        'example_solutions': [_example(10)],
+    }
+
+    packed = pack_input(inp, token_budget=100)
+
+    assert json.loads(packed.json_input)['example_solutions'] == []
+    assert (packed.examples, packed.dropped) == (0, 1)
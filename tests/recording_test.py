@@ -0,0 +1,54 @@
+import pytest
+from models.errors import ModelError
+from models.recording import prompt_hash
+from models.recording import Recording
+from models.recording import RecordingLanguageModel
+from models.recording import RecordingStore
+from models.recording import ReplayLanguageModel
+from models.usage import TokenUsage
+
+
+def test_replays_failed_requests_in_order(tmp_path, scripted_model):
+    answers = iter(['first', None, 'third'])
+
+    def respond(text):
+        answer = next(answers)
+        if answer is None:
+            raise ModelError('bad request', model_name='scripted')
+        return answer
+
+    store = RecordingStore(str(tmp_path / 'recording.sqlite'))
+    recording = RecordingLanguageModel(
+        scripted_model({'unknown': respond}), store,
+    )
+    assert recording.prompt('hello') == 'first'
+    with pytest.raises(ModelError):
+        recording.prompt('hello')
+    assert recording.prompt('hello') == 'third'
+    store.close()
+
+    replay = ReplayLanguageModel(
+        'scripted', RecordingStore(str(tmp_path / 'recording.sqlite')),
+    )
+    assert replay.prompt('hello') == 'first'
+    with pytest.raises(ModelError, match='bad request') as e:
+        replay.prompt('hello')
+    assert not e.value.retryable
+    assert replay.prompt('hello') == 'third'
+    # Repeated in order when requested more often than recorded
+    assert replay.prompt('hello') == 'first'
+
+
+def test_occurrences_with_gaps_are_replayed_by_rank(tmp_path):
+    store = RecordingStore(str(tmp_path / 'recording.sqlite'))
+    key = prompt_hash('model', 'prompt', 'hello', None)
+    for occurrence in (0, 2):
+        store.put(
+            key, occurrence, 'model', 'prompt', 'hello',
+            Recording(f'response {occurrence}', 0.0, TokenUsage()),
+        )
+
+    assert store.get(key, 0).response == 'response 0'
+    assert store.get(key, 1).response == 'response 2'
+    assert store.get(key, 2).response == 'response 0'
+    assert store.get('unknown', 0) is None
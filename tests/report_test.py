@@ -0,0 +1,25 @@
+import importlib.util
+
+import pytest
+from benchmark.report import check_results_path
+
+
+def test_csv_and_parquet_results_are_supported(monkeypatch):
+    monkeypatch.setattr(
+        importlib.util, 'find_spec', lambda name: object(),
+    )
+
+    check_results_path('results/run.csv')
+    check_results_path('results/run.parquet')
+
+
+def test_unsupported_extension_is_rejected():
+    with pytest.raises(ValueError, match='Unsupported'):
+        check_results_path('results/run.json')
+
+
+def test_parquet_without_engine_is_rejected(monkeypatch):
+    monkeypatch.setattr(importlib.util, 'find_spec', lambda name: None)
+
+    with pytest.raises(ValueError, match='pyarrow'):
+        check_results_path('results/run.parquet')
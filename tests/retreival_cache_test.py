@@ -0,0 +1,46 @@
+from core.retreival_cache import cache_key
+from core.retreival_cache import puzzle_fingerprint
+from core.retreival_cache import RetreivalCache
+
+
+def test_cache_key_ignores_the_order_of_the_parts():
+    assert cache_key(a=1, b=[2, 3]) == cache_key(b=[2, 3], a=1)
+    assert cache_key(a=1) != cache_key(a=2)
+
+
+def test_fingerprint_includes_the_pre_processing_output():
+    base = puzzle_fingerprint(2024, 1, 'description')
+
+    assert base == puzzle_fingerprint(2024, 1, 'description', '', [], [])
+    assert base.startswith('2024-1-')
+    assert base != puzzle_fingerprint(2024, 2, 'description')
+    assert base != puzzle_fingerprint(2024, 1, 'description', 'statement')
+    assert base != puzzle_fingerprint(
+        2024, 1, 'description', keywords=['grid'],
+    )
+    assert base != puzzle_fingerprint(
+        2024, 1, 'description', underlying_concepts=['bfs'],
+    )
+
+
+def test_memory_cache():
+    cache = RetreivalCache()
+
+    assert cache.get('key') is None
+    cache.put('key', [1, 2])
+    assert cache.get('key') == [1, 2]
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_disk_cache_is_shared(tmp_path):
+    RetreivalCache(str(tmp_path)).put('key', {'a': 1})
+
+    cache = RetreivalCache(str(tmp_path))
+    assert cache.get('key') == {'a': 1}
+    assert cache.get('other') is None
+
+
+def test_disk_cache_ignores_corrupt_entries(tmp_path):
+    (tmp_path / 'key.json').write_text('{')
+
+    assert RetreivalCache(str(tmp_path)).get('key') is None
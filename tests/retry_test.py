@@ -0,0 +1,115 @@
+import time
+
+import pytest
+from loguru import logger
+from models.errors import ModelError
+from models.registry import create_model
+from models.retry import _hedged_call
+from models.retry import backoff_delay
+from models.retry import call_with_retry
+from models.retry import RetryPolicy
+
+NO_DELAY = RetryPolicy(max_attempts=3, base_delay=0.0, max_delay=0.0)
+
+
+def _error(retryable: bool = True) -> ModelError:
+    return ModelError('failed', model_name='test', retryable=retryable)
+
+
+class _Calls:
+    """
+    Returns (or raises) the outcomes in order, one per call.
+    """
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def __call__(self):
+        outcome = self.outcomes[self.calls]
+        self.calls += 1
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+
+def test_backoff_delay_is_capped():
+    policy = RetryPolicy(base_delay=1.0, max_delay=5.0)
+    for attempt in range(10):
+        assert 0 <= backoff_delay(policy, attempt) <= 5.0
+
+
+def test_retries_retryable_errors():
+    fn = _Calls(_error(), _error(), 'ok')
+    assert call_with_retry(fn, NO_DELAY, logger) == 'ok'
+    assert fn.calls == 3
+
+
+def test_does_not_retry_non_retryable_errors():
+    fn = _Calls(_error(retryable=False), 'ok')
+    with pytest.raises(ModelError):
+        call_with_retry(fn, NO_DELAY, logger)
+    assert fn.calls == 1
+
+
+def test_stops_after_max_attempts():
+    fn = _Calls(_error(), _error(), _error(), 'ok')
+    with pytest.raises(ModelError):
+        call_with_retry(fn, NO_DELAY, logger)
+    assert fn.calls == 3
+
+
+def test_does_not_retry_after_the_deadline():
+    fn = _Calls(_error(), 'ok')
+    policy = RetryPolicy(base_delay=10.0, max_delay=10.0)
+    with pytest.raises(ModelError):
+        call_with_retry(fn, policy, logger, deadline=time.monotonic())
+    assert fn.calls == 1
+
+
+def test_hedged_call_returns_a_fast_result():
+    assert _hedged_call(lambda: 'ok', 5.0) == 'ok'
+
+
+def test_hedged_call_raises_a_fast_error():
+    with pytest.raises(ModelError):
+        _hedged_call(_Calls(_error()), 5.0)
+
+
+def test_hedged_call_uses_the_first_response():
+    calls = []
+
+    def fn():
+        calls.append(None)
+        if len(calls) == 1:
+            time.sleep(1.0)
+            return 'slow'
+        return 'hedge'
+
+    assert _hedged_call(fn, 0.05) == 'hedge'
+    assert len(calls) == 2
+
+
+def test_hedged_call_raises_when_both_fail():
+
+    def fn():
+        time.sleep(0.1)
+        raise _error()
+
+    with pytest.raises(ModelError):
+        _hedged_call(fn, 0.01)
+
+
+def test_hedged_retries():
+    fn = _Calls(_error(), 'ok')
+    policy = NO_DELAY._replace(hedge_after=5.0)
+    assert call_with_retry(fn, policy, logger) == 'ok'
+
+
+def test_hedge_after_from_the_environment(monkeypatch):
+    monkeypatch.setenv('OPENAI_API_KEY', 'test')
+    monkeypatch.setenv('MODEL_HEDGE_AFTER', '2.5')
+    assert create_model('gpt-4o').retry_policy.hedge_after == 2.5
+
+    monkeypatch.delenv('MODEL_HEDGE_AFTER')
+    assert create_model('gpt-4o').retry_policy.hedge_after is None
@@ -0,0 +1,129 @@
+import time
+
+import pytest
+from models.errors import ModelError
+from models.retry import RetryPolicy
+from models.router import RoutingLanguageModel
+
+NO_RETRY = RetryPolicy(max_attempts=1)
+
+
+def _failing(model_name, retryable=True):
+    def respond(text):
+        raise ModelError(
+            'unavailable', model_name=model_name, status_code=503,
+            retryable=retryable,
+        )
+    return respond
+
+
+def _sleeping(seconds, answer):
+    def respond(text):
+        time.sleep(seconds)
+        return answer
+    return respond
+
+
+def test_fails_over_to_the_next_backend(scripted_model):
+    first = scripted_model({'unknown': _failing('first')}, 'first')
+    second = scripted_model({'unknown': lambda text: 'ok'}, 'second')
+    router = RoutingLanguageModel([first, second], retry_policy=NO_RETRY)
+
+    assert router.prompt('hello') == 'ok'
+
+    first_metrics, second_metrics = router.metrics()
+    assert (first_metrics.errors, first_metrics.routed) == (1, 1)
+    assert (second_metrics.failovers, second_metrics.routed) == (1, 0)
+    # Only the usage of the successful backend is added
+    assert router.usage.input_tokens == 1
+
+
+def test_all_backends_failed(scripted_model):
+    router = RoutingLanguageModel(
+        [
+            scripted_model({'unknown': _failing('a', False)}, 'a'),
+            scripted_model({'unknown': _failing('b', True)}, 'b'),
+        ],
+        retry_policy=NO_RETRY,
+    )
+
+    with pytest.raises(ModelError, match='All backends failed') as e:
+        router.prompt('hello')
+    # Retryable if one of the backends may succeed
+    assert e.value.retryable
+
+
+def test_routes_to_unmeasured_then_fastest(scripted_model):
+    slow = scripted_model({'unknown': _sleeping(0.05, 'slow')}, 'slow')
+    fast = scripted_model({'unknown': _sleeping(0, 'fast')}, 'fast')
+    router = RoutingLanguageModel([slow, fast], retry_policy=NO_RETRY)
+
+    answers = [router.prompt('hello') for _ in range(3)]
+
+    assert answers == ['slow', 'fast', 'fast']
+    assert [m.routed for m in router.metrics()] == [1, 2]
+    assert router.metrics()[0].p50 >= 0.05
+
+
+def test_times_out_and_fails_over(scripted_model):
+    hanging = scripted_model({'unknown': _sleeping(1, 'late')}, 'hanging')
+    backup = scripted_model({'unknown': lambda text: 'ok'}, 'backup')
+    router = RoutingLanguageModel(
+        [hanging, backup], timeout=0.05, retry_policy=NO_RETRY,
+    )
+
+    start = time.monotonic()
+    assert router.prompt('hello') == 'ok'
+    # The hanging request is abandoned, not waited for
+    assert time.monotonic() - start < 0.5
+    assert router.metrics()[0].timeouts == 1
+
+
+def test_unhealthy_backend_is_tried_last(scripted_model):
+    flaky_answers = iter(['ok'])
+
+    def flaky(text):
+        answer = next(flaky_answers, None)
+        if answer is None:
+            raise ModelError('down', model_name='flaky', retryable=True)
+        return answer
+
+    flaky_model = scripted_model({'unknown': flaky}, 'flaky')
+    slow = scripted_model({'unknown': _sleeping(0.05, 'slow')}, 'slow')
+    router = RoutingLanguageModel(
+        [flaky_model, slow], min_requests=2, max_error_rate=0.4,
+        cooldown=60, retry_policy=NO_RETRY,
+    )
+
+    assert router.prompt('hello') == 'ok'
+    # The unmeasured backend is measured
+    assert router.prompt('hello') == 'slow'
+    # flaky is the fastest, fails and fails over to slow
+    assert router.prompt('hello') == 'slow'
+
+    flaky_metrics, slow_metrics = router.metrics()
+    assert not flaky_metrics.healthy
+    assert slow_metrics.healthy
+    assert flaky_metrics.error_rate == 0.5
+    # Not tried anymore while the slow backend works
+    assert router.prompt('hello') == 'slow'
+    assert router.metrics()[0].requests == flaky_metrics.requests
+
+
+def test_unhealthy_backend_recovers_after_cooldown(scripted_model):
+    down = scripted_model({'unknown': _failing('down')}, 'down')
+    up = scripted_model({'unknown': lambda text: 'ok'}, 'up')
+    router = RoutingLanguageModel(
+        [down, up], min_requests=1, cooldown=0.05, retry_policy=NO_RETRY,
+    )
+
+    router.prompt('hello')
+    assert not router.metrics()[0].healthy
+
+    time.sleep(0.06)
+    assert router.metrics()[0].healthy
+
+
+def test_requires_a_backend():
+    with pytest.raises(ValueError):
+        RoutingLanguageModel([])
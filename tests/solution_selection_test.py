@@ -0,0 +1,48 @@
+from core.retreival import select_solutions
+from utils.solution_selection import select_diverse
+
+BFS = (
+    'from collections import deque\n'
+    'queue = deque([start])\nwhile queue: pass'
+)
+BFS_RENAMED = BFS + '\nprint(len(seen))'
+REGEX = 'import re\nprint(sum(int(a) * int(b) for a, b in re.findall(p, s)))'
+
+
+def test_starts_with_the_smallest_solution():
+    assert select_diverse(['a b c', 'a'], [30, 10], limit=1) == [1]
+
+
+def test_prefers_different_solutions():
+    codes = [BFS, BFS_RENAMED, REGEX]
+
+    assert select_diverse(codes, [10, 11, 12], limit=2) == [0, 2]
+
+
+def test_respects_the_token_budget():
+    codes = [BFS, REGEX, BFS_RENAMED]
+
+    assert select_diverse(codes, [10, 50, 11], limit=3, token_budget=25) == [
+        0, 2,
+    ]
+    assert select_diverse(codes, [10, 50, 11], limit=3, token_budget=5) == []
+
+
+def test_limit_and_no_candidates():
+    assert select_diverse([BFS, REGEX], [1, 1], limit=0) == []
+    assert select_diverse([], [], limit=3) == []
+
+
+def test_select_solutions_from_rows():
+    rows = [
+        (BFS, 'a', 'reddit', 1, 'python', 10),
+        (REGEX, 'b', 'github', 2, None, None),
+    ]
+
+    selected = select_solutions(
+        rows, 2024, 3, limit=2, token_budget=None,
+    )
+
+    assert [solution.author for solution in selected] == ['a', 'b']
+    assert selected[1].tokens is not None
+    assert (selected[0].puzzle_year, selected[0].puzzle_day) == (2024, 3)
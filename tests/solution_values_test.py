@@ -0,0 +1,32 @@
+from core.retreival import INSERT_SOLUTION_QUERY
+from core.retreival import solution_values
+from core.retreival import SolutionData
+from utils.code_hash import code_hash
+
+
+def _solution(code: str, language: str | None = None) -> SolutionData:
+    return SolutionData(
+        code=code,
+        author='author',
+        source='reddit',
+        puzzle_day=1,
+        puzzle_year=2024,
+        language=language,
+    )
+
+
+def test_values_match_the_insert_query():
+    values = solution_values(7, _solution('print(1)\n'))
+
+    assert INSERT_SOLUTION_QUERY.count('%s') == len(values)
+    assert values.puzzle_id == 7
+    assert values.code_hash == code_hash('print(1)\n')
+    assert values.language == 'python'
+
+
+def test_the_hash_uses_the_language():
+    code = 'let s = "#"; // wall\n'
+    values = solution_values(7, _solution(code, 'rust'))
+
+    assert values.language == 'rust'
+    assert values.code_hash == code_hash(code, 'rust')
@@ -0,0 +1,67 @@
+import pytest
+from prompts.prompts import PROMPT_PARTS
+from prompts.prompts import PROMPTS
+from prompts.template import PromptTemplate
+
+
+def test_render_matches_format():
+    text = 'Json: {{"a": 1}}\nInput: {json_input}\nAgain: {json_input}'
+    template = PromptTemplate('test', text, {'json_input'})
+
+    assert template.render(json_input='{x}', other=1) == text.format(
+        json_input='{x}',
+    )
+
+
+def test_missing_value():
+    template = PromptTemplate('test', 'Input: {json_input}')
+
+    with pytest.raises(KeyError, match='json_input'):
+        template.render()
+
+
+@pytest.mark.parametrize(
+    'text', ['{0}', '{}', '{a.b}', '{a[0]}', '{a!r}', '{a:>5}', '{a'],
+)
+def test_invalid_placeholders(text):
+    with pytest.raises(ValueError):
+        PromptTemplate('test', text)
+
+
+def test_unexpected_placeholders():
+    with pytest.raises(ValueError, match='expected'):
+        PromptTemplate('test', '{json_input} {other}', {'json_input'})
+
+
+def test_hash_changes_with_the_text():
+    assert PromptTemplate('a', 'x').hash == PromptTemplate('b', 'x').hash
+    assert PromptTemplate('a', 'x').hash != PromptTemplate('a', 'y').hash
+
+
+def test_split_at_the_line_of_the_first_placeholder():
+    template = PromptTemplate(
+        'test', 'You are {{an}} agent.\n\nInput: {json_input}\nEnd',
+    )
+
+    static, dynamic = template.split()
+
+    assert static == 'You are {an} agent.'
+    assert dynamic.render(json_input='x') == 'Input: x\nEnd'
+
+
+def test_split_without_placeholders():
+    template = PromptTemplate('test', 'Static {{only}}')
+
+    assert template.split() == ('', template)
+
+
+@pytest.mark.parametrize('name', sorted(PROMPTS))
+def test_prompt_parts_render_the_full_prompt(name):
+    values = dict.fromkeys(PROMPTS[name].placeholders, '{"a": "b"}')
+    static, dynamic = PROMPT_PARTS[name]
+
+    full = PROMPTS[name].render(**values)
+    parts = dynamic.render(**values)
+
+    assert full.strip().startswith(static)
+    assert full.strip().endswith(parts.strip())